@@ -44,6 +44,11 @@ sudo cp gunicorn.service.example /etc/systemd/system/gunicorn.service
 sudo systemctl daemon-reload
 sudo systemctl restart gunicorn
 sudo systemctl enable gunicorn
+# The stock event stream runs under the ASGI app in its own service
+sudo cp gunicorn-events.service.example /etc/systemd/system/gunicorn-events.service
+sudo systemctl daemon-reload
+sudo systemctl restart gunicorn-events
+sudo systemctl enable gunicorn-events
 
 # === NGINX CONFIGURATION ===
 echo "[6/7] Configuring Nginx..."
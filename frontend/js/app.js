@@ -200,9 +200,11 @@ async function fetchAPI(endpoint, options = {}) {
     }
 }
 
-// Helper function to get all products
-async function getProducts() {
-    return await fetchAPI(API_CONFIG.ENDPOINTS.PRODUCTS);
+// Helper function to get all products, optionally filtered server-side
+// (e.g. { type, search, ordering, fields })
+async function getProducts(params = {}) {
+    const query = new URLSearchParams(params).toString();
+    return await fetchAPI(API_CONFIG.ENDPOINTS.PRODUCTS + (query ? `?${query}` : ''));
 }
 
 // Helper function to get product types
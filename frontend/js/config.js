@@ -10,6 +10,13 @@ const API_CONFIG = {
         STATS: '/products/stats/',
         WASTAGE_STATS: '/products/wastage_stats/',
         SUPPLIERS: '/suppliers/',
-        CLIENTS: '/clients/'
+        CLIENTS: '/clients/',
+        STOCK_EVENTS: '/events/stock/',
+        STOCK_EVENTS_TICKET: '/events/stock/ticket/',
+        SYNC: '/sync/',
+        REPORTS_TIMESERIES: '/reports/timeseries/',
+        REPORTS_CATEGORIES: '/reports/categories/',
+        REPORTS_PRODUCTS: '/reports/products/',
+        LOTS_EXPIRING: '/lots/expiring/'
     }
 }; 
\ No newline at end of file
@@ -10,6 +10,8 @@ document.addEventListener('DOMContentLoaded', async function() {
     try {
         // Initialize dashboard
         await initDashboard();
+        // Keep the totals current as stock moves
+        subscribeToStockEvents();
     } catch (error) {
         console.error('Error initializing dashboard:', error);
         showNotification('Error loading dashboard data', 'danger');
@@ -118,6 +120,74 @@ function formatCurrency(amount) {
     }).format(amount);
 }
 
+// Live stock events. EventSource cannot send the token header, so the
+// stream is opened with a short-lived ticket, and a new one is fetched
+// whenever the connection has to be opened again
+let stockEvents = null;
+let lastStockEventId = null;
+let stockEventFailures = 0;
+let liveRefreshTimer = null;
+
+async function subscribeToStockEvents() {
+    if (!window.EventSource) return;
+    
+    let ticket;
+    try {
+        const response = await fetchAPI(API_CONFIG.ENDPOINTS.STOCK_EVENTS_TICKET, { method: 'POST' });
+        ticket = response && response.ticket;
+    } catch (error) {
+        console.error('Error getting a stock events ticket:', error);
+    }
+    if (!ticket) return;
+    
+    const params = new URLSearchParams({ ticket: ticket });
+    if (lastStockEventId !== null) {
+        params.set('last_event_id', lastStockEventId);
+    }
+    stockEvents = new EventSource(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.STOCK_EVENTS}?${params}`);
+    
+    stockEvents.addEventListener('open', () => {
+        stockEventFailures = 0;
+    });
+    stockEvents.addEventListener('stock', event => {
+        lastStockEventId = event.lastEventId;
+        scheduleLiveRefresh();
+    });
+    stockEvents.addEventListener('reset', event => {
+        lastStockEventId = event.lastEventId;
+        scheduleLiveRefresh();
+    });
+    stockEvents.addEventListener('error', () => {
+        // The browser retries dropped connections itself; a refused one
+        // (expired ticket, server without the event stream) is closed
+        if (stockEvents.readyState !== EventSource.CLOSED) return;
+        stockEventFailures += 1;
+        if (stockEventFailures > 3) {
+            console.error('Stock events unavailable; use the refresh button to update the dashboard');
+            return;
+        }
+        setTimeout(subscribeToStockEvents, 5000 * stockEventFailures);
+    });
+}
+
+// Movements often come in bursts; refresh once they settle
+function scheduleLiveRefresh() {
+    clearTimeout(liveRefreshTimer);
+    liveRefreshTimer = setTimeout(refreshLiveData, 1000);
+}
+
+async function refreshLiveData() {
+    try {
+        const stats = await getInventoryStats();
+        document.getElementById('totalProducts').textContent = stats.total_products || 0;
+        document.getElementById('inventoryValue').textContent = formatCurrency(stats.total_value || 0);
+        document.getElementById('lowStockCount').textContent = stats.low_stock_count || 0;
+        await loadTopProducts();
+    } catch (error) {
+        console.error('Error refreshing dashboard from stock events:', error);
+    }
+}
+
 // Load top products
 async function loadTopProducts() {
     try {
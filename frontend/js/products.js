@@ -40,7 +40,15 @@ async function loadProductTypes() {
 // Load products into table with optional filters
 async function loadProducts(filterType = '', searchQuery = '') {
     try {
-        const products = await getProducts();
+        // Filtering happens in the API
+        const params = {};
+        if (filterType) {
+            params.type = filterType;
+        }
+        if (searchQuery) {
+            params.search = searchQuery;
+        }
+        const filteredProducts = await getProducts(params);
         const tableBody = document.getElementById('productsTable');
         const emptyMessage = document.getElementById('emptyMessage');
         const welcomeMessage = document.getElementById('welcomeMessage');
@@ -48,7 +56,7 @@ async function loadProducts(filterType = '', searchQuery = '') {
         const filterRow = document.querySelector('.row.mb-3');
         
         // Show welcome message if no products exist at all
-        if (products.length === 0) {
+        if (filteredProducts.length === 0 && !filterType && !searchQuery) {
             welcomeMessage.classList.remove('d-none');
             productsTable.classList.add('d-none');
             filterRow.classList.add('d-none');
@@ -59,21 +67,6 @@ async function loadProducts(filterType = '', searchQuery = '') {
             filterRow.classList.remove('d-none');
         }
         
-        // Filter products by type and search query
-        let filteredProducts = products;
-        
-        if (filterType) {
-            filteredProducts = filteredProducts.filter(product => product.type === filterType);
-        }
-        
-        if (searchQuery) {
-            const query = searchQuery.toLowerCase();
-            filteredProducts = filteredProducts.filter(product => 
-                product.name.toLowerCase().includes(query) || 
-                product.sku.toLowerCase().includes(query)
-            );
-        }
-        
         // Show or hide empty message
         if (filteredProducts.length === 0) {
             tableBody.innerHTML = '';
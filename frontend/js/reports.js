@@ -94,8 +94,8 @@ async function initReportsPage() {
         initializeReportFilters(products, suppliers, clients);
         
         // Load charts
-        createTransactionsChart(stockHistory);
-        createCategoryChart(products);
+        createTransactionsChart();
+        createCategoryChart();
         
         // Load stock history table
         loadStockHistoryTable(stockHistory, products);
@@ -233,33 +233,26 @@ async function loadSummaryStats() {
 }
 
 // Create transactions chart (last 30 days)
-function createTransactionsChart(stockHistory) {
-    // Get dates for the last 30 days
-    const dates = [];
+async function createTransactionsChart() {
+    // Get daily totals for the last 30 days, bucketed by the server
     const today = new Date();
+    const start = new Date(today);
+    start.setDate(today.getDate() - 29);
+    const toDateString = date => date.toISOString().split('T')[0];
     
-    for (let i = 29; i >= 0; i--) {
-        const date = new Date(today);
-        date.setDate(today.getDate() - i);
-        dates.push(date.toISOString().split('T')[0]);
+    let series = [];
+    try {
+        const data = await fetchAPI(
+            `${API_CONFIG.ENDPOINTS.REPORTS_TIMESERIES}?interval=day&start_date=${toDateString(start)}&end_date=${toDateString(today)}`
+        );
+        series = data.series;
+    } catch (error) {
+        console.error('Error loading transactions timeseries:', error);
     }
     
-    // Count stock in and stock out for each day
-    const stockInData = Array(30).fill(0);
-    const stockOutData = Array(30).fill(0);
-    
-    stockHistory.forEach(transaction => {
-        const transactionDate = new Date(transaction.date).toISOString().split('T')[0];
-        const dateIndex = dates.indexOf(transactionDate);
-        
-        if (dateIndex !== -1) {
-            if (transaction.type === 'IN') {
-                stockInData[dateIndex] += transaction.quantity;
-            } else {
-                stockOutData[dateIndex] += transaction.quantity;
-            }
-        }
-    });
+    const dates = series.map(bucket => bucket.period);
+    const stockInData = series.map(bucket => bucket.in_quantity);
+    const stockOutData = series.map(bucket => bucket.out_quantity);
     
     // Format dates for display
     const formattedDates = dates.map(date => {
@@ -316,33 +309,29 @@ function createTransactionsChart(stockHistory) {
     });
 }
 
-// Create custom report chart based on filtered data
-function createCustomReportChart(filteredData, startDate, endDate) {
-    // Get all dates between start and end date
-    const dates = [];
-    const start = new Date(startDate);
-    const end = new Date(endDate);
-    
-    for (let date = new Date(start); date <= end; date.setDate(date.getDate() + 1)) {
-        dates.push(date.toISOString().split('T')[0]);
+// Create custom report chart from daily totals bucketed by the server,
+// over the same filters as the report table
+async function createCustomReportChart(reportType, startDate, endDate) {
+    const params = new URLSearchParams({ interval: 'day', report_type: reportType });
+    if (startDate) params.set('start_date', startDate);
+    if (endDate) params.set('end_date', endDate);
+    const filters = { product_id: 'productFilter', supplier_id: 'supplierFilter', client_id: 'clientFilter' };
+    Object.entries(filters).forEach(([param, elementId]) => {
+        const value = document.getElementById(elementId).value;
+        if (value && value !== 'all') params.set(param, value);
+    });
+    
+    let series = [];
+    try {
+        const data = await fetchAPI(`${API_CONFIG.ENDPOINTS.REPORTS_TIMESERIES}?${params}`);
+        series = data.series;
+    } catch (error) {
+        console.error('Error loading custom report timeseries:', error);
     }
     
-    // Count stock in and stock out for each day
-    const stockInData = Array(dates.length).fill(0);
-    const stockOutData = Array(dates.length).fill(0);
-    
-    filteredData.forEach(transaction => {
-        const transactionDate = new Date(transaction.date).toISOString().split('T')[0];
-        const dateIndex = dates.indexOf(transactionDate);
-        
-        if (dateIndex !== -1) {
-            if (transaction.type === 'IN') {
-                stockInData[dateIndex] += transaction.quantity;
-            } else {
-                stockOutData[dateIndex] += transaction.quantity;
-            }
-        }
-    });
+    const dates = series.map(bucket => bucket.period);
+    const stockInData = series.map(bucket => bucket.in_quantity);
+    const stockOutData = series.map(bucket => bucket.out_quantity);
     
     // Format dates for display
     const formattedDates = dates.map(date => {
@@ -405,24 +394,18 @@ function createCustomReportChart(filteredData, startDate, endDate) {
 }
 
 // Create category chart
-function createCategoryChart(products) {
-    // Group products by category and calculate total value
-    const categories = {};
-    
-    products.forEach(product => {
-        const type = product.type;
-        const value = product.quantity * product.buying_price;
-        
-        if (!categories[type]) {
-            categories[type] = 0;
-        }
-        
-        categories[type] += value;
-    });
+async function createCategoryChart() {
+    // Get total stock value per category, grouped by the server
+    let categories = [];
+    try {
+        categories = await fetchAPI(API_CONFIG.ENDPOINTS.REPORTS_CATEGORIES);
+    } catch (error) {
+        console.error('Error loading category breakdown:', error);
+    }
     
     // Prepare data for chart
-    const categoryLabels = Object.keys(categories);
-    const categoryValues = Object.values(categories);
+    const categoryLabels = categories.map(category => category.type);
+    const categoryValues = categories.map(category => Number(category.stock_value));
     
     // Create chart
     const ctx = document.getElementById('categoryChart').getContext('2d');
@@ -626,10 +609,18 @@ async function generateCustomReport() {
         // Sort by date (newest first)
         filteredData.sort((a, b) => new Date(b.date) - new Date(a.date));
         
+        // Product details of every product in one request, instead of one
+        // request per transaction
+        const productsById = {};
+        const analytics = await fetchAPI(API_CONFIG.ENDPOINTS.REPORTS_PRODUCTS);
+        (analytics.products || []).forEach(product => {
+            productsById[product.id] = product;
+        });
+        
         // Enhance transaction data with additional fields
-        const enhancedData = await Promise.all(filteredData.map(async (transaction) => {
+        const enhancedData = filteredData.map(transaction => {
             // Get product details
-            const product = await getProductById(transaction.product);
+            const product = productsById[transaction.product] || { name: '-', sku: '-' };
             
             // Normalize wastage field - check both possible field names
             let wastage = 0;
@@ -676,7 +667,7 @@ async function generateCustomReport() {
                 profit_margin: profitMargin,
                 wastage: wastage // Ensure wastage is normalized
             };
-        }));
+        });
         
         // Display the report results
         displayReportResults(enhancedData, reportType, startDate, endDate);
@@ -864,7 +855,7 @@ function displayReportResults(filteredData, reportType, startDate, endDate) {
     const chartContainer = document.getElementById('customReportChartContainer');
     if (chartContainer && document.getElementById('includeCharts') && document.getElementById('includeCharts').checked) {
         chartContainer.style.display = 'block';
-        createCustomReportChart(filteredData, startDate, endDate);
+        createCustomReportChart(reportType, startDate, endDate);
     } else if (chartContainer) {
         chartContainer.style.display = 'none';
     }
@@ -48,12 +48,10 @@ async function initStockPage() {
 // Load products dropdown
 async function loadProductsDropdown() {
     try {
-        const products = await getProducts();
+        // Only the fields the dropdown shows, sorted by name in the API
+        const products = await getProducts({ fields: 'id,name', ordering: 'name' });
         const productSelect = document.getElementById('product');
         
-        // Sort products by name
-        products.sort((a, b) => a.name.localeCompare(b.name));
-        
         // Generate options
         products.forEach(product => {
             const option = document.createElement('option');
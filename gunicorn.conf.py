@@ -0,0 +1,18 @@
+# Gunicorn settings: gunicorn -c gunicorn.conf.py ims_project.wsgi:application
+import os
+import shutil
+
+
+def on_starting(server):
+    # Request metrics of every worker are written under PROMETHEUS_MULTIPROC_DIR;
+    # files left by the previous run would be added to the new counts
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
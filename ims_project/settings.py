@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'inventory.metrics.RequestMetricsMiddleware',  # First, so its timings cover the rest
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # Add CORS middleware
@@ -54,6 +55,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'inventory.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'ims_project.urls'
@@ -156,6 +158,58 @@ AUTHENTICATION_BACKENDS = [
     'inventory.backends.EmailOrUsernameModelBackend',
 ]
 
+# Server-sent stock events (/api/events/stock/)
+# Only served through the ASGI app (ims_project.asgi); the WSGI app answers 501.
+# Seconds between ledger polls, which pick up movements made by other workers
+STOCK_EVENTS_POLL_INTERVAL = 5
+# Seconds of silence before a keep-alive comment is sent
+STOCK_EVENTS_KEEPALIVE_INTERVAL = 15
+# Resuming clients further behind than this many events get a 'reset' event
+STOCK_EVENTS_MAX_BACKLOG = 1000
+# Seconds a ticket from /api/events/stock/ticket/ can open a stream for
+STOCK_EVENTS_TICKET_MAX_AGE = 60
+
+# Seconds analytics results stay cached; any stock movement invalidates them sooner
+ANALYTICS_CACHE_TIMEOUT = 3600
+
+# Counter slots of each product with sharded stock (see inventory/counters.py).
+# More slots let more movements of one product run at once, but leave each
+# slot a smaller share of the stock, so large OUTs fall back to the product
+# lock sooner.
+STOCK_COUNTER_SLOTS = 8
+
+# Filter reports by supplier/client through the indexed foreign keys only,
+# ignoring legacy free-text names. Enable once resolve_account_refs has
+# linked the old ledger rows.
+REPORTS_STRICT_ACCOUNT_FILTERS = False
+
+# Request metrics, served at /api/metrics/ to staff users. Under gunicorn set
+# the PROMETHEUS_MULTIPROC_DIR environment variable to a directory shared by
+# the workers (see gunicorn.conf.py), so every worker's requests are counted.
+# Requests slower than this many seconds are logged with their slowest queries
+SLOW_REQUEST_THRESHOLD = 1.0
+SLOW_REQUEST_LOGGED_QUERIES = 5
+
+# On-demand request profiling: staff users with the 'Can profile requests'
+# permission add an X-Profile header or ?_profile=1 to a request to have it
+# run under cProfile, with its SQL and EXPLAIN plans, and saved under
+# MEDIA_ROOT/profiles/ (viewable in the admin). Profiles older than this many
+# days, or beyond the newest PROFILE_MAX_COUNT, are deleted.
+PROFILE_RETENTION_DAYS = 7
+PROFILE_MAX_COUNT = 100
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'inventory.metrics': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+        'inventory.profiling': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # Only for development
 
@@ -1,19 +1,297 @@
-from django.contrib import admin
+import csv
+import json
+from datetime import timedelta
+
+from django.contrib import admin, messages
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
-from .models import Product, StockHistory, ProductType, Supplier, Client, StockTransaction
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Max, Min, Q, QuerySet
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from . import counters, product_stats
+from .archive import archive_transactions
+from .models import (
+    Product, StockHistory, ProductType, Supplier, Client, StockTransaction, ArchivedStockTransaction, Lot,
+    RequestProfile,
+)
+
+# Filtered changelists stop counting here; beyond it pages aren't linked
+ADMIN_COUNT_LIMIT = 10000
+# Rows per query and per database transaction of the bulk actions
+ADMIN_CHUNK_SIZE = 2000
+
+
+def estimated_count(model):
+    """
+    Row count of the model's table from the planner statistics (refreshed by
+    ANALYZE), or None when the database has none.
+    """
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                # The first number of each stat is the table's row count
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+                counts = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+                return max(counts) if counts else None
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+                row = cursor.fetchone()
+                return row[0] if row and row[0] >= 0 else None
+            if connection.vendor == 'mysql':
+                cursor.execute(
+                    'SELECT table_rows FROM information_schema.tables '
+                    'WHERE table_schema = DATABASE() AND table_name = %s', [table]
+                )
+                row = cursor.fetchone()
+                return row[0] if row else None
+    except DatabaseError:
+        return None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Changelist paginator that never counts a whole large table: the
+    unfiltered list uses estimated_count() and filtered lists count up to
+    ADMIN_COUNT_LIMIT rows.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model)
+            if estimate is not None:
+                return estimate
+        return queryset.order_by()[:ADMIN_COUNT_LIMIT].count()
+    
+    def page(self, number):
+        # The page's ids come from the table alone, read in index order;
+        # joined to the related rows up front, the database may sort the
+        # whole join before applying the limit
+        page = super().page(number)
+        ids = list(page.object_list.values_list('pk', flat=True))
+        rows = self.object_list.filter(pk__in=ids).in_bulk()
+        page.object_list = [rows[pk] for pk in ids]
+        return page
+
+
+def period_start(moment, kind):
+    if kind == 'year':
+        return moment.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+    if kind == 'month':
+        return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_period(start, kind):
+    if kind == 'year':
+        return start.replace(year=start.year + 1)
+    if kind == 'month':
+        return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start + timedelta(days=1)
+
+
+class DrilldownQuerySet(QuerySet):
+    """
+    QuerySet of the LargeTableAdmin changelists. datetimes(), which the date
+    hierarchy lists its years, months or days with, probes each period
+    between the first and last date with an EXISTS on the date index
+    instead of truncating the date of every row.
+    """
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        if kind not in ('year', 'month', 'day'):
+            return super().datetimes(field_name, kind, order, tzinfo)
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        if bounds['first'] is None:
+            return []
+        first, last = bounds['first'], bounds['last']
+        if timezone.is_aware(first):
+            tzinfo = tzinfo or timezone.get_current_timezone()
+            first, last = timezone.localtime(first, tzinfo), timezone.localtime(last, tzinfo)
+        periods = []
+        start = period_start(first, kind)
+        while start <= last:
+            end = next_period(start, kind)
+            if self.filter(**{f'{field_name}__gte': start, f'{field_name}__lt': end}).exists():
+                periods.append(start)
+            start = end
+        return periods if order == 'ASC' else periods[::-1]
+
+
+def id_chunks(queryset, chunk_size=ADMIN_CHUNK_SIZE):
+    """
+    Ids of ``queryset`` in ascending lists of ``chunk_size``, each read from
+    where the last one ended, so a selection of millions of rows is never
+    loaded at once.
+    """
+    ids = queryset.order_by('id').values_list('id', flat=True)
+    last_id = 0
+    while True:
+        chunk = list(ids.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]
+
+
+class Echo:
+    """File-like object handing csv.writer's lines back instead of buffering them."""
+
+    def write(self, value):
+        return value
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Admin for the ledger tables with millions of rows: estimated counts and
+    no full result count or facet counts, a date drilldown on the indexed
+    ``date`` column, and a product prefix search that reads the table
+    through its product index (subclasses add to search_queries()).
+    Selections are exported as CSV in chunks of ADMIN_CHUNK_SIZE rows.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    date_hierarchy = 'date'
+    # Non-empty so the search box is shown; get_search_results() does the search
+    search_fields = ('product__name',)
+    # values() lookups written by export_csv, in column order
+    export_fields = ()
+    
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return DrilldownQuerySet(model=queryset.model, query=queryset.query, using=queryset.db)
+    
+    def search_queries(self, term):
+        """
+        Querysets of the ids matching ``term``, one per index they are read
+        through; the search is their union.
+        """
+        products = Product.objects.filter(Q(name__istartswith=term) | Q(sku__istartswith=term)).values('id')
+        return [self.model.objects.filter(product__in=products)]
+    
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        # A UNION rather than OR'ed conditions, which the database would
+        # answer by reading the whole table in date order
+        first, *others = [query.order_by().values('id') for query in self.search_queries(term)]
+        return queryset.filter(id__in=first.union(*others) if others else first), False
+    
+    def has_export_permission(self, request):
+        return request.user.has_perm('inventory.export_reports')
+    
+    @admin.action(description='Export selected rows to CSV', permissions=['export'])
+    def export_csv(self, request, queryset):
+        model = queryset.model
+        writer = csv.writer(Echo())
+        
+        def rows():
+            yield writer.writerow(self.export_fields)
+            for ids in id_chunks(queryset):
+                for row in model.objects.filter(id__in=ids).order_by('id').values_list(*self.export_fields):
+                    yield writer.writerow(row)
+        
+        response = StreamingHttpResponse(rows(), content_type='text/csv')
+        filename = f'{model._meta.model_name}-{timezone.now():%Y%m%d-%H%M%S}.csv'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+class ProductStatsAdminMixin:
+    """
+    Recomputes the ProductStats of the products whose ledger rows are
+    added, edited or deleted here.
+    """
+    
+    def save_model(self, request, obj, form, change):
+        previous = None
+        if change:
+            previous = type(obj).objects.filter(pk=obj.pk).values_list('product_id', flat=True).first()
+        super().save_model(request, obj, form, change)
+        product_stats.refresh({obj.product_id, previous} - {None})
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        product_stats.refresh([obj.product_id])
+    
+    def delete_queryset(self, request, queryset):
+        product_ids = set(queryset.order_by().values_list('product_id', flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        product_stats.refresh(product_ids)
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'sku', 'type', 'quantity', 'price')
-    list_filter = ('type',)
+    list_display = ('name', 'sku', 'type', 'stock', 'price', 'sharded_stock')
+    list_filter = ('type', 'sharded_stock')
+    list_select_related = ('type',)
     search_fields = ('name', 'sku')
+    actions = ['enable_sharded_stock', 'disable_sharded_stock']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(pending_stock=counters.PENDING_STOCK)
+    
+    def get_readonly_fields(self, request, obj=None):
+        # Sharded stock is switched by the actions, which fold the counters;
+        # a sharded product's stock only changes through movements
+        if obj is not None and obj.sharded_stock:
+            return ('sharded_stock', 'quantity')
+        return ('sharded_stock',)
+    
+    @admin.display(description='Quantity', ordering='quantity')
+    def stock(self, obj):
+        return counters.stock_of(obj)
+    
+    def save_model(self, request, obj, form, change):
+        if not (change and obj.sharded_stock):
+            super().save_model(request, obj, form, change)
+            return
+        # Under the product lock, so the quantity read with the form isn't
+        # written back over a compaction
+        with transaction.atomic():
+            obj.quantity = counters.compact(obj.id).quantity
+            super().save_model(request, obj, form, change)
+    
+    @admin.action(description='Shard the stock counter of selected products', permissions=['change'])
+    def enable_sharded_stock(self, request, queryset):
+        ids = list(queryset.filter(sharded_stock=False).values_list('id', flat=True))
+        for product_id in ids:
+            counters.enable(product_id)
+        self.message_user(
+            request,
+            f'Movements of {len(ids)} products now go to {counters.slot_count()} counter slots each.',
+            messages.SUCCESS,
+        )
+    
+    @admin.action(description='Fold the stock counter of selected products back in', permissions=['change'])
+    def disable_sharded_stock(self, request, queryset):
+        ids = list(queryset.filter(sharded_stock=True).values_list('id', flat=True))
+        for product_id in ids:
+            counters.disable(product_id)
+        # Dropping the slots drops their count of unrecorded movements
+        product_stats.refresh(ids)
+        self.message_user(request, f'Movements of {len(ids)} products lock the product row again.', messages.SUCCESS)
 
 @admin.register(StockHistory)
-class StockHistoryAdmin(admin.ModelAdmin):
+class StockHistoryAdmin(LargeTableAdmin):
     list_display = ('product', 'quantity', 'type', 'date', 'notes')
-    list_filter = ('type', 'date')
-    search_fields = ('product__name', 'notes')
+    list_filter = ('type',)
+    list_select_related = ('product',)
+    search_help_text = 'Product name or SKU, by prefix'
+    raw_id_fields = ('product',)
+    export_fields = ('id', 'date', 'product__sku', 'product__name', 'type', 'quantity', 'notes')
+    actions = ('export_csv',)
 
 @admin.register(ProductType)
 class ProductTypeAdmin(admin.ModelAdmin):
@@ -31,10 +309,11 @@ class ClientAdmin(admin.ModelAdmin):
     search_fields = ('name', 'contact_person', 'email')
 
 @admin.register(StockTransaction)
-class StockTransactionAdmin(admin.ModelAdmin):
-    list_display = ('product', 'quantity', 'type', 'date', 'supplier', 'client', 'reference_number')
-    list_filter = ('type', 'date', 'is_wastage')
-    search_fields = ('product__name', 'supplier', 'client', 'reference_number')
+class StockTransactionAdmin(ProductStatsAdminMixin, LargeTableAdmin):
+    list_display = ('product', 'quantity', 'type', 'date', 'supplier_name', 'client_name', 'reference_number')
+    list_filter = ('type', 'is_wastage')
+    list_select_related = ('product', 'supplier_ref', 'client_ref')
+    search_help_text = 'Product name or SKU, supplier or client name (by prefix), or an exact reference number'
     raw_id_fields = ('product', 'supplier_ref', 'client_ref')
     fieldsets = (
         (None, {
@@ -49,17 +328,65 @@ class StockTransactionAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+    export_fields = (
+        'id', 'date', 'product__sku', 'product__name', 'type', 'quantity', 'unit_price', 'discount',
+        'line_total', 'net_total', 'supplier_ref__name', 'supplier', 'client_ref__name', 'client',
+        'reference_number', 'is_wastage', 'notes',
+    )
+    actions = ('export_csv', 'recalculate_totals', 'archive')
     
-    def get_queryset(self, request):
-        # Add a note to highlight the new report permissions
-        if not hasattr(self, '_permissions_note_shown') and request.user.is_superuser:
-            self._permissions_note_shown = True
-            self.message_user(request, (
-                "New report permissions are available for users: "
-                "'Can view reports', 'Can export reports to CSV/PDF', and 'Can print reports'. "
-                "Assign these permissions to users who need to access the reports section."
-            ))
-        return super().get_queryset(request)
+    @admin.display(description='Supplier')
+    def supplier_name(self, obj):
+        # Linked supplier, else the legacy free-text name
+        return obj.supplier_ref.name if obj.supplier_ref_id else obj.supplier
+    
+    @admin.display(description='Client')
+    def client_name(self, obj):
+        return obj.client_ref.name if obj.client_ref_id else obj.client
+    
+    def search_queries(self, term):
+        return super().search_queries(term) + [
+            StockTransaction.objects.filter(supplier_ref__in=Supplier.objects.filter(name__istartswith=term).values('id')),
+            StockTransaction.objects.filter(client_ref__in=Client.objects.filter(name__istartswith=term).values('id')),
+            StockTransaction.objects.filter(reference_number=term),
+        ]
+    
+    @admin.action(description='Recalculate totals of selected transactions', permissions=['change'])
+    def recalculate_totals(self, request, queryset):
+        # Set-based like the 0021 backfill: bulk_update's CASE per row is
+        # several times slower on chunks this size
+        updated = 0
+        product_ids = set()
+        for ids in id_chunks(queryset):
+            with transaction.atomic():
+                chunk = StockTransaction.objects.filter(id__in=ids)
+                chunk.filter(unit_price__isnull=False).update(line_total=F('quantity') * F('unit_price'))
+                chunk.filter(unit_price__isnull=True).update(line_total=0)
+                # updated_at too, so cached analytics notice the new totals
+                chunk.update(net_total=F('line_total') - F('discount'), updated_at=timezone.now())
+                product_ids.update(chunk.values_list('product_id', flat=True))
+            updated += len(ids)
+        # Revenue is the sum of net totals
+        product_stats.refresh(product_ids)
+        self.message_user(request, f'Recalculated the totals of {updated} transactions.', messages.SUCCESS)
+    
+    @admin.action(description='Move selected transactions to the archive', permissions=['delete'])
+    def archive(self, request, queryset):
+        latest = queryset.aggregate(date=Max('date'), id=Max('id'))
+        if latest['id'] is None:
+            return
+        # Bounded by id so the opening-balance rows written meanwhile, which
+        # may match the changelist filters, are not picked up in turn
+        candidates = queryset.filter(id__lte=latest['id'])
+        moved = 0
+        for moved in archive_transactions(candidates, latest['date'], ADMIN_CHUNK_SIZE):
+            pass
+        self.message_user(
+            request,
+            f"Archived {moved} transactions; their net quantities are carried forward in opening-balance rows "
+            f"dated {latest['date']:%Y-%m-%d %H:%M}.",
+            messages.SUCCESS,
+        )
 
 # Register Report Permissions explicitly to make them visible in admin
 class ReportPermissionAdmin(admin.ModelAdmin):
@@ -85,3 +412,101 @@ class ReportPermissionAdmin(admin.ModelAdmin):
 # Register the model if it doesn't interfere with Django's built-in permission admin
 # This is optional and would need to be tested in the actual application
 # admin.site.register(Permission, ReportPermissionAdmin)
+
+@admin.register(ArchivedStockTransaction)
+class ArchivedStockTransactionAdmin(ProductStatsAdminMixin, LargeTableAdmin):
+    list_display = ('product', 'quantity', 'type', 'date', 'supplier', 'client', 'reference_number', 'archived_at')
+    list_filter = ('type', 'is_opening_balance')
+    list_select_related = ('product',)
+    search_help_text = 'Product name or SKU, by prefix'
+    raw_id_fields = ('product', 'supplier_ref', 'client_ref')
+    export_fields = (
+        'id', 'date', 'product__sku', 'product__name', 'type', 'quantity', 'unit_price', 'discount',
+        'line_total', 'net_total', 'supplier', 'client', 'reference_number', 'archived_at',
+    )
+    actions = ('export_csv',)
+    
+    # The archive is written only by the archive_transactions command
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(Lot)
+class LotAdmin(admin.ModelAdmin):
+    list_display = ('product', 'batch_number', 'expiry_date', 'quantity', 'received_quantity', 'received_at')
+    list_select_related = ('product',)
+    search_fields = ('batch_number', 'product__name', 'product__sku')
+    raw_id_fields = ('product',)
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'status_code', 'duration_ms', 'query_count', 'db_time_ms', 'user')
+    list_filter = ('method', 'status_code')
+    list_select_related = ('user',)
+    search_fields = ('path', 'view_name')
+    # The files are shown here and downloaded through stats_view, not linked
+    # under MEDIA_URL, since they hold query params
+    fields = ('created_at', 'user', 'method', 'path', 'view_name', 'status_code', 'duration_ms', 'query_count',
+              'db_time_ms', 'stats_download', 'functions', 'queries')
+    readonly_fields = fields
+    
+    # Profiles are only written by ProfilingMiddleware
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def get_urls(self):
+        return [
+            path('<path:object_id>/stats/', self.admin_site.admin_view(self.stats_view),
+                 name='inventory_requestprofile_stats'),
+        ] + super().get_urls()
+    
+    def stats_view(self, request, object_id):
+        profile = get_object_or_404(RequestProfile, pk=object_id)
+        if not self.has_view_permission(request, profile):
+            raise PermissionDenied
+        if not profile.stats_file.storage.exists(profile.stats_file.name):
+            raise Http404
+        return FileResponse(profile.stats_file.open('rb'), as_attachment=True, filename=f'profile-{profile.id}.prof')
+    
+    @admin.display(description='Duration (ms)', ordering='duration')
+    def duration_ms(self, obj):
+        return round(obj.duration * 1000, 1)
+    
+    @admin.display(description='DB time (ms)', ordering='db_time')
+    def db_time_ms(self, obj):
+        return round(obj.db_time * 1000, 1)
+    
+    @admin.display(description='cProfile stats')
+    def stats_download(self, obj):
+        url = reverse('admin:inventory_requestprofile_stats', args=[obj.id])
+        return format_html('<a href="{}">Download (open with pstats or snakeviz)</a>', url)
+    
+    def report(self, obj):
+        # Both report fields of one page read the file once
+        if getattr(obj, '_report', None) is None:
+            try:
+                with obj.report_file.open('rb') as report_file:
+                    obj._report = json.load(report_file)
+            except (OSError, ValueError):
+                obj._report = {'functions': 'Report file missing', 'queries': []}
+        return obj._report
+    
+    @admin.display(description='Top functions (cumulative time)')
+    def functions(self, obj):
+        return format_html('<pre style="white-space: pre-wrap">{}</pre>', self.report(obj)['functions'])
+    
+    @admin.display(description='Queries')
+    def queries(self, obj):
+        blocks = []
+        for number, query in enumerate(self.report(obj)['queries'], 1):
+            block = f"#{number}  {query['duration_ms']} ms\n{query['sql']}\nparams: {query['params']}"
+            if query['explain']:
+                block += f"\nEXPLAIN:\n{query['explain']}"
+            blocks.append(block)
+        return format_html('<pre style="white-space: pre-wrap">{}</pre>', '\n\n'.join(blocks) or 'No queries')
+
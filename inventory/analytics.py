@@ -0,0 +1,172 @@
+from datetime import timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.conf import settings
+from django.db.models import Count, Sum, F, Q, Max, DecimalField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .counters import STOCK_QUANTITY
+from .models import Product, ProductType, StockTransaction, ArchivedStockTransaction, DeletedRecord
+from .reports import product_type_id
+
+# Cumulative revenue share closing the A and B classes
+ABC_THRESHOLDS = (0.80, 0.95)
+
+VALUE_FIELD = DecimalField(max_digits=14, decimal_places=2)
+
+
+def ledger_version():
+    """
+    Stamp that changes with every stock movement, ledger or product edit
+    and deletion.
+
+    Cached analytics are keyed on it, so they stay valid exactly until the
+    next change, in every worker, without explicit invalidation. Each part
+    is a max() over an indexed column.
+    """
+    edited = StockTransaction.objects.aggregate(v=Max('updated_at'))['v']
+    return '{}-{}-{}-{}'.format(
+        StockTransaction.objects.aggregate(v=Max('id'))['v'] or 0,
+        edited.timestamp() if edited else 0,
+        (Product.objects.aggregate(v=Max('updated_at'))['v'] or timezone.now()).timestamp(),
+        DeletedRecord.objects.aggregate(v=Max('id'))['v'] or 0,
+    )
+
+
+def cached(name, compute, *key_parts):
+    key = ':'.join(['analytics', name, ledger_version(), *map(str, key_parts)])
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        cache.set(key, result, getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', 3600))
+    return result
+
+
+def category_breakdown():
+    """Product count, units and stock value per product type, in one grouped query."""
+    type_names = dict(ProductType.objects.values_list('id', 'name'))
+    rows = (
+        Product.objects
+        .order_by()
+        # Counter slots of sharded products included
+        .alias(stock=STOCK_QUANTITY)
+        .values('type_id')
+        .annotate(
+            product_count=Count('id'),
+            total_quantity=Coalesce(Sum('stock'), 0),
+            stock_value=Coalesce(Sum(F('stock') * F('buying_price')), 0, output_field=VALUE_FIELD),
+            retail_value=Coalesce(Sum(F('stock') * F('selling_price')), 0, output_field=VALUE_FIELD),
+            below_minimum=Count('id', filter=Q(stock__lte=F('minimum_stock_level'))),
+        )
+        .order_by('-stock_value')
+    )
+    return [{'type': type_names[row.pop('type_id')], **row} for row in rows]
+
+
+def sales_by_product(queryset):
+    """Units sold and net revenue per product from one grouped ledger query."""
+    return (
+        queryset
+        .filter(type='OUT', is_opening_balance=False)
+        .order_by()
+        .values('product_id')
+        .annotate(
+            out_quantity=Sum('quantity'),
+            revenue=Sum('net_total'),
+        )
+        .values_list('product_id', 'out_quantity', 'revenue')
+    )
+
+
+def abc_classes(revenue):
+    """
+    ABC class per product from its revenue: A for the products making up the
+    first 80% of revenue, B for the next 15%, C for the rest (and no sales).
+    """
+    classes = np.full(revenue.shape, 'C', dtype='<U1')
+    total = revenue.sum()
+    if total <= 0:
+        return classes
+    order = np.argsort(-revenue, kind='stable')
+    # Share of revenue accumulated before each product in the ranking
+    cumulative_before = (np.cumsum(revenue[order]) - revenue[order]) / total
+    ranked = np.where(
+        cumulative_before < ABC_THRESHOLDS[0], 'A',
+        np.where(cumulative_before < ABC_THRESHOLDS[1], 'B', 'C')
+    )
+    classes[order] = ranked
+    classes[revenue <= 0] = 'C'
+    return classes
+
+
+def product_analytics(days=90, product_type=None):
+    """
+    ABC class, inventory turnover and days of cover per product over the last
+    ``days`` days.
+
+    Turnover is units sold in the period per unit currently in stock, and
+    days of cover is current stock divided by average daily sales; both are
+    None when undefined (nothing in stock / nothing sold).
+    """
+    since = timezone.now() - timedelta(days=days)
+
+    products = Product.objects.order_by('id')
+    if product_type:
+        products = products.filter(type_id=product_type_id(product_type))
+    product_rows = list(products.values_list(
+        'id', 'name', 'sku', 'type__name', STOCK_QUANTITY, 'unit_of_measure', 'buying_price', 'selling_price'
+    ))
+    if not product_rows:
+        return []
+
+    sales = list(sales_by_product(StockTransaction.objects.filter(date__gte=since)))
+    if ArchivedStockTransaction.objects.filter(date__gte=since).exists():
+        sales += list(sales_by_product(ArchivedStockTransaction.objects.filter(date__gte=since)))
+
+    ids = np.fromiter((row[0] for row in product_rows), dtype=np.int64, count=len(product_rows))
+    quantity = np.fromiter((row[4] for row in product_rows), dtype=np.float64, count=len(product_rows))
+    out_quantity = np.zeros(len(ids))
+    revenue = np.zeros(len(ids))
+
+    if sales:
+        sale_ids = np.fromiter((row[0] for row in sales), dtype=np.int64, count=len(sales))
+        positions = np.searchsorted(ids, sale_ids)
+        # Drop sales of products filtered out by type
+        known = (positions < len(ids)) & (ids[np.minimum(positions, len(ids) - 1)] == sale_ids)
+        np.add.at(out_quantity, positions[known],
+                  np.fromiter((row[1] or 0 for row in sales), dtype=np.float64, count=len(sales))[known])
+        np.add.at(revenue, positions[known],
+                  np.fromiter((float(row[2] or 0) for row in sales), dtype=np.float64, count=len(sales))[known])
+
+    total_revenue = revenue.sum()
+    revenue_share = revenue / total_revenue if total_revenue > 0 else np.zeros(len(ids))
+    classes = abc_classes(revenue)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        turnover = np.where(quantity > 0, out_quantity / quantity, np.nan)
+        days_of_cover = np.where(out_quantity > 0, quantity / (out_quantity / days), np.nan)
+
+    def number(value, digits=2):
+        return None if np.isnan(value) else round(float(value), digits)
+
+    return [
+        {
+            'id': row[0],
+            'name': row[1],
+            'sku': row[2],
+            'type': row[3],
+            'quantity': row[4],
+            'unit_of_measure': row[5],
+            # Strings, like the decimals of the other endpoints
+            'buying_price': str(row[6]),
+            'selling_price': str(row[7]),
+            'out_quantity': int(out_quantity[i]),
+            'revenue': round(float(revenue[i]), 2),
+            'revenue_share': round(float(revenue_share[i]), 4),
+            'abc_class': str(classes[i]),
+            'turnover': number(turnover[i]),
+            'days_of_cover': number(days_of_cover[i], 1),
+        }
+        for i, row in enumerate(product_rows)
+    ]
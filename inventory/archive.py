@@ -0,0 +1,105 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import StockTransaction, ArchivedStockTransaction
+
+# Columns copied from the hot ledger into the archive
+ARCHIVED_COLUMNS = [field.column for field in StockTransaction._meta.concrete_fields]
+
+OPENING_BALANCE_NOTE = 'Opening balance carried forward from archived transactions'
+
+
+def archive_transactions(candidates, cutoff, chunk_size=5000):
+    """
+    Move the ``candidates`` queryset of StockTransaction rows into the
+    archive, ``chunk_size`` rows per database transaction, and yield the
+    running total moved after each chunk. Their net quantity is carried
+    into each product's opening-balance row dated at ``cutoff``.
+    """
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(candidates.order_by('id').values('id', 'product_id', 'type', 'quantity')[:chunk_size])
+            if not rows:
+                return
+            move_chunk(rows, cutoff)
+        moved += len(rows)
+        yield moved
+
+
+def copy_to_archive(ids):
+    """
+    Copy the ledger rows with these ids into the archive with one
+    INSERT ... SELECT, so their values never pass through Python.
+    """
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(column) for column in ARCHIVED_COLUMNS)
+    archived_at = ArchivedStockTransaction._meta.get_field('archived_at')
+    now = archived_at.get_db_prep_save(timezone.now(), connection)
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(ArchivedStockTransaction._meta.db_table)} ({columns}, {quote(archived_at.column)}) '
+            f'SELECT {columns}, %s FROM {quote(StockTransaction._meta.db_table)} WHERE {quote("id")} IN ({placeholders})',
+            [now, *ids],
+        )
+
+
+def move_chunk(rows, cutoff):
+    copy_to_archive([row['id'] for row in rows])
+
+    net_quantities = defaultdict(int)
+    for row in rows:
+        net_quantities[row['product_id']] += row['quantity'] if row['type'] == 'IN' else -row['quantity']
+    carry_forward(net_quantities, cutoff)
+
+    # Archived rows are still history, not deletions, so skip the
+    # post_delete handlers (and the sync tombstones they would write)
+    StockTransaction.objects.filter(id__in=[row['id'] for row in rows])._raw_delete(StockTransaction.objects.db)
+
+
+def carry_forward(net_quantities, cutoff):
+    """
+    Add the net quantity of the archived rows to each product's
+    opening-balance row at the cutoff, creating it when missing, so the
+    hot ledger still adds up to Product.quantity.
+    """
+    opening_rows = {
+        row.product_id: row
+        for row in StockTransaction.objects.filter(
+            is_opening_balance=True, date=cutoff, product_id__in=net_quantities
+        )
+    }
+
+    to_update = []
+    to_create = []
+    for product_id, net in net_quantities.items():
+        row = opening_rows.get(product_id)
+        if row is None:
+            row = StockTransaction(product_id=product_id, is_opening_balance=True, notes=OPENING_BALANCE_NOTE)
+            to_create.append(row)
+        else:
+            to_update.append(row)
+            net += row.quantity if row.type == 'IN' else -row.quantity
+        row.type = 'IN' if net >= 0 else 'OUT'
+        row.quantity = abs(net)
+
+    if to_update:
+        # One prepared UPDATE per row; bulk_update's CASE over thousands of
+        # rows costs far more
+        quote = connection.ops.quote_name
+        updated_at = StockTransaction._meta.get_field('updated_at')
+        now = updated_at.get_db_prep_save(timezone.now(), connection)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'UPDATE {quote(StockTransaction._meta.db_table)} '
+                f'SET {quote("type")} = %s, {quote("quantity")} = %s, {quote(updated_at.column)} = %s '
+                f'WHERE {quote("id")} = %s',
+                [(row.type, row.quantity, now, row.id) for row in to_update],
+            )
+    if to_create:
+        created = StockTransaction.objects.bulk_create(to_create)
+        # date is auto_now_add, so it can only be backdated with an update
+        StockTransaction.objects.filter(id__in=[row.id for row in created]).update(date=cutoff)
@@ -0,0 +1,112 @@
+from datetime import timedelta
+
+from django.db.models import Count
+from django.urls import get_script_prefix, reverse
+from django.utils import timezone
+
+from . import urls
+from .models import Product, ProductType, Supplier, Client, StockTransaction, Lot
+
+# Routes not requested: the stock event stream never ends
+SKIPPED_ROUTES = {'stock-events'}
+
+
+def api_path(name, *args):
+    # reverse() adds FORCE_SCRIPT_NAME once a request has set it; the test
+    # client wants the path without it
+    return '/' + reverse(name, args=args)[len(get_script_prefix()):]
+
+
+def busiest(queryset, field):
+    """Id of the row of ``queryset``'s model with the most transactions through ``field``."""
+    row = (
+        StockTransaction.objects.filter(**{f'{field}__isnull': False})
+        .values(field).annotate(count=Count('id')).order_by('-count')[:1]
+    )
+    return row[0][field] if row else queryset.values_list('id', flat=True).first()
+
+
+def endpoint_requests(days=30):
+    """
+    A request for every route of inventory/urls.py, on the busiest rows of
+    the current data, as ``(label, route name, method, path, data)``.
+    Report date ranges cover the last ``days`` days. Writes come last, so
+    they don't invalidate caches the reads rely on.
+    """
+    product = busiest(Product.objects.all(), 'product')
+    supplier = busiest(Supplier.objects.all(), 'supplier_ref')
+    client = busiest(Client.objects.all(), 'client_ref')
+    product_type = ProductType.objects.filter(products__id=product).values_list('name', 'id').first() or ('', None)
+    transaction = StockTransaction.objects.order_by('-id').values_list('id', flat=True).first()
+    lot = Lot.objects.order_by('-quantity').values_list('id', flat=True).first()
+    since = (timezone.now() - timedelta(days=days)).date().isoformat()
+    reports = f'?start_date={since}'
+
+    requests = [
+        ('api root', 'api-root', 'get', api_path('api-root'), None),
+        ('products', 'product-list', 'get', api_path('product-list'), None),
+        ('products, sparse fields', 'product-list', 'get', api_path('product-list') + '?fields=id,name,quantity', None),
+        ('products, columnar', 'product-list', 'get', api_path('product-list') + '?format=columnar', None),
+        ('products, by type', 'product-list', 'get',
+         api_path('product-list') + f'?type={product_type[0]}&ordering=name', None),
+        ('products, search', 'product-list', 'get', api_path('product-list') + '?search=10', None),
+        ('products, stats', 'product-list', 'get', api_path('product-list') + '?stats=true', None),
+        ('product', 'product-detail', 'get', api_path('product-detail', product), None),
+        ('product, stats', 'product-detail', 'get', api_path('product-detail', product) + '?stats=true', None),
+        ('product timeline', 'product-timeline', 'get', api_path('product-timeline', product), None),
+        ('low stock', 'product-low-stock', 'get', api_path('product-low-stock'), None),
+        ('reorder suggestions', 'product-reorder-suggestions', 'get', api_path('product-reorder-suggestions'), None),
+        ('product stats', 'product-stats', 'get', api_path('product-stats'), None),
+        ('wastage stats', 'product-wastage-stats', 'get', api_path('product-wastage-stats'), None),
+        ('stock history', 'stocktransaction-list', 'get', api_path('stocktransaction-list'), None),
+        ('stock history entry', 'stocktransaction-detail', 'get',
+         api_path('stocktransaction-detail', transaction), None),
+        ('product types', 'producttype-list', 'get', api_path('producttype-list'), None),
+        ('product type', 'producttype-detail', 'get', api_path('producttype-detail', product_type[1]), None),
+        ('suppliers', 'supplier-list', 'get', api_path('supplier-list'), None),
+        ('supplier', 'supplier-detail', 'get', api_path('supplier-detail', supplier), None),
+        ('supplier products', 'supplier-products', 'get', api_path('supplier-products', supplier), None),
+        ('supplier products, stats', 'supplier-products', 'get',
+         api_path('supplier-products', supplier) + '?stats=true', None),
+        ('supplier transactions', 'supplier-transactions', 'get', api_path('supplier-transactions', supplier), None),
+        ('clients', 'client-list', 'get', api_path('client-list'), None),
+        ('client', 'client-detail', 'get', api_path('client-detail', client), None),
+        ('client products', 'client-products', 'get', api_path('client-products', client), None),
+        ('client products, stats', 'client-products', 'get', api_path('client-products', client) + '?stats=true', None),
+        ('client transactions', 'client-transactions', 'get', api_path('client-transactions', client), None),
+        ('lots', 'lot-list', 'get', api_path('lot-list'), None),
+        ('expiring lots', 'lot-expiring', 'get', api_path('lot-expiring'), None),
+        ('lot', 'lot-detail', 'get', api_path('lot-detail', lot), None),
+        ('sync', 'sync', 'get', api_path('sync'), None),
+        ('user permissions', 'user-permissions', 'get', api_path('user-permissions'), None),
+        ('report', 'reports', 'get', api_path('reports') + reports, None),
+        ('report, columnar', 'reports', 'get', api_path('reports') + reports + '&format=columnar', None),
+        ('report timeseries', 'reports-timeseries', 'get', api_path('reports-timeseries') + reports, None),
+        ('report categories', 'reports-categories', 'get', api_path('reports-categories'), None),
+        ('report products', 'reports-products', 'get', api_path('reports-products'), None),
+        ('report profit', 'reports-profit', 'get', api_path('reports-profit') + reports, None),
+        ('export products', 'export-ledger', 'get', api_path('export-ledger') + '?dataset=products', None),
+        ('export transactions', 'export-ledger', 'get', api_path('export-ledger') + reports, None),
+        ('metrics', 'metrics', 'get', api_path('metrics'), None),
+        ('stock events ticket', 'stock-events-ticket', 'post', api_path('stock-events-ticket'), {}),
+        ('stock in', 'stock-update', 'post', api_path('stock-update'),
+         {'product': product, 'quantity': 5, 'type': 'IN', 'supplier_id': supplier}),
+        ('stock out', 'stock-update', 'post', api_path('stock-update'),
+         {'product': product, 'quantity': 1, 'type': 'OUT', 'client_id': client}),
+    ]
+    return requests
+
+
+def route_names(patterns=None):
+    names = set()
+    for pattern in urls.urlpatterns if patterns is None else patterns:
+        if hasattr(pattern, 'url_patterns'):
+            names |= route_names(pattern.url_patterns)
+        elif pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+def uncovered_routes(requests):
+    """Route names of inventory/urls.py that no request exercises."""
+    return route_names() - SKIPPED_ROUTES - {request[1] for request in requests}
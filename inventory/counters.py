@@ -0,0 +1,215 @@
+"""
+Sharded stock counters for fast-moving products.
+
+Every movement of a product normally locks its row, so concurrent sales
+of one SKU queue up behind each other. A product with ``sharded_stock``
+instead takes movements on one of STOCK_COUNTER_SLOTS StockCounter rows,
+picked at random, and compaction folds their deltas back into
+Product.quantity. Product.quantity is shared out between the slots as
+allowances, and an OUT only goes to a slot whose allowance covers it, so
+the stock can't go below zero; when no slot can take it the movement
+falls back to the product lock, which compacts first.
+"""
+import random
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, When, F, Sum, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Product, StockCounter
+
+def pending_stock(product='pk'):
+    """
+    Net counter delta not yet folded into Product.quantity, of the product
+    at ``product``: 'pk' in product queries, the foreign key elsewhere
+    (e.g. 'product' in ledger or suggestion queries).
+    """
+    prefix = '' if product == 'pk' else f'{product}__'
+    return Case(
+        When(**{f'{prefix}sharded_stock': True}, then=Coalesce(Subquery(
+            StockCounter.objects
+            .filter(product=OuterRef(product))
+            .order_by()
+            .values('product')
+            .annotate(total=Sum('delta'))
+            .values('total')
+        ), 0)),
+        default=Value(0),
+    )
+
+
+def stock_quantity(product='pk'):
+    """Stock of the product at ``product`` (see pending_stock), sharded or not."""
+    prefix = '' if product == 'pk' else f'{product}__'
+    return F(f'{prefix}quantity') + pending_stock(product)
+
+
+# Net counter delta of a product not yet folded into Product.quantity
+PENDING_STOCK = pending_stock()
+
+# Stock of a product, sharded or not
+STOCK_QUANTITY = stock_quantity()
+
+
+def pending_deltas():
+    """
+    ``{product_id: net delta}`` of the sharded products with deltas not
+    folded in yet, for totals over every product that would rather read
+    Product.quantity through its index and correct these few. Only sharded
+    products have counter slots.
+    """
+    return dict(
+        StockCounter.objects
+        .order_by()
+        .values('product')
+        .annotate(total=Sum('delta'))
+        .exclude(total=0)
+        .values_list('product', 'total')
+    )
+
+
+def slot_count():
+    return getattr(settings, 'STOCK_COUNTER_SLOTS', 8)
+
+
+def locked_products():
+    """
+    Products read with their rows locked until the transaction ends. Where
+    the database tells the two apart (PostgreSQL) the lock leaves new rows
+    free to reference the product: a movement taken on a counter slot
+    inserts its ledger row while holding the slot, which compaction waits
+    for.
+    """
+    return Product.objects.select_for_update(no_key=connection.features.has_select_for_no_key_update)
+
+
+def lock_product(product_id):
+    return locked_products().get(id=product_id)
+
+
+def stock_of(product):
+    """
+    Current stock of ``product``. Uses its ``pending_stock`` annotation when
+    it was read with one, else reads the product again with its counters.
+    """
+    if not product.sharded_stock:
+        return product.quantity
+    pending = getattr(product, 'pending_stock', None)
+    if pending is not None:
+        return product.quantity + pending
+    # One query, so a compaction can't fall between the two reads
+    return Product.objects.filter(pk=product.pk).values_list(STOCK_QUANTITY, flat=True).get()
+
+
+def apply_movement(product, transaction_type, quantity, receives_lot=False):
+    """
+    Add a movement of a sharded product to one of its counter slots,
+    without locking the product row.
+
+    Returns False, leaving the movement to the locked path, when it touches
+    lots (an IN receiving one, an OUT while the product has open lots,
+    which it mirrors in its expiry and batch fields) or when no slot can
+    take it: an OUT larger than what any one slot has left, or slots not
+    created yet.
+    """
+    counters = StockCounter.objects.filter(product=product)
+    if transaction_type == 'IN':
+        if receives_lot:
+            return False
+        return counters.filter(slot=random.randrange(slot_count())).update(
+            delta=F('delta') + quantity, unrecorded=F('unrecorded') + 1) == 1
+
+    if product.expiry_date or product.batch_number:
+        return False
+    covered = counters.filter(delta__gte=quantity - F('allowance'))
+    # The condition is checked again by the UPDATE, as the picked slot may
+    # have been drawn from since
+    slot = covered.order_by('?').values('id')[:1]
+    return covered.filter(id=Subquery(slot)).update(
+        delta=F('delta') - quantity, unrecorded=F('unrecorded') + 1) == 1
+
+
+def fold(product):
+    """
+    Move the counter deltas of ``product`` into its quantity, in memory.
+
+    The caller holds the product row lock and saves the product; the slots
+    stay locked until its transaction ends, so no movement can be taken
+    against allowances that no longer hold.
+    """
+    counters = StockCounter.objects.filter(product=product)
+    deltas = list(counters.select_for_update().values_list('delta', flat=True))
+    pending = sum(deltas)
+    if pending:
+        counters.exclude(delta=0).update(delta=0)
+        product.quantity += pending
+
+
+def share_out(product):
+    """
+    Split the saved quantity of ``product`` between its counter slots as
+    their allowances, creating missing slots. Run after ``fold`` in the
+    same transaction.
+    """
+    slots = slot_count()
+    share, extra = divmod(max(product.quantity, 0), slots)
+    counters = StockCounter.objects.filter(product=product)
+    # Left over from a larger STOCK_COUNTER_SLOTS; folded already
+    counters.filter(slot__gte=slots).delete()
+    existing = set(counters.values_list('slot', flat=True))
+    StockCounter.objects.bulk_create([
+        StockCounter(product=product, slot=slot) for slot in range(slots) if slot not in existing
+    ])
+    counters.update(allowance=Case(When(slot__lt=extra, then=Value(share + 1)), default=Value(share)))
+
+
+def compact(product_id, quantity=None):
+    """
+    Fold the counter deltas of a product into Product.quantity and share it
+    out again. With ``quantity`` the deltas are discarded and the quantity
+    set to it instead, e.g. by a reconciliation or a manual edit.
+    """
+    with transaction.atomic():
+        product = lock_product(product_id)
+        fold(product)
+        if quantity is not None:
+            product.quantity = quantity
+        # updated_at too, so delta-sync clients pick up the new quantity
+        product.save(update_fields=['quantity', 'updated_at'])
+        if product.sharded_stock:
+            share_out(product)
+    return product
+
+
+def pending_products():
+    """Ids of the sharded products with deltas left to compact."""
+    return (
+        Product.objects
+        .filter(sharded_stock=True)
+        .filter(Exists(StockCounter.objects.filter(product=OuterRef('pk')).exclude(delta=0)))
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+
+
+def enable(product_id):
+    """Start taking the movements of a product on counter slots."""
+    with transaction.atomic():
+        product = lock_product(product_id)
+        if not product.sharded_stock:
+            product.sharded_stock = True
+            product.save(update_fields=['sharded_stock'])
+            share_out(product)
+    return product
+
+
+def disable(product_id):
+    """Fold the counter slots of a product back in and drop them."""
+    with transaction.atomic():
+        product = lock_product(product_id)
+        fold(product)
+        product.sharded_stock = False
+        product.save(update_fields=['quantity', 'sharded_stock', 'updated_at'])
+        StockCounter.objects.filter(product=product).delete()
+    return product
@@ -0,0 +1,270 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import ProductType, Product, Supplier, Client, StockTransaction, Lot
+from .product_stats import refresh
+
+LOCATIONS = [f'Aisle {aisle}{shelf}' for aisle in 'ABCDEFGH' for shelf in range(1, 6)]
+UNITS = ['Unit', 'Unit', 'Unit', 'Box', 'Pack', 'Kg', 'Litre']
+
+# Share of ledger rows that are purchases; they restock in larger batches
+# than sales take out, roughly balancing stock over the period
+PURCHASE_SHARE = 0.045
+
+
+def zipf_weights(count, exponent=1.1):
+    """Selection probabilities of ``count`` items where a few are far more popular."""
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def cents(value):
+    return Decimal(int(value)).scaleb(-2)
+
+
+# Ledger columns written by insert_rows(), in tuple order
+LEDGER_COLUMNS = (
+    'product', 'quantity', 'type', 'notes', 'supplier', 'client', 'reference_number', 'unit_price', 'discount',
+    'date', 'is_wastage', 'wastage', 'supplier_ref', 'client_ref', 'is_opening_balance', 'line_total', 'net_total',
+)
+
+
+def insert_rows(model, fields, rows):
+    """
+    INSERT tuples of database-ready values for ``fields``, one executemany()
+    per call. The ledger is written this way since bulk_create's per-field
+    preparation caps it at a few thousand rows per second; callers must
+    give every NOT NULL column, as model defaults are not applied.
+    """
+    opts = model._meta
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(opts.get_field(field).column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {quote(opts.db_table)} ({columns}) VALUES ({placeholders})', rows)
+
+
+class DatasetGenerator:
+    """
+    Bulk inserts a synthetic catalogue and ledger with a realistic skew: a
+    few products, clients and suppliers account for most movements (Zipf),
+    sales far outnumber purchases, and ids grow with dates spread over the
+    last ``days`` days. All names and SKUs start with ``prefix``.
+
+    Random draws come from numpy with a fixed ``seed``, so two runs with the
+    same arguments produce the same data.
+    """
+
+    def __init__(self, products=1000, suppliers=50, clients=500, transactions=100000, types=20, days=365,
+                 seed=0, batch_size=10000, prefix='GEN', log=None):
+        self.counts = {'products': products, 'suppliers': suppliers, 'clients': clients,
+                       'transactions': transactions, 'types': types}
+        self.days = days
+        self.rng = np.random.default_rng(seed)
+        self.batch_size = batch_size
+        self.prefix = prefix
+        self.log = log or (lambda message: None)
+
+    def run(self):
+        if Product.objects.filter(sku__startswith=f'{self.prefix}-').exists():
+            raise ValueError(f"Products with SKU prefix '{self.prefix}-' already exist; use another prefix")
+        self.end = timezone.now()
+        self.start = self.end - timedelta(days=self.days)
+
+        type_ids = self.create_types()
+        self.create_products(type_ids)
+        self.supplier_ids = self.create_accounts(Supplier, 'supplier', self.counts['suppliers'])
+        self.client_ids = self.create_accounts(Client, 'client', self.counts['clients'])
+        self.create_transactions()
+        self.update_stock()
+        self.log(f'Built the stats of {refresh(int(product_id) for product_id in self.product_ids)} products')
+        self.create_lots()
+        with connection.cursor() as cursor:
+            # Fresh planner statistics for the new volumes
+            cursor.execute('ANALYZE')
+
+    def create_types(self):
+        names = [f'{self.prefix} category {i + 1}' for i in range(self.counts['types'])]
+        ProductType.objects.bulk_create([ProductType(name=name) for name in names], ignore_conflicts=True)
+        type_ids = dict(ProductType.objects.filter(name__in=names).values_list('name', 'id'))
+        return [type_ids[name] for name in names]
+
+    def create_products(self, type_ids):
+        count = self.counts['products']
+        rng = self.rng
+        types = rng.choice(type_ids, count, p=zipf_weights(len(type_ids), 0.8))
+        self.buying_cents = np.clip(np.exp(rng.normal(3, 1, count)) * 100, 50, 500000).round().astype(np.int64)
+        self.selling_cents = (self.buying_cents * rng.uniform(1.15, 1.8, count)).round().astype(np.int64)
+        has_expiry = rng.random(count) < 0.3
+        expiry_days = rng.integers(-30, 365, count)
+        today = self.end.date()
+
+        products = [
+            Product(
+                name=f'{self.prefix} product {i + 1}',
+                sku=f'{self.prefix}-{i + 1:07d}',
+                barcode=f'{i + 1:013d}',
+                type_id=int(types[i]),
+                buying_price=cents(self.buying_cents[i]),
+                selling_price=cents(self.selling_cents[i]),
+                price=cents(self.buying_cents[i] + self.selling_cents[i]) / 2,
+                location=LOCATIONS[i % len(LOCATIONS)],
+                expiry_date=today + timedelta(days=int(expiry_days[i])) if has_expiry[i] else None,
+                batch_number=f'B{i + 1:06d}' if has_expiry[i] else None,
+                minimum_stock_level=int(rng.integers(5, 50)),
+                unit_of_measure=UNITS[i % len(UNITS)],
+            )
+            for i in range(count)
+        ]
+        with transaction.atomic():
+            Product.objects.bulk_create(products, batch_size=self.batch_size)
+        # In SKU order, matching the price arrays
+        self.product_ids = np.array(
+            Product.objects.filter(sku__startswith=f'{self.prefix}-').order_by('sku').values_list('id', flat=True)
+        )
+        # Popularity unrelated to id order
+        self.product_weights = rng.permutation(zipf_weights(count))
+        self.log(f'Created {count} products')
+
+    def create_accounts(self, model, label, count):
+        accounts = [
+            model(name=f'{self.prefix} {label} {i + 1}', contact_person=f'Contact {i + 1}',
+                  email=f'{label}{i + 1}@example.com', phone=f'555{i + 1:07d}')
+            for i in range(count)
+        ]
+        with transaction.atomic():
+            model.objects.bulk_create(accounts, batch_size=self.batch_size)
+        ids = list(
+            model.objects.filter(name__startswith=f'{self.prefix} {label} ').order_by('id').values_list('id', flat=True)
+        )
+        self.log(f'Created {len(ids)} {model._meta.verbose_name_plural}')
+        return np.array(ids, dtype=np.int64)
+
+    def create_transactions(self):
+        total = self.counts['transactions']
+        span = (self.end - self.start).total_seconds()
+        self.supplier_weights = zipf_weights(len(self.supplier_ids))
+        self.client_weights = zipf_weights(len(self.client_ids))
+        started = time.perf_counter()
+        self.create_opening_stock()
+        written = 0
+        while written < total:
+            size = min(self.batch_size, total - written)
+            # Each batch covers its share of the period, so ids follow dates
+            offsets = np.sort(self.rng.uniform(written / total, (written + size) / total, size)) * span
+            with transaction.atomic():
+                insert_rows(StockTransaction, LEDGER_COLUMNS, self.transaction_batch(size, offsets))
+            written += size
+            elapsed = time.perf_counter() - started
+            self.log(f'{written}/{total} transactions ({written / elapsed:,.0f} rows/s)')
+        self.correct_negative_stock()
+
+    def create_opening_stock(self):
+        """One purchase per product at the start of the period, so stock rarely runs negative."""
+        self.net_quantity = self.rng.integers(50, 200, len(self.product_ids))
+        line_totals = self.net_quantity * self.buying_cents
+        date = connection.ops.adapt_datetimefield_value(self.start)
+        rows = [
+            (int(product_id), int(quantity), 'IN', 'Opening stock', None, None, None, cents(price), cents(0),
+             date, False, cents(0), None, None, False, cents(line_total), cents(line_total))
+            for product_id, quantity, price, line_total in zip(
+                self.product_ids, self.net_quantity, self.buying_cents, line_totals)
+        ]
+        with transaction.atomic():
+            insert_rows(StockTransaction, LEDGER_COLUMNS, rows)
+
+    def correct_negative_stock(self):
+        """Restock products that sold more than they received, dated at the end of the period."""
+        short = np.flatnonzero(self.net_quantity < 0)
+        quantities = -self.net_quantity[short] + self.rng.integers(10, 50, len(short))
+        self.net_quantity[short] += quantities
+        date = connection.ops.adapt_datetimefield_value(self.end)
+        rows = [
+            (int(self.product_ids[product]), int(quantity), 'IN', 'Stock count correction', None, None, None,
+             cents(self.buying_cents[product]), cents(0), date, False, cents(0), None, None, False,
+             cents(quantity * self.buying_cents[product]), cents(quantity * self.buying_cents[product]))
+            for product, quantity in zip(short, quantities)
+        ]
+        with transaction.atomic():
+            insert_rows(StockTransaction, LEDGER_COLUMNS, rows)
+
+    def pick(self, ids, weights, size):
+        if not len(ids):
+            return np.zeros(size, dtype=np.int64)
+        return ids[self.rng.choice(len(ids), size, p=weights)]
+
+    def transaction_batch(self, size, offsets):
+        """``size`` ledger rows as LEDGER_COLUMNS tuples."""
+        rng = self.rng
+        products = rng.choice(len(self.product_ids), size, p=self.product_weights)
+        purchases = rng.random(size) < PURCHASE_SHARE
+        quantities = np.where(purchases, rng.integers(20, 100, size), 1 + rng.poisson(1.5, size))
+        suppliers = self.pick(self.supplier_ids, self.supplier_weights, size)
+        clients = self.pick(self.client_ids, self.client_weights, size)
+        # Which account a row carries: a linked one, a legacy free-text name or none
+        account_kind = rng.random(size)
+        wasted = ~purchases & (rng.random(size) < 0.01)
+        discounted = ~purchases & ~wasted & (rng.random(size) < 0.1)
+        np.add.at(self.net_quantity, products, np.where(purchases, quantities, -quantities))
+
+        # Totals in cents, as compute_totals() would set them
+        unit_prices = np.where(purchases, self.buying_cents[products], self.selling_cents[products])
+        line_totals = quantities * unit_prices
+        discounts = np.where(discounted, np.rint(line_totals * 5 / 100).astype(np.int64), 0)
+        wastages = np.where(wasted, line_totals, 0)
+        net_totals = line_totals - discounts
+
+        adapt_date = connection.ops.adapt_datetimefield_value
+        rows = []
+        for i in range(size):
+            supplier = supplier_ref = client = client_ref = reference = notes = None
+            if purchases[i]:
+                kind = 'IN'
+                if account_kind[i] < 0.85 and len(self.supplier_ids):
+                    supplier_ref = int(suppliers[i])
+                elif account_kind[i] < 0.95:
+                    supplier = f'{self.prefix} legacy supplier {i % 20 + 1}'
+                reference = f'PO-{i:06d}'
+            else:
+                kind = 'OUT'
+                if wasted[i]:
+                    notes = 'Damaged'
+                elif account_kind[i] < 0.7 and len(self.client_ids):
+                    client_ref = int(clients[i])
+                elif account_kind[i] < 0.9:
+                    client = 'Walk-in customer'
+            rows.append((
+                int(self.product_ids[products[i]]), int(quantities[i]), kind, notes, supplier, client, reference,
+                cents(unit_prices[i]), cents(discounts[i]),
+                adapt_date(self.start + timedelta(seconds=float(offsets[i]))), bool(wasted[i]), cents(wastages[i]),
+                supplier_ref, client_ref, False, cents(line_totals[i]), cents(net_totals[i]),
+            ))
+        return rows
+
+    def update_stock(self):
+        products = [
+            Product(id=int(product_id), quantity=int(quantity))
+            for product_id, quantity in zip(self.product_ids, self.net_quantity)
+        ]
+        with transaction.atomic():
+            Product.objects.bulk_update(products, ['quantity'], batch_size=1000)
+
+    def create_lots(self):
+        lots = [
+            Lot(product_id=product_id, batch_number=batch_number, expiry_date=expiry_date,
+                quantity=quantity, received_quantity=quantity)
+            for product_id, batch_number, expiry_date, quantity in (
+                Product.objects
+                .filter(sku__startswith=f'{self.prefix}-', expiry_date__isnull=False, quantity__gt=0)
+                .values_list('id', 'batch_number', 'expiry_date', 'quantity')
+                .iterator()
+            )
+        ]
+        with transaction.atomic():
+            Lot.objects.bulk_create(lots, batch_size=self.batch_size)
+        self.log(f'Created {len(lots)} lots')
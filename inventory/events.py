@@ -0,0 +1,214 @@
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max
+
+from .counters import stock_quantity
+from .models import StockTransaction
+
+# Salt of the tickets that open an event stream
+TICKET_SALT = 'inventory.events.stock'
+
+# Fields read from the ledger when building stock events, plus the
+# product's stock as 'product_quantity'
+EVENT_FIELDS = ('id', 'product_id', 'type', 'quantity', 'is_wastage', 'date')
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def ticket_max_age():
+    return get_setting('STOCK_EVENTS_TICKET_MAX_AGE', 60)
+
+
+def issue_ticket(user):
+    """
+    Signed, short-lived ticket letting ``user`` open an event stream.
+    EventSource cannot send an Authorization header, and an API token in
+    the URL would end up in access logs; a ticket expires within
+    STOCK_EVENTS_TICKET_MAX_AGE seconds.
+    """
+    return signing.dumps(user.pk, salt=TICKET_SALT)
+
+
+def read_ticket(ticket):
+    """Id of the user a ticket was issued to, or None if it is invalid or expired."""
+    try:
+        return signing.loads(ticket, salt=TICKET_SALT, max_age=ticket_max_age())
+    except signing.BadSignature:
+        return None
+
+
+def build_event(row):
+    """
+    Build the compact event payload for one ledger row.
+
+    ``row`` is a dict with the keys in EVENT_FIELDS and 'product_quantity',
+    either read from the database or built from a freshly saved transaction.
+    """
+    return {
+        'id': row['id'],
+        'product': row['product_id'],
+        'product_quantity': row['product_quantity'],
+        'type': row['type'],
+        'quantity': row['quantity'],
+        'is_wastage': row['is_wastage'],
+        'date': row['date'],
+    }
+
+
+def event_from_transaction(transaction):
+    return build_event({
+        'id': transaction.id,
+        'product_id': transaction.product_id,
+        'product_quantity': transaction.product.quantity,
+        'type': transaction.type,
+        'quantity': transaction.quantity,
+        'is_wastage': transaction.is_wastage,
+        'date': transaction.date,
+    })
+
+
+def format_sse(data, event=None, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+
+class StockEventBroadcaster:
+    """
+    In-process fan-out of stock events to connected SSE streams.
+
+    Each subscriber owns an asyncio queue bound to its event loop. Publishing
+    is thread-safe so it can be called from sync views running in a worker
+    thread. Events published in other processes are not seen here; streams
+    pick those up by polling the ledger.
+    """
+
+    def __init__(self, max_queue_size=100):
+        self.max_queue_size = max_queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            self._subscribers.add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscribers = {sub for sub in self._subscribers if sub[1] is not queue}
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, event)
+            except RuntimeError:
+                # The subscriber's loop has been closed
+                self.unsubscribe(queue)
+
+    @staticmethod
+    def _put(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A slow client misses the event here and catches up from the ledger
+            pass
+
+
+broadcaster = StockEventBroadcaster()
+
+
+def publish_transaction(transaction):
+    broadcaster.publish(event_from_transaction(transaction))
+
+
+async def get_latest_event_id():
+    result = await StockTransaction.objects.aaggregate(latest=Max('id'))
+    return result['latest'] or 0
+
+
+async def fetch_events_since(last_id, limit):
+    queryset = (
+        StockTransaction.objects
+        .filter(id__gt=last_id)
+        .order_by('id')
+        # Counter slots of sharded products included
+        .values(*EVENT_FIELDS, product_quantity=stock_quantity('product'))[:limit]
+    )
+    return [build_event(row) async for row in queryset]
+
+
+async def stock_event_stream(last_event_id=None):
+    """
+    Yield server-sent events for new stock transactions.
+
+    Event ids are ledger ids, so a client reconnecting with ``Last-Event-ID``
+    resumes exactly where it left off. Live events from this process are
+    emitted directly when they follow the last sent id; any gap (events from
+    another worker, a dropped event, a resumed stream) is filled by reading
+    the ledger, which is also polled periodically as the multi-worker fallback.
+    """
+    poll_interval = get_setting('STOCK_EVENTS_POLL_INTERVAL', 5)
+    keepalive_interval = get_setting('STOCK_EVENTS_KEEPALIVE_INTERVAL', 15)
+    batch_size = get_setting('STOCK_EVENTS_BATCH_SIZE', 100)
+    max_backlog = get_setting('STOCK_EVENTS_MAX_BACKLOG', 1000)
+
+    queue = broadcaster.subscribe()
+    try:
+        latest_id = await get_latest_event_id()
+        yield f'retry: {int(poll_interval * 1000)}\n\n'
+
+        if last_event_id is None:
+            last_id = latest_id
+        elif latest_id - last_event_id > max_backlog:
+            # Too far behind to replay; tell the client to reload its data
+            last_id = latest_id
+            yield format_sse({'latest_id': latest_id}, event='reset', event_id=latest_id)
+        else:
+            last_id = last_event_id
+
+        loop = asyncio.get_running_loop()
+        last_sent = loop.time()
+        needs_catch_up = last_id < latest_id
+        while True:
+            if not needs_catch_up:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    event = None
+
+                if event is not None and event['id'] <= last_id:
+                    continue
+                if event is not None and event['id'] == last_id + 1:
+                    last_id = event['id']
+                    last_sent = loop.time()
+                    yield format_sse(event, event='stock', event_id=last_id)
+                    continue
+
+            events = await fetch_events_since(last_id, batch_size)
+            for event in events:
+                last_id = event['id']
+                yield format_sse(event, event='stock', event_id=last_id)
+            if events:
+                last_sent = loop.time()
+            # Keep reading while full batches come back
+            needs_catch_up = len(events) == batch_size
+
+            if loop.time() - last_sent >= keepalive_interval:
+                last_sent = loop.time()
+                yield ': keep-alive\n\n'
+    finally:
+        broadcaster.unsubscribe(queue)
@@ -0,0 +1,223 @@
+from datetime import timezone as dt_timezone
+
+from django.db.models import Max
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .counters import STOCK_QUANTITY
+from .models import Product, StockTransaction, ArchivedStockTransaction
+from .reports import ReportFilters
+
+FORMATS = ('parquet', 'arrow')
+
+# Column name, values() source and Arrow type name of each exported dataset.
+# Types are names so pyarrow is only imported when an export runs.
+TRANSACTION_COLUMNS = [
+    ('id', 'id', 'int64'),
+    ('date', 'date', 'timestamp'),
+    ('product_id', 'product_id', 'int64'),
+    ('product_name', 'product__name', 'string'),
+    ('product_sku', 'product__sku', 'string'),
+    ('product_type', 'product__type__name', 'string'),
+    ('type', 'type', 'string'),
+    ('quantity', 'quantity', 'int64'),
+    ('unit_price', 'unit_price', 'decimal10'),
+    ('discount', 'discount', 'decimal10'),
+    ('line_total', 'line_total', 'decimal14'),
+    ('net_total', 'net_total', 'decimal14'),
+    ('wastage', 'wastage', 'decimal10'),
+    ('is_wastage', 'is_wastage', 'bool'),
+    ('is_opening_balance', 'is_opening_balance', 'bool'),
+    ('supplier_id', 'supplier_ref_id', 'int64'),
+    ('supplier_name', Coalesce('supplier_ref__name', 'supplier'), 'string'),
+    ('client_id', 'client_ref_id', 'int64'),
+    ('client_name', Coalesce('client_ref__name', 'client'), 'string'),
+    ('reference_number', 'reference_number', 'string'),
+    ('notes', 'notes', 'string'),
+]
+
+PRODUCT_COLUMNS = [
+    ('id', 'id', 'int64'),
+    ('name', 'name', 'string'),
+    ('sku', 'sku', 'string'),
+    ('type', 'type__name', 'string'),
+    ('quantity', STOCK_QUANTITY, 'int64'),
+    ('buying_price', 'buying_price', 'decimal10'),
+    ('selling_price', 'selling_price', 'decimal10'),
+    ('price', 'price', 'decimal10'),
+    ('location', 'location', 'string'),
+    ('expiry_date', 'expiry_date', 'date'),
+    ('batch_number', 'batch_number', 'string'),
+    ('barcode', 'barcode', 'string'),
+    ('minimum_stock_level', 'minimum_stock_level', 'int64'),
+    ('unit_of_measure', 'unit_of_measure', 'string'),
+    ('wastage', 'wastage', 'decimal10'),
+    ('created_at', 'created_at', 'timestamp'),
+    ('updated_at', 'updated_at', 'timestamp'),
+]
+
+
+class ExportUnavailable(Exception):
+    """pyarrow, which writes the export files, is not installed."""
+
+
+def load_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportUnavailable('Exports need pyarrow. Install it with: pip install -r requirements-export.txt')
+    return pyarrow
+
+
+def arrow_type(pa, name):
+    return {
+        'int64': pa.int64(),
+        'string': pa.string(),
+        'bool': pa.bool_(),
+        'date': pa.date32(),
+        'timestamp': pa.timestamp('us', tz='UTC'),
+        'decimal10': pa.decimal128(10, 2),
+        'decimal14': pa.decimal128(14, 2),
+    }[name]
+
+
+class LedgerExport:
+    """
+    One export of stock transactions or products, ready to be written.
+
+    Transactions can be limited to a date range (``start``/``end``, end
+    exclusive) and to ids above ``after_id`` for incremental exports. The
+    export stops at the newest id present when it was planned; that id is
+    the ``watermark`` to pass as ``after_id`` next time. Date ranges reaching
+    into the archive read it too.
+    """
+
+    def __init__(self, dataset='transactions', start=None, end=None, after_id=None):
+        if dataset not in ('transactions', 'products'):
+            raise ValueError("dataset must be 'transactions' or 'products'")
+        self.dataset = dataset
+        self.exported_at = timezone.now()
+
+        if dataset == 'products':
+            self.columns = PRODUCT_COLUMNS
+            self.querysets = [Product.objects.order_by('id')]
+            self.watermark = None
+            return
+
+        self.columns = TRANSACTION_COLUMNS
+        self.querysets = []
+        # Archived rows keep their ids and are older, so they come first;
+        # incremental exports only follow new ids, which are never archived
+        if after_id is None and ReportFilters(start_date=start, end_date=end).needs_archive():
+            self.querysets.append(self.in_range(ArchivedStockTransaction.objects.all(), start, end))
+
+        ledger = self.in_range(StockTransaction.objects.all(), start, end)
+        if after_id is not None:
+            ledger = ledger.filter(id__gt=after_id)
+        last_id = StockTransaction.objects.aggregate(last=Max('id'))['last'] or 0
+        self.watermark = max(last_id, after_id or 0)
+        self.querysets.append(ledger.filter(id__lte=self.watermark))
+
+    @staticmethod
+    def in_range(queryset, start, end):
+        if start:
+            queryset = queryset.filter(date__gte=start)
+        if end:
+            queryset = queryset.filter(date__lt=end)
+        return queryset.order_by('id')
+
+    def schema(self, pa):
+        metadata = {'dataset': self.dataset, 'exported_at': self.exported_at.isoformat()}
+        if self.watermark is not None:
+            metadata['watermark'] = str(self.watermark)
+        return pa.schema(
+            [pa.field(name, arrow_type(pa, type_name)) for name, _, type_name in self.columns],
+            metadata=metadata,
+        )
+
+    def batches(self, pa, schema, batch_size):
+        """Record batches of ``batch_size`` rows, streamed from iterator()."""
+        sources = [source for _, source, _ in self.columns]
+        for queryset in self.querysets:
+            rows = []
+            for row in queryset.values_list(*sources).iterator(chunk_size=min(batch_size, 10000)):
+                rows.append(row)
+                if len(rows) == batch_size:
+                    yield self.record_batch(pa, schema, rows)
+                    rows = []
+            if rows:
+                yield self.record_batch(pa, schema, rows)
+
+    def record_batch(self, pa, schema, rows):
+        columns = zip(*rows)
+        return pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema,
+        )
+
+    def write(self, sink, file_format='parquet', batch_size=50000, compression='snappy'):
+        """
+        Write the export to ``sink`` (a path or writable file object), one
+        Parquet row group or Arrow record batch per ``batch_size`` rows, and
+        yield the number of rows written after each batch.
+        """
+        if file_format not in FORMATS:
+            raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+        pa = load_pyarrow()
+        schema = self.schema(pa)
+        if file_format == 'parquet':
+            writer = pa.parquet.ParquetWriter(sink, schema, compression=compression)
+        else:
+            writer = pa.ipc.new_file(sink, schema)
+        written = 0
+        try:
+            for batch in self.batches(pa, schema, batch_size):
+                writer.write_batch(batch)
+                written += batch.num_rows
+                yield written
+        finally:
+            writer.close()
+
+
+class ChunkSink:
+    """Write-only file object collecting what the writer produces, so it can be streamed."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_export(export, file_format='parquet', batch_size=50000, compression='snappy'):
+    """Yield the export file in pieces as each batch is written, for a streaming response."""
+    sink = ChunkSink()
+    for _ in export.write(sink, file_format, batch_size, compression):
+        yield sink.drain()
+    # The footer is written when the writer closes
+    yield sink.drain()
+
+
+def export_filename(export, file_format):
+    stamp = export.exported_at.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    extension = 'parquet' if file_format == 'parquet' else 'arrow'
+    return f'{export.dataset}-{stamp}.{extension}'
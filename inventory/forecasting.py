@@ -0,0 +1,169 @@
+import math
+from datetime import timedelta
+from statistics import NormalDist
+
+import numpy as np
+from django.db import connection
+from django.db.models import Sum
+from django.db.models.functions import TruncDate, Substr
+from django.utils import timezone
+
+from .counters import STOCK_QUANTITY
+from .models import Product, StockTransaction, ArchivedStockTransaction, ReorderSuggestion
+
+SUGGESTION_FIELDS = ['method', 'daily_demand', 'demand_std', 'safety_stock', 'reorder_point',
+                     'suggested_quantity', 'needs_reorder', 'computed_at']
+
+
+class ForecastSettings:
+    def __init__(self, method='ses', history_days=730, window=28, alpha=0.3,
+                 lead_time_days=7, review_days=30, service_level=0.95):
+        if method not in ('sma', 'ses'):
+            raise ValueError("method must be 'sma' or 'ses'")
+        if not 0 < alpha <= 1:
+            raise ValueError('alpha must be in (0, 1]')
+        if not 0.5 <= service_level < 1:
+            raise ValueError('service level must be in [0.5, 1)')
+        if window < 1 or window > history_days:
+            raise ValueError('window must be between 1 and the history length')
+        if lead_time_days < 0:
+            raise ValueError('lead time must be zero or more days')
+        if review_days < 0:
+            raise ValueError('review days must be zero or more')
+        self.method = method
+        self.history_days = history_days
+        self.window = window
+        self.alpha = alpha
+        self.lead_time_days = lead_time_days
+        self.review_days = review_days
+        self.service_level = service_level
+        self.z = NormalDist().inv_cdf(service_level)
+
+
+def sale_day():
+    """
+    Day of a ledger row, for grouping.
+
+    SQLite evaluates TruncDate with a Python function per row, which
+    dominates large runs; its stored UTC timestamps begin with the date, so
+    slicing the text gives the same day (TIME_ZONE is UTC) natively.
+    """
+    if connection.vendor == 'sqlite':
+        return Substr('date', 1, 10)
+    return TruncDate('date')
+
+
+def daily_sales_matrix(product_ids, start, days):
+    """
+    Units sold per product per day as a (products x days) array.
+
+    One grouped query per ledger table fetches the daily OUT totals of all
+    the given products; ``product_ids`` must be sorted.
+    """
+    ids = np.asarray(product_ids, dtype=np.int64)
+    matrix = np.zeros((len(ids), days), dtype=np.float32)
+    if not len(ids):
+        return matrix
+
+    tables = [StockTransaction.objects]
+    if ArchivedStockTransaction.objects.filter(date__gte=start).exists():
+        tables.append(ArchivedStockTransaction.objects)
+
+    end = start + timedelta(days=days)
+    start_day = np.datetime64(start.date(), 'D')
+    for table in tables:
+        rows = list(
+            table
+            .filter(type='OUT', is_opening_balance=False, date__gte=start, date__lt=end,
+                    product_id__gte=int(ids[0]), product_id__lte=int(ids[-1]))
+            .order_by()
+            .annotate(day=sale_day())
+            .values('product_id', 'day')
+            .annotate(total=Sum('quantity'))
+            .values_list('product_id', 'day', 'total')
+        )
+        if not rows:
+            continue
+        row_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        positions = np.searchsorted(ids, row_ids)
+        # Days come back as dates or ISO strings depending on the database
+        columns = (np.array([row[1] for row in rows], dtype='datetime64[D]') - start_day).astype(np.int64)
+        totals = np.fromiter((row[2] for row in rows), dtype=np.float32, count=len(rows))
+        valid = (columns >= 0) & (columns < days) & (positions < len(ids))
+        valid &= ids[np.minimum(positions, len(ids) - 1)] == row_ids
+        np.add.at(matrix, (positions[valid], columns[valid]), totals[valid])
+    return matrix
+
+
+def forecast(matrix, settings):
+    """
+    Daily demand forecast and demand standard deviation for every row of
+    ``matrix``, vectorized across products.
+    """
+    recent = matrix[:, -settings.window:]
+    if settings.method == 'sma':
+        level = recent.mean(axis=1)
+    else:
+        # Exponential smoothing, one vector step per day of history
+        level = matrix[:, 0].astype(np.float64)
+        for day in range(1, matrix.shape[1]):
+            level = settings.alpha * matrix[:, day] + (1 - settings.alpha) * level
+    return level.astype(np.float64), recent.std(axis=1).astype(np.float64)
+
+
+def suggest(quantities, daily_demand, demand_std, settings):
+    """Safety stock, reorder point and order quantity arrays."""
+    safety_stock = np.ceil(settings.z * demand_std * math.sqrt(settings.lead_time_days))
+    reorder_point = np.ceil(daily_demand * settings.lead_time_days + safety_stock)
+    order_up_to = np.ceil(daily_demand * (settings.lead_time_days + settings.review_days) + safety_stock)
+    suggested_quantity = np.maximum(order_up_to - quantities, 0)
+    return safety_stock, reorder_point, suggested_quantity
+
+
+def run_forecast(settings, chunk_size=10000, stdout=None):
+    """
+    Recompute reorder suggestions for every product, ``chunk_size`` products
+    at a time so memory stays bounded. Returns the number of products.
+    """
+    now = timezone.now()
+    # Whole days only: today is still in progress
+    end = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=settings.history_days)
+
+    products = Product.objects.order_by('id').values_list('id', STOCK_QUANTITY)
+    last_id = 0
+    processed = 0
+    while True:
+        chunk = list(products.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+        ids = [row[0] for row in chunk]
+        quantities = np.array([row[1] for row in chunk], dtype=np.float64)
+
+        matrix = daily_sales_matrix(ids, start, settings.history_days)
+        daily_demand, demand_std = forecast(matrix, settings)
+        safety_stock, reorder_point, suggested_quantity = suggest(quantities, daily_demand, demand_std, settings)
+
+        suggestions = [
+            ReorderSuggestion(
+                product_id=product_id,
+                method=settings.method,
+                daily_demand=round(float(daily_demand[i]), 4),
+                demand_std=round(float(demand_std[i]), 4),
+                safety_stock=int(safety_stock[i]),
+                reorder_point=int(reorder_point[i]),
+                suggested_quantity=int(suggested_quantity[i]),
+                needs_reorder=bool(quantities[i] <= reorder_point[i] and daily_demand[i] > 0),
+                computed_at=now,
+            )
+            for i, product_id in enumerate(ids)
+        ]
+        ReorderSuggestion.objects.bulk_create(
+            suggestions, batch_size=1000,
+            update_conflicts=True, unique_fields=['product'], update_fields=SUGGESTION_FIELDS,
+        )
+        processed += len(chunk)
+        if stdout:
+            stdout.write(f'Forecast {processed} products...')
+    return processed
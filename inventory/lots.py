@@ -0,0 +1,74 @@
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .models import Lot
+
+# First-expiry-first-out: dated lots by expiry, then undated ones, oldest first
+FEFO_ORDER = [F('expiry_date').asc(nulls_last=True), 'id']
+
+
+def open_lots(product):
+    return Lot.objects.filter(product=product, quantity__gt=0).order_by(*FEFO_ORDER)
+
+
+def expired_quantity(product, today=None):
+    """Units of the product left in lots past their expiry date, which can't be sold."""
+    today = today or timezone.localdate()
+    return (
+        Lot.objects.filter(product=product, quantity__gt=0, expiry_date__lt=today)
+        .aggregate(total=Sum('quantity'))['total'] or 0
+    )
+
+
+def receive_lot(product, quantity, batch_number=None, expiry_date=None):
+    return Lot.objects.create(
+        product=product,
+        batch_number=batch_number or None,
+        expiry_date=expiry_date,
+        quantity=quantity,
+        received_quantity=quantity,
+    )
+
+
+def allocate_fefo(product, quantity, today=None):
+    """
+    Take ``quantity`` units from the product's open lots that have not
+    expired, earliest expiry first, and return ``[(lot, taken)]``. Stock
+    not held in lots covers whatever the lots can't; the caller checks
+    there is enough of it besides the expired lots (expired_quantity).
+
+    Lot changes of a product are serialized by the caller holding the
+    product row lock.
+    """
+    today = today or timezone.localdate()
+    allocations = []
+    remaining = quantity
+    sellable = open_lots(product).filter(Q(expiry_date__isnull=True) | Q(expiry_date__gte=today))
+    for lot in sellable.iterator(chunk_size=100):
+        taken = min(lot.quantity, remaining)
+        lot.quantity -= taken
+        allocations.append((lot, taken))
+        remaining -= taken
+        if not remaining:
+            break
+    if allocations:
+        Lot.objects.bulk_update([lot for lot, _ in allocations], ['quantity'])
+    return allocations
+
+
+def refresh_product_expiry(product):
+    """Mirror the next lot to expire onto the product's expiry and batch fields."""
+    lot = open_lots(product).only('batch_number', 'expiry_date').first()
+    product.expiry_date = lot.expiry_date if lot else None
+    product.batch_number = lot.batch_number if lot else None
+
+
+def expiring_lots(before, since=None):
+    """
+    Lots with stock left expiring on or before ``before`` (and on or after
+    ``since``), read as a range of the (expiry_date, product) index.
+    """
+    lots = Lot.objects.filter(quantity__gt=0, expiry_date__lte=before)
+    if since:
+        lots = lots.filter(expiry_date__gte=since)
+    return lots.order_by('expiry_date', 'product_id', 'id')
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from inventory.archive import archive_transactions
+from inventory.models import StockTransaction
+
+
+class Command(BaseCommand):
+    help = 'Moves stock transactions older than a cutoff into the archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='Archive transactions dated before this day (YYYY-MM-DD)')
+        parser.add_argument('--older-than-days', type=int, help='Archive transactions older than this many days')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows moved per database transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = self.get_cutoff(options)
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        candidates = StockTransaction.objects.filter(date__lt=cutoff)
+
+        if options['dry_run']:
+            count = candidates.count()
+            products = candidates.values('product_id').distinct().count()
+            self.stdout.write(f'Would archive {count} transactions of {products} products dated before {cutoff:%Y-%m-%d}')
+            return
+
+        moved = 0
+        for moved in archive_transactions(candidates, cutoff, chunk_size):
+            self.stdout.write(f'Archived {moved} transactions...')
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully archived {moved} transactions dated before {cutoff:%Y-%m-%d}'))
+
+    def get_cutoff(self, options):
+        if options['before'] and options['older_than_days'] is not None:
+            raise CommandError('Use either --before or --older-than-days, not both')
+        if options['before']:
+            try:
+                return timezone.make_aware(datetime.strptime(options['before'], '%Y-%m-%d'))
+            except ValueError:
+                raise CommandError('Invalid --before date. Use YYYY-MM-DD')
+        if options['older_than_days'] is not None:
+            day = timezone.localdate() - timedelta(days=options['older_than_days'])
+            return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+        raise CommandError('Specify a cutoff with --before or --older-than-days')
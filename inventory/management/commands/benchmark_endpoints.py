@@ -0,0 +1,149 @@
+import json
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from inventory.benchmarks import endpoint_requests, uncovered_routes
+from inventory.models import Product, Supplier, Client as Account, StockTransaction, Lot
+
+
+class Rollback(Exception):
+    pass
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Requests every API endpoint through the test client on the current data and reports p50/p95 '
+            'latency, queries per request and peak memory, saved as JSON. Writes are rolled back')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Timed requests per endpoint')
+        parser.add_argument('--days', type=int, default=30, help='Days covered by the report requests')
+        parser.add_argument('--only', help='Only endpoints whose label contains this text')
+        parser.add_argument('--output', help='JSON file for the results (default: benchmark-<commit>-<time>.json)')
+        parser.add_argument('--compare', help='Earlier results file to compare with')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+        previous = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    previous = json.load(f)['endpoints']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f'Cannot read {options["compare"]}: {e}')
+
+        results = {
+            'commit': current_commit(),
+            'created_at': timezone.now().isoformat(),
+            'repeat': options['repeat'],
+            'dataset': {
+                'products': Product.objects.count(),
+                'suppliers': Supplier.objects.count(),
+                'clients': Account.objects.count(),
+                'transactions': StockTransaction.objects.count(),
+                'lots': Lot.objects.count(),
+            },
+            'endpoints': {},
+        }
+        self.stdout.write(f"Dataset: {results['dataset']}")
+        self.stdout.write(f"{'endpoint':32} {'status':>6} {'cold ms':>9} {'p50 ms':>9} {'p95 ms':>9} "
+                          f"{'queries':>7} {'peak KiB':>9} {'KiB':>8}")
+        try:
+            # Every request is slow on purpose here; no need to log each one
+            with transaction.atomic(), override_settings(SLOW_REQUEST_THRESHOLD=None):
+                self.run(options, results['endpoints'], previous)
+                raise Rollback
+        except Rollback:
+            pass
+
+        output = options['output'] or f"benchmark-{results['commit'] or 'local'}-{timezone.now():%Y%m%dT%H%M%S}.json"
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Results saved to {output}'))
+
+    def run(self, options, endpoints, previous):
+        user = User.objects.create_superuser('benchmark', 'benchmark@example.com', None)
+        # A host from ALLOWED_HOSTS, as this doesn't run under the test runner
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(user)
+
+        requests = endpoint_requests(options['days'])
+        missing = uncovered_routes(requests)
+        if missing:
+            self.stdout.write(self.style.WARNING(f"Routes without a benchmark: {', '.join(sorted(missing))}"))
+
+        for label, _, method, path, data in requests:
+            if options['only'] and options['only'] not in label:
+                continue
+
+            def request():
+                if method == 'get':
+                    response = client.get(path)
+                else:
+                    response = client.generic(method.upper(), path, json.dumps(data), 'application/json')
+                body = b''.join(response.streaming_content) if response.streaming else response.content
+                return response, body
+
+            # The first request fills caches (analytics, the query planner's)
+            with CaptureQueriesContext(connection) as cold_queries:
+                start = time.perf_counter()
+                response, body = request()
+                cold = time.perf_counter() - start
+
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                request()
+                timings.append(time.perf_counter() - start)
+
+            with CaptureQueriesContext(connection) as queries:
+                tracemalloc.start()
+                try:
+                    request()
+                    peak = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+
+            result = {
+                'method': method.upper(),
+                'path': path,
+                'status': response.status_code,
+                'bytes': len(body),
+                'cold_ms': round(cold * 1000, 2),
+                'p50_ms': round(float(np.percentile(timings, 50)) * 1000, 2),
+                'p95_ms': round(float(np.percentile(timings, 95)) * 1000, 2),
+                'mean_ms': round(float(np.mean(timings)) * 1000, 2),
+                'cold_queries': len(cold_queries),
+                'queries': len(queries),
+                'peak_memory_kib': round(peak / 1024),
+            }
+            endpoints[label] = result
+            self.stdout.write(
+                f"{label:32} {result['status']:>6} {result['cold_ms']:>9.1f} {result['p50_ms']:>9.1f} "
+                f"{result['p95_ms']:>9.1f} {result['queries']:>7} {result['peak_memory_kib']:>9} "
+                f"{result['bytes'] / 1024:>8.0f}"
+            )
+            if previous and label in previous:
+                self.compare(previous[label], result)
+
+    def compare(self, before, after):
+        change = (after['p50_ms'] / before['p50_ms'] - 1) * 100 if before['p50_ms'] else 0
+        style = self.style.ERROR if change > 10 else self.style.SUCCESS if change < -10 else str
+        queries = '' if before['queries'] == after['queries'] else f", queries {before['queries']} -> {after['queries']}"
+        self.stdout.write(style(f"{'':32} was p50 {before['p50_ms']:.1f} ms ({change:+.0f}%){queries}"))
@@ -0,0 +1,90 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from inventory.models import Product, ProductType, Supplier, Client, StockTransaction
+from inventory.serializers import StockTransactionSerializer, ProductSerializer, TRANSACTION_ROWS, PRODUCT_ROWS
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Compares rows per second of the serializer and values() paths for stock transaction and '
+            'product lists, on generated rows that are rolled back afterwards')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Stock transactions to generate')
+        parser.add_argument('--products', type=int, default=1000, help='Products to generate')
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['products'] < 1:
+            raise CommandError('--rows and --products must be at least 1')
+        try:
+            with transaction.atomic():
+                self.generate(options['rows'], options['products'])
+                transactions = StockTransaction.objects.order_by('-date')
+                # The serializer path gets its joins too, so only serialization differs
+                self.compare(
+                    'stock transactions',
+                    lambda: StockTransactionSerializer(
+                        transactions.select_related('product', 'supplier_ref', 'client_ref'), many=True
+                    ).data,
+                    lambda: TRANSACTION_ROWS.render(transactions),
+                )
+                products = Product.objects.order_by('id')
+                self.compare(
+                    'products',
+                    lambda: ProductSerializer(products.select_related('type'), many=True).data,
+                    lambda: PRODUCT_ROWS.render(products),
+                )
+                raise Rollback
+        except Rollback:
+            pass
+
+    def generate(self, rows, product_count):
+        self.stdout.write(f'Generating {rows} transactions over {product_count} products...')
+        product_type = ProductType.objects.create(name='Benchmark')
+        products = Product.objects.bulk_create([
+            Product(name=f'Benchmark product {i}', sku=f'BENCH-{i}', type=product_type,
+                    buying_price=10, selling_price=15, price='12.50')
+            for i in range(product_count)
+        ])
+        supplier = Supplier.objects.create(name='Benchmark supplier')
+        client = Client.objects.create(name='Benchmark client')
+        StockTransaction.objects.bulk_create(
+            (
+                StockTransaction(
+                    product=products[i % product_count],
+                    quantity=i % 20 + 1,
+                    type='IN' if i % 2 else 'OUT',
+                    unit_price='12.50',
+                    discount='0.50',
+                    # Mix linked accounts and legacy names
+                    supplier_ref=supplier if i % 4 == 1 else None,
+                    supplier='Legacy supplier' if i % 4 == 3 else None,
+                    client_ref=client if i % 4 == 0 else None,
+                    client='Walk-in' if i % 4 == 2 else None,
+                    notes=f'Benchmark row {i}',
+                )
+                for i in range(rows)
+            ),
+            batch_size=5000,
+        )
+
+    def compare(self, label, serializer_path, values_path):
+        renderer = JSONRenderer()
+        results = {}
+        for name, path in (('serializer', serializer_path), ('values', values_path)):
+            start = time.perf_counter()
+            data = path()
+            elapsed = time.perf_counter() - start
+            results[name] = renderer.render(data)
+            self.stdout.write(f'{label}, {name} path: {len(data)} rows in {elapsed:.2f}s, '
+                              f'{len(data) / elapsed:,.0f} rows/s')
+        if results['serializer'] == results['values']:
+            self.stdout.write(self.style.SUCCESS(f'{label}: output is byte-identical'))
+        else:
+            self.stdout.write(self.style.ERROR(f'{label}: output differs'))
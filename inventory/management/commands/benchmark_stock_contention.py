@@ -0,0 +1,115 @@
+import threading
+import time
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from inventory import counters
+from inventory.benchmarks import api_path
+from inventory.models import Product, ProductType, StockTransaction
+
+BENCHMARK_SKU = 'BENCHMARK-CONTENTION'
+BENCHMARK_USERNAME = 'benchmark-contention'
+
+
+def remove_product(product_id):
+    """
+    Delete a benchmark product with every row referencing it (ledger, stats,
+    counter slots, lots...). Benchmark rows are not history, so the
+    post_delete handlers and the sync tombstones they write are skipped.
+    """
+    for relation in Product._meta.related_objects:
+        related = relation.related_model
+        related.objects.filter(**{relation.field.name: product_id})._raw_delete(related.objects.db)
+    Product.objects.filter(id=product_id)._raw_delete(Product.objects.db)
+
+
+class Command(BaseCommand):
+    help = ('Posts concurrent OUT movements of one product from several threads, with its row locked per '
+            'movement and with sharded stock counters, and reports the throughput of each. Creates and '
+            'removes its own product; run it on a copy of the database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent clients')
+        parser.add_argument('--movements', type=int, default=200, help='OUT movements posted per client')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['movements'] < 1:
+            raise CommandError('--threads and --movements must be at least 1')
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING(
+                'SQLite runs one write transaction at a time, so sharding can only show its gain on a '
+                'database with row locks such as PostgreSQL. Without "transaction_mode": "IMMEDIATE" in the '
+                'database OPTIONS, concurrent movements fail with "database is locked" (counted as errors)'
+            ))
+
+        # Left behind by an interrupted run
+        User.objects.filter(username=BENCHMARK_USERNAME).delete()
+        for product_id in Product.objects.filter(sku=BENCHMARK_SKU).values_list('id', flat=True):
+            remove_product(product_id)
+
+        user = User.objects.create_superuser(BENCHMARK_USERNAME, 'benchmark@example.com', None)
+        product_type = ProductType.objects.get_or_create(name='Benchmark')[0]
+        self.stdout.write(f"{'mode':8} {'movements/s':>11} {'p50 ms':>9} {'p95 ms':>9} {'errors':>6} {'stock':>6}")
+        try:
+            # Every movement is slow under contention; no need to log each one
+            with override_settings(SLOW_REQUEST_THRESHOLD=None):
+                for sharded in (False, True):
+                    self.run(user, product_type, sharded, options['threads'], options['movements'])
+        finally:
+            user.delete()
+
+    def run(self, user, product_type, sharded, threads, movements):
+        stock = threads * movements
+        product = Product.objects.create(name='Contention benchmark', sku=BENCHMARK_SKU, type=product_type,
+                                         quantity=stock)
+        if sharded:
+            counters.enable(product.id)
+
+        timings = []
+        errors = []
+        start = threading.Barrier(threads + 1)
+
+        def client_thread():
+            client = Client(HTTP_HOST='localhost')
+            client.force_login(user)
+            data = {'product': product.id, 'quantity': 1, 'type': 'OUT'}
+            try:
+                start.wait()
+                for _ in range(movements):
+                    started = time.perf_counter()
+                    response = client.post(api_path('stock-update'), data, content_type='application/json')
+                    timings.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=client_thread) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        start.wait()
+        started = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        try:
+            # Every accepted movement must be in both the ledger and the stock
+            product = counters.compact(product.id)
+            recorded = StockTransaction.objects.filter(product=product).count()
+            consistent = product.quantity == stock - recorded and product.quantity >= 0
+            self.stdout.write(
+                f"{'sharded' if sharded else 'locked':8} {(len(timings) - len(errors)) / elapsed:>11.1f} "
+                f"{np.percentile(timings, 50) * 1000:>9.1f} {np.percentile(timings, 95) * 1000:>9.1f} "
+                f"{len(errors):>6} {product.quantity:>6}"
+            )
+            if not consistent:
+                self.stdout.write(self.style.ERROR(
+                    f'Stock {product.quantity} does not match the {recorded} recorded movements'
+                ))
+        finally:
+            remove_product(product.id)
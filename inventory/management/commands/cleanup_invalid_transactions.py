@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from inventory.models import Product
+from inventory.product_stats import refresh
+from inventory.reconciliation import find_mismatches, invalid_transactions, repair_quantities, repair_ledger
+
+
+class Command(BaseCommand):
+    help = 'Reconciles product quantities against the stock transaction ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repair', choices=['quantity', 'ledger'],
+            help="Fix mismatches: 'quantity' sets Product.quantity to the ledger balance, "
+                 "'ledger' writes adjustment transactions to match Product.quantity"
+        )
+        parser.add_argument('--delete-invalid', action='store_true',
+                            help='Delete transactions with an unknown type, non-positive quantity or missing product')
+        parser.add_argument('--chunk-size', type=int, default=0,
+                            help='Reconcile this many products per query instead of the whole ledger at once')
+        parser.add_argument('--show', type=int, default=20, help='Number of mismatches to list')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        invalid = invalid_transactions()
+        invalid_count = invalid.count()
+        if invalid_count:
+            self.stdout.write(self.style.WARNING(f'Found {invalid_count} invalid transactions'))
+            if options['delete_invalid']:
+                product_ids = set(invalid.order_by().values_list('product_id', flat=True).distinct())
+                invalid.delete()
+                refresh(product_ids)
+                self.stdout.write(self.style.SUCCESS(f'Deleted {invalid_count} invalid transactions'))
+
+        mismatches = list(find_mismatches(chunk_size=options['chunk_size']))
+        elapsed = time.monotonic() - started
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS(f'All product quantities match the ledger ({elapsed:.2f}s)'))
+            return
+
+        self.stdout.write(self.style.WARNING(f'Found {len(mismatches)} products not matching the ledger ({elapsed:.2f}s)'))
+        shown = mismatches[:options['show']]
+        names = dict(Product.objects.filter(id__in=[m[0] for m in shown]).values_list('id', 'sku'))
+        for product_id, quantity, balance in shown:
+            self.stdout.write(f'  {names.get(product_id, product_id)}: quantity {quantity}, ledger {balance} ({quantity - balance:+d})')
+        if len(mismatches) > len(shown):
+            self.stdout.write(f'  ... and {len(mismatches) - len(shown)} more')
+
+        if options['repair'] == 'quantity':
+            # Locks and commits a chunk of products at a time
+            count = repair_quantities(mismatches)
+            self.stdout.write(self.style.SUCCESS(f'Set quantity from the ledger for {count} products'))
+        elif options['repair'] == 'ledger':
+            with transaction.atomic():
+                count = repair_ledger(mismatches)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {count} adjustment transactions'))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from inventory import product_stats
+from inventory.counters import compact, pending_products
+from inventory.models import Product
+
+
+class Command(BaseCommand):
+    help = ('Folds the counter slots of products with sharded stock back into their quantity and brings '
+            'their product stats up to date. Run it every minute or so; until then their stats lag behind '
+            'and stock reads add up the slots')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=float, metavar='SECONDS',
+                            help='Keep running, compacting every this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            # Each product in its own short transaction, so movements of the
+            # others never wait for the whole run
+            count = 0
+            for product_id in list(pending_products()):
+                compact(product_id)
+                count += 1
+            # Their movements taken on slots skipped the stats rows
+            stale = product_stats.refresh(product_stats.stale_products(Product.objects.filter(sharded_stock=True)))
+            self.stdout.write(self.style.SUCCESS(
+                f'Compacted the stock counters of {count} products and refreshed the stats of {stale} '
+                f'({time.monotonic() - started:.2f}s)'
+            ))
+            if not options['loop']:
+                return
+            time.sleep(options['loop'])
@@ -0,0 +1,54 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from inventory.export import FORMATS, ExportUnavailable, LedgerExport
+from inventory.reports import ReportFilters
+
+
+class Command(BaseCommand):
+    help = ('Writes stock transactions (with product, supplier and client names) or a product snapshot '
+            'to a Parquet or Arrow IPC file, in batches streamed from the database. Needs pyarrow: '
+            'pip install -r requirements-export.txt')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='File to write; the format follows its extension (.parquet, .arrow)')
+        parser.add_argument('--dataset', choices=('transactions', 'products'), default='transactions')
+        parser.add_argument('--format', choices=FORMATS, dest='file_format',
+                            help='File format, when the extension does not give it (default: parquet)')
+        parser.add_argument('--start-date', help='First transaction date to export, YYYY-MM-DD')
+        parser.add_argument('--end-date', help='Last transaction date to export, YYYY-MM-DD')
+        parser.add_argument('--after-id', type=int,
+                            help='Only export transactions with a higher id (the watermark of the last export)')
+        parser.add_argument('--batch-size', type=int, default=50000,
+                            help='Rows per Parquet row group / Arrow record batch')
+        parser.add_argument('--compression', default='snappy', help='Parquet compression codec')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        file_format = options['file_format'] or self.format_from_extension(options['output'])
+        try:
+            filters = ReportFilters.from_params({
+                key: options[key] for key in ('start_date', 'end_date') if options[key]
+            })
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        export = LedgerExport(options['dataset'], filters.start_date, filters.end_date, options['after_id'])
+        written = 0
+        try:
+            for written in export.write(options['output'], file_format, options['batch_size'],
+                                        options['compression']):
+                self.stdout.write(f'{written} rows written...')
+        except ExportUnavailable as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f'Exported {written} {options["dataset"]} to {options["output"]}'))
+        if export.watermark is not None:
+            self.stdout.write(f'Watermark: {export.watermark} (pass --after-id {export.watermark} next time)')
+
+    def format_from_extension(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension in ('.arrow', '.feather', '.ipc'):
+            return 'arrow'
+        return 'parquet'
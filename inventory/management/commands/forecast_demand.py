@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from inventory.forecasting import ForecastSettings, run_forecast
+
+
+class Command(BaseCommand):
+    help = 'Forecasts daily demand per product and stores suggested reorder points and quantities'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--method', choices=['sma', 'ses'], default='ses',
+                            help="'sma' for a moving average, 'ses' for exponential smoothing (default)")
+        parser.add_argument('--history-days', type=int, default=730, help='Days of sales history to load')
+        parser.add_argument('--window', type=int, default=28,
+                            help='Days used for the moving average and demand variability')
+        parser.add_argument('--alpha', type=float, default=0.3, help='Smoothing factor for exponential smoothing')
+        parser.add_argument('--lead-time', type=int, default=7, help='Supplier lead time in days')
+        parser.add_argument('--review-days', type=int, default=30, help='Days of demand each order should cover')
+        parser.add_argument('--service-level', type=float, default=0.95,
+                            help='Target probability of not running out during the lead time')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Products forecast per batch')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        try:
+            settings = ForecastSettings(
+                method=options['method'],
+                history_days=options['history_days'],
+                window=options['window'],
+                alpha=options['alpha'],
+                lead_time_days=options['lead_time'],
+                review_days=options['review_days'],
+                service_level=options['service_level'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        started = time.monotonic()
+        count = run_forecast(settings, chunk_size=options['chunk_size'], stdout=self.stdout)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Successfully forecast demand for {count} products in {elapsed:.1f}s'))
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from inventory.datagen import DatasetGenerator
+
+
+class Command(BaseCommand):
+    help = ('Bulk inserts a synthetic dataset (product types, products, suppliers, clients, stock '
+            'transactions and lots) with realistic skew, for benchmarks. Rows are added, not replaced')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--suppliers', type=int, default=200)
+        parser.add_argument('--clients', type=int, default=2000)
+        parser.add_argument('--transactions', type=int, default=1000000)
+        parser.add_argument('--types', type=int, default=25, help='Product types')
+        parser.add_argument('--days', type=int, default=365, help='Days of history the transactions span')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same data')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per INSERT transaction')
+        parser.add_argument('--prefix', default='GEN', help='Prefix of generated names and SKUs')
+
+    def handle(self, *args, **options):
+        if options['products'] < 1 or options['types'] < 1 or options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--products, --types, --days and --batch-size must be at least 1')
+        if min(options['suppliers'], options['clients'], options['transactions']) < 0:
+            raise CommandError('Counts cannot be negative')
+
+        generator = DatasetGenerator(
+            products=options['products'],
+            suppliers=options['suppliers'],
+            clients=options['clients'],
+            transactions=options['transactions'],
+            types=options['types'],
+            days=options['days'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            prefix=options['prefix'],
+            log=self.stdout.write,
+        )
+        started = time.perf_counter()
+        try:
+            generator.run()
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Dataset generated in {time.perf_counter() - started:.1f}s'))
@@ -33,8 +33,9 @@ class Command(BaseCommand):
         product_types = ['Jewelry', 'Accessories', 'Apparel', 'Home Decor', 'Gifts']
 
         # Create product types
+        types_by_name = {}
         for type_name in product_types:
-            ProductType.objects.get_or_create(name=type_name)
+            types_by_name[type_name] = ProductType.objects.get_or_create(name=type_name)[0]
             self.stdout.write(self.style.SUCCESS(f'Created product type: {type_name}'))
 
         # Create products
@@ -43,7 +44,7 @@ class Command(BaseCommand):
                 sku=product_data['sku'],
                 defaults={
                     'name': product_data['name'],
-                    'type': product_data['type'],
+                    'type': types_by_name[product_data['type']],
                     'quantity': product_data['quantity'],
                     'price': product_data['price']
                 }
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from inventory.product_stats import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the per-product stats (totals in and out, revenue, wastage, last movement) from the ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Products recomputed per database transaction')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        started = time.monotonic()
+        done = 0
+        for done in rebuild(options['chunk_size']):
+            self.stdout.write(f'Rebuilt the stats of {done} products...')
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt the stats of {done} products in {elapsed:.1f}s'))
@@ -0,0 +1,111 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from inventory.models import Supplier, Client, StockTransaction, ArchivedStockTransaction
+
+# Account model behind each legacy name column of the ledgers
+ACCOUNTS = {
+    'supplier': Supplier,
+    'client': Client,
+}
+
+LEDGERS = (StockTransaction, ArchivedStockTransaction)
+
+
+def clean_name(name):
+    """Name with runs of whitespace collapsed, as stored on created accounts."""
+    return ' '.join(name.split())
+
+
+def match_key(name):
+    return clean_name(name).casefold()
+
+
+class Command(BaseCommand):
+    help = ('Links ledger rows that only carry a free-text supplier/client name to the matching '
+            'Supplier/Client, creating the missing ones. Only unlinked rows are touched, so it can be rerun')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows updated per database transaction')
+        parser.add_argument('--no-create', action='store_true',
+                            help='Only link names matching an existing supplier/client')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be created and linked')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        for field, model in ACCOUNTS.items():
+            self.resolve(field, model, options)
+
+    def unresolved(self, ledger, field):
+        return (
+            ledger.objects
+            .filter(**{f'{field}_ref__isnull': True, f'{field}__isnull': False})
+            .exclude(**{field: ''})
+        )
+
+    def resolve(self, field, model, options):
+        label = model._meta.verbose_name_plural
+        # Existing accounts by normalized name; the oldest wins on duplicates
+        accounts = {}
+        for account_id, name in model.objects.order_by('id').values_list('id', 'name'):
+            accounts.setdefault(match_key(name), account_id)
+
+        # Legacy names without an account, with a contact to seed new ones
+        missing = {}
+        for ledger in LEDGERS:
+            names = self.unresolved(ledger, field).order_by().values_list(field, f'{field}_contact').distinct()
+            for name, contact in names.iterator():
+                key = match_key(name)
+                if key and key not in accounts:
+                    seed = missing.setdefault(key, [clean_name(name), contact])
+                    seed[1] = seed[1] or contact
+
+        created = 0
+        if missing and not options['no_create']:
+            if options['dry_run']:
+                # Stand-in ids so the dry run counts the rows new accounts would get
+                accounts.update(dict.fromkeys(missing, 0))
+            else:
+                new_accounts = model.objects.bulk_create(
+                    [model(name=name, contact_person=contact or None) for name, contact in missing.values()]
+                )
+                accounts.update(zip(missing, (account.id for account in new_accounts)))
+            created = len(missing)
+
+        for ledger in LEDGERS:
+            linked, unmatched = self.link(ledger, field, accounts, options['chunk_size'], options['dry_run'])
+            verb = 'Would link' if options['dry_run'] else 'Linked'
+            self.stdout.write(f'{verb} {linked} {ledger._meta.verbose_name_plural} to {label}, {unmatched} left unmatched')
+
+        verb = 'Would create' if options['dry_run'] else 'Created'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {created} {label}'))
+
+    def link(self, ledger, field, accounts, chunk_size, dry_run):
+        """Set the ref of unlinked rows, ``chunk_size`` rows per transaction."""
+        rows = self.unresolved(ledger, field).order_by('id').values_list('id', field)
+        linked = unmatched = 0
+        last_id = 0
+        while True:
+            chunk = list(rows.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                return linked, unmatched
+            last_id = chunk[-1][0]
+
+            updates = []
+            now = timezone.now()
+            for row_id, name in chunk:
+                key = match_key(name)
+                if not key:
+                    # Blank names have nothing to resolve
+                    continue
+                account_id = accounts.get(key)
+                if account_id is None:
+                    unmatched += 1
+                else:
+                    updates.append(ledger(id=row_id, updated_at=now, **{f'{field}_ref_id': account_id}))
+            if updates and not dry_run:
+                with transaction.atomic():
+                    ledger.objects.bulk_update(updates, [f'{field}_ref', 'updated_at'], batch_size=1000)
+            linked += len(updates)
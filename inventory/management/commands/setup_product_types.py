@@ -5,11 +5,6 @@ class Command(BaseCommand):
     help = 'Sets up the required product types'
 
     def handle(self, *args, **kwargs):
-        # Delete all existing product types
-        ProductType.objects.all().delete()
-        self.stdout.write(self.style.SUCCESS('Deleted all existing product types'))
-        
-        # Create new product types
         product_types = [
             'Fruits',
             'Spice',
@@ -18,7 +13,17 @@ class Command(BaseCommand):
             'Bakery Ingredients'
         ]
         
+        # Delete the other product types, except those products still use
+        deleted, _ = ProductType.objects.exclude(name__in=product_types).filter(products__isnull=True).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unused product types'))
+        
+        kept = ProductType.objects.exclude(name__in=product_types).values_list('name', flat=True)
+        if kept:
+            self.stdout.write(self.style.WARNING(f'Kept product types still in use: {", ".join(kept)}'))
+        
+        # Create the missing product types
+        created = 0
         for type_name in product_types:
-            ProductType.objects.create(name=type_name)
+            created += ProductType.objects.get_or_create(name=type_name)[1]
         
-        self.stdout.write(self.style.SUCCESS(f'Successfully created {len(product_types)} product types')) 
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS(f'Successfully created {created} product types'))
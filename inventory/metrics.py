@@ -0,0 +1,185 @@
+import heapq
+import logging
+import os
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from prometheus_client import REGISTRY, CollectorRegistry, Histogram, generate_latest, multiprocess
+
+logger = logging.getLogger(__name__)
+
+# Labelled by Django view name (e.g. 'product-list'), which keeps the number
+# of series bounded unlike raw paths
+REQUEST_LATENCY = Histogram(
+    'ims_request_duration_seconds', 'Time spent handling a request',
+    ['method', 'route', 'status'],
+)
+DB_QUERIES = Histogram(
+    'ims_request_db_queries', 'Database queries run per request',
+    ['method', 'route'], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 500, 1000),
+)
+DB_TIME = Histogram(
+    'ims_request_db_duration_seconds', 'Time spent in database queries per request',
+    ['method', 'route'],
+)
+RENDER_TIME = Histogram(
+    'ims_request_render_duration_seconds', 'Time spent rendering (serializing) the response body',
+    ['method', 'route'],
+)
+RESPONSE_BYTES = Histogram(
+    'ims_response_bytes', 'Size of response bodies (streaming responses excluded)',
+    ['method', 'route'], buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+)
+
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+# Stats of the request being handled; a context variable so it follows the
+# request through sync_to_async into the thread running the view
+current_request = ContextVar('request_metrics', default=None)
+
+
+class RequestStats:
+    __slots__ = ('start', 'queries', 'db_time', 'render_start', 'render_time', 'slowest', 'keep')
+
+    def __init__(self, keep):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_start = None
+        self.render_time = None
+        # Min-heap of the ``keep`` slowest (duration, sql) seen so far
+        self.slowest = []
+        self.keep = keep
+
+    def add_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        if len(self.slowest) < self.keep:
+            heapq.heappush(self.slowest, (duration, sql))
+        elif self.keep and duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, sql))
+
+    def rendered(self, response):
+        self.render_time = time.perf_counter() - self.render_start
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper adding each query's time to the current request's stats."""
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(sql, time.perf_counter() - start)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # connection_created fires again on reconnects of the same wrapper
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records latency, database queries and time, render time and response
+    size of every request, and logs requests slower than
+    SLOW_REQUEST_THRESHOLD seconds with their slowest queries.
+
+    Should come first in MIDDLEWARE so the latency covers the other
+    middleware too.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        self.slow_threshold = getattr(settings, 'SLOW_REQUEST_THRESHOLD', None)
+        self.logged_queries = getattr(settings, 'SLOW_REQUEST_LOGGED_QUERIES', 5)
+        # Labelled series by (method, route, status), saving the labels() lookups
+        self.series = {}
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats(self.logged_queries)
+        token = current_request.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.observe(request, response, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats(self.logged_queries)
+        token = current_request.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.observe(request, response, stats)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook
+        stats = current_request.get()
+        if stats is not None:
+            stats.render_start = time.perf_counter()
+            response.add_post_render_callback(stats.rendered)
+        return response
+
+    def observe(self, request, response, stats):
+        duration = time.perf_counter() - stats.start
+        route = request.resolver_match.view_name if request.resolver_match else 'unmatched'
+        method = request.method if request.method in METHODS else 'other'
+
+        key = (method, route, response.status_code)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = (
+                REQUEST_LATENCY.labels(method, route, str(response.status_code)),
+                DB_QUERIES.labels(method, route),
+                DB_TIME.labels(method, route),
+                RENDER_TIME.labels(method, route),
+                RESPONSE_BYTES.labels(method, route),
+            )
+        latency, queries, db_time, render_time, response_bytes = series
+        latency.observe(duration)
+        queries.observe(stats.queries)
+        db_time.observe(stats.db_time)
+        if stats.render_time is not None:
+            render_time.observe(stats.render_time)
+        if not response.streaming:
+            response_bytes.observe(len(response.content))
+
+        if self.slow_threshold is not None and duration >= self.slow_threshold:
+            worst = ''.join(
+                f'\n  {query_time * 1000:.1f}ms {sql[:1000]}'
+                for query_time, sql in sorted(stats.slowest, reverse=True)
+            )
+            logger.warning(
+                'Slow request: %s %s -> %s in %.3fs, %d queries in %.3fs%s',
+                request.method, request.get_full_path(), response.status_code, duration,
+                stats.queries, stats.db_time, worst,
+            )
+
+
+def exposition():
+    """
+    Metrics in the Prometheus text format. With PROMETHEUS_MULTIPROC_DIR set
+    (gunicorn workers), the values every worker wrote there are summed.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
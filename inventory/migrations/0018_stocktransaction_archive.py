@@ -0,0 +1,62 @@
+# Generated by Django 5.2.1 on 2026-10-19 11:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0017_sync_tombstones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedStockTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('type', models.CharField(choices=[('IN', 'Stock In'), ('OUT', 'Stock Out')], max_length=3)),
+                ('notes', models.TextField(blank=True, null=True)),
+                ('supplier', models.CharField(blank=True, max_length=255, null=True)),
+                ('supplier_contact', models.CharField(blank=True, max_length=255, null=True)),
+                ('client', models.CharField(blank=True, max_length=255, null=True)),
+                ('client_contact', models.CharField(blank=True, max_length=255, null=True)),
+                ('reference_number', models.CharField(blank=True, max_length=100, null=True)),
+                ('unit_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('discount', models.DecimalField(blank=True, decimal_places=2, default=0, max_digits=10)),
+                ('date', models.DateTimeField()),
+                ('is_wastage', models.BooleanField(default=False)),
+                ('wastage', models.DecimalField(blank=True, decimal_places=2, default=0, max_digits=10)),
+                ('is_opening_balance', models.BooleanField(default=False)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AddField(
+            model_name='stocktransaction',
+            name='is_opening_balance',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='archivedstocktransaction',
+            name='client_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_transactions', to='inventory.client'),
+        ),
+        migrations.AddField(
+            model_name='archivedstocktransaction',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_transactions', to='inventory.product'),
+        ),
+        migrations.AddField(
+            model_name='archivedstocktransaction',
+            name='supplier_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_transactions', to='inventory.supplier'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedstocktransaction',
+            index=models.Index(fields=['date'], name='inventory_a_date_9c29e5_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-19 11:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0018_stocktransaction_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReorderSuggestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(choices=[('sma', 'Moving average'), ('ses', 'Exponential smoothing')], max_length=3)),
+                ('daily_demand', models.FloatField(help_text='Forecast units sold per day')),
+                ('demand_std', models.FloatField(help_text='Standard deviation of daily sales')),
+                ('safety_stock', models.IntegerField()),
+                ('reorder_point', models.IntegerField()),
+                ('suggested_quantity', models.IntegerField(help_text='Units to order to reach the order-up-to level')),
+                ('needs_reorder', models.BooleanField(db_index=True, default=False)),
+                ('computed_at', models.DateTimeField()),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reorder_suggestion', to='inventory.product')),
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-19 11:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0019_reorder_suggestion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedstocktransaction',
+            name='line_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='archivedstocktransaction',
+            name='net_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='stocktransaction',
+            name='line_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='stocktransaction',
+            name='net_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddIndex(
+            model_name='stocktransaction',
+            index=models.Index(fields=['date', 'type', 'quantity', 'line_total', 'net_total'], name='stocktxn_date_type_totals_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, transaction
+from django.db.models import F, Max
+
+CHUNK_SIZE = 10000
+
+
+def backfill_line_totals(apps, schema_editor):
+    # Fill line_total/net_total one id range at a time so each UPDATE (and
+    # its transaction) stays small on large ledgers
+    for model_name in ('StockTransaction', 'ArchivedStockTransaction'):
+        model = apps.get_model('inventory', model_name)
+        last_id = model.objects.aggregate(last=Max('id'))['last'] or 0
+        for start in range(0, last_id + 1, CHUNK_SIZE):
+            with transaction.atomic():
+                chunk = model.objects.filter(id__gte=start, id__lt=start + CHUNK_SIZE)
+                chunk.filter(unit_price__isnull=False).update(line_total=F('quantity') * F('unit_price'))
+                chunk.update(net_total=F('line_total') - F('discount'))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('inventory', '0020_stocktransaction_line_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_line_totals, migrations.RunPython.noop),
+    ]
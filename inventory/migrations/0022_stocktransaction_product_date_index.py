@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-19 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0021_backfill_line_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stocktransaction',
+            index=models.Index(fields=['product', 'date', 'id'], name='stocktxn_product_date_idx'),
+        ),
+    ]
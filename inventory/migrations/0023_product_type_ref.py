@@ -0,0 +1,29 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0022_stocktransaction_product_date_index'),
+    ]
+
+    operations = [
+        # Product.type allowed 100 characters, so type names must too
+        migrations.AlterField(
+            model_name='producttype',
+            name='name',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        # Nullable while both columns exist, so the move can be reversed
+        migrations.AlterField(
+            model_name='product',
+            name='type',
+            field=models.CharField(max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='type_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='inventory.producttype'),
+        ),
+    ]
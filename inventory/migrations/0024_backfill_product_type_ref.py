@@ -0,0 +1,43 @@
+from django.db import migrations, transaction
+from django.db.models import Max, OuterRef, Subquery
+
+CHUNK_SIZE = 10000
+
+
+def fill_type_ref(apps, schema_editor):
+    Product = apps.get_model('inventory', 'Product')
+    ProductType = apps.get_model('inventory', 'ProductType')
+
+    # Every type name in use gets a ProductType row
+    names = set(Product.objects.values_list('type', flat=True).distinct())
+    existing = set(ProductType.objects.filter(name__in=names).values_list('name', flat=True))
+    ProductType.objects.bulk_create([ProductType(name=name) for name in names - existing])
+
+    type_id = Subquery(ProductType.objects.filter(name=OuterRef('type')).values('id')[:1])
+    last_id = Product.objects.aggregate(last=Max('id'))['last'] or 0
+    for start in range(0, last_id + 1, CHUNK_SIZE):
+        with transaction.atomic():
+            Product.objects.filter(id__gte=start, id__lt=start + CHUNK_SIZE).update(type_ref_id=type_id)
+
+
+def fill_type_name(apps, schema_editor):
+    Product = apps.get_model('inventory', 'Product')
+    ProductType = apps.get_model('inventory', 'ProductType')
+
+    type_name = Subquery(ProductType.objects.filter(id=OuterRef('type_ref_id')).values('name')[:1])
+    last_id = Product.objects.aggregate(last=Max('id'))['last'] or 0
+    for start in range(0, last_id + 1, CHUNK_SIZE):
+        with transaction.atomic():
+            Product.objects.filter(id__gte=start, id__lt=start + CHUNK_SIZE).update(type=type_name)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('inventory', '0023_product_type_ref'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_type_ref, fill_type_name),
+    ]
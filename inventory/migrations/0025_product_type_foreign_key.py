@@ -0,0 +1,26 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0024_backfill_product_type_ref'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='product',
+            name='type',
+        ),
+        migrations.RenameField(
+            model_name='product',
+            old_name='type_ref',
+            new_name='type',
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='products', to='inventory.producttype'),
+        ),
+    ]
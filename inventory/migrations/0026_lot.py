@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-19 11:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0025_product_type_foreign_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_number', models.CharField(blank=True, max_length=50, null=True)),
+                ('expiry_date', models.DateField(blank=True, null=True)),
+                ('quantity', models.IntegerField()),
+                ('received_quantity', models.IntegerField()),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lots', to='inventory.product')),
+            ],
+            options={
+                'ordering': ['expiry_date', 'id'],
+                'indexes': [models.Index(condition=models.Q(('quantity__gt', 0)), fields=['expiry_date', 'product'], name='lot_expiry_product_idx'), models.Index(condition=models.Q(('quantity__gt', 0)), fields=['product', 'expiry_date'], name='lot_product_fefo_idx')],
+            },
+        ),
+    ]
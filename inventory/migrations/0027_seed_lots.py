@@ -0,0 +1,40 @@
+from django.db import migrations, transaction
+from django.db.models import Max, Q
+
+CHUNK_SIZE = 10000
+
+
+def seed_lots(apps, schema_editor):
+    # A product's own expiry date / batch number becomes its first lot
+    Product = apps.get_model('inventory', 'Product')
+    Lot = apps.get_model('inventory', 'Lot')
+    tracked = Product.objects.filter(quantity__gt=0).filter(
+        Q(expiry_date__isnull=False) | (Q(batch_number__isnull=False) & ~Q(batch_number=''))
+    )
+    last_id = Product.objects.aggregate(last=Max('id'))['last'] or 0
+    for start in range(0, last_id + 1, CHUNK_SIZE):
+        rows = tracked.filter(id__gte=start, id__lt=start + CHUNK_SIZE).values_list(
+            'id', 'batch_number', 'expiry_date', 'quantity'
+        )
+        with transaction.atomic():
+            Lot.objects.bulk_create([
+                Lot(product_id=product_id, batch_number=batch_number or None, expiry_date=expiry_date,
+                    quantity=quantity, received_quantity=quantity)
+                for product_id, batch_number, expiry_date, quantity in rows
+            ])
+
+
+def remove_lots(apps, schema_editor):
+    apps.get_model('inventory', 'Lot').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('inventory', '0026_lot'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_lots, remove_lots),
+    ]
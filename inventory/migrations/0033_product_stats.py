@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0032_stock_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='inventory.product')),
+                ('total_in', models.BigIntegerField(default=0)),
+                ('total_out', models.BigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_wastage', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('last_movement_date', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'product stats',
+            },
+        ),
+    ]
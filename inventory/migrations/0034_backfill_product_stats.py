@@ -0,0 +1,54 @@
+from django.db import migrations, transaction
+from django.db.models import Max, Q, Sum
+
+CHUNK_SIZE = 1000
+
+
+def backfill_product_stats(apps, schema_editor):
+    # One stats row per product, from the hot and archived ledger grouped by
+    # product one id range at a time
+    Product = apps.get_model('inventory', 'Product')
+    ProductStats = apps.get_model('inventory', 'ProductStats')
+    ledgers = [apps.get_model('inventory', name) for name in ('StockTransaction', 'ArchivedStockTransaction')]
+    last_id = Product.objects.aggregate(last=Max('id'))['last'] or 0
+    for start in range(0, last_id + 1, CHUNK_SIZE):
+        ids = list(Product.objects.filter(id__gte=start, id__lt=start + CHUNK_SIZE).values_list('id', flat=True))
+        stats = {product_id: ProductStats(product_id=product_id) for product_id in ids}
+        for model in ledgers:
+            rows = (
+                model.objects
+                .filter(product_id__gte=start, product_id__lt=start + CHUNK_SIZE, is_opening_balance=False)
+                .order_by()
+                .values('product_id')
+                .annotate(
+                    total_in=Sum('quantity', filter=Q(type='IN')),
+                    total_out=Sum('quantity', filter=Q(type='OUT')),
+                    revenue=Sum('net_total', filter=Q(type='OUT')),
+                    total_wastage=Sum('wastage'),
+                    last_movement_date=Max('date'),
+                )
+            )
+            for row in rows:
+                row_stats = stats.get(row['product_id'])
+                if row_stats is None:
+                    continue
+                row_stats.total_in += row['total_in'] or 0
+                row_stats.total_out += row['total_out'] or 0
+                row_stats.revenue += row['revenue'] or 0
+                row_stats.total_wastage += row['total_wastage'] or 0
+                if row_stats.last_movement_date is None or row['last_movement_date'] > row_stats.last_movement_date:
+                    row_stats.last_movement_date = row['last_movement_date']
+        with transaction.atomic():
+            ProductStats.objects.bulk_create(stats.values())
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('inventory', '0033_product_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_product_stats, migrations.RunPython.noop),
+    ]
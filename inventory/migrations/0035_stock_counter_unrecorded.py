@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0034_backfill_product_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockcounter',
+            name='unrecorded',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0035_stock_counter_unrecorded'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedstocktransaction',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stocktransaction',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -1,26 +1,39 @@
+from decimal import Decimal
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
+class ProductType(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    
+    def __str__(self):
+        return self.name
+
 class Product(models.Model):
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, db_index=True)
     sku = models.CharField(max_length=50, unique=True)
-    type = models.CharField(max_length=100)
+    type = models.ForeignKey(ProductType, on_delete=models.PROTECT, related_name='products')
     quantity = models.IntegerField(default=0)
+    # Fast-moving SKU whose movements go to StockCounter slots instead of
+    # locking this row; see inventory/counters.py
+    sharded_stock = models.BooleanField(default=False)
     buying_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     selling_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     # Legacy price field for backwards compatibility
     price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     # Track product details
-    location = models.CharField(max_length=100, blank=True, null=True)
-    expiry_date = models.DateField(blank=True, null=True)
+    location = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    expiry_date = models.DateField(blank=True, null=True, db_index=True)
     batch_number = models.CharField(max_length=50, blank=True, null=True)
     barcode = models.CharField(max_length=100, blank=True, null=True)
     minimum_stock_level = models.IntegerField(default=5)
     unit_of_measure = models.CharField(max_length=50, default='Unit', blank=True)
     wastage = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     def __str__(self):
         return self.name
@@ -32,6 +45,12 @@ class Product(models.Model):
             self.price = (self.buying_price + self.selling_price) / 2
         super().save(*args, **kwargs)
 
+    class Meta:
+        indexes = [
+            # Covers the stock value and low stock counts of the product stats
+            models.Index(fields=['quantity', 'price'], name='product_stock_value_idx'),
+        ]
+
 class Supplier(models.Model):
     name = models.CharField(max_length=255)
     contact_person = models.CharField(max_length=255, blank=True, null=True)
@@ -40,7 +59,7 @@ class Supplier(models.Model):
     address = models.TextField(blank=True, null=True)
     notes = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     def __str__(self):
         return self.name
@@ -56,7 +75,7 @@ class Client(models.Model):
     address = models.TextField(blank=True, null=True)
     notes = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     def __str__(self):
         return self.name
@@ -78,12 +97,12 @@ class StockHistory(models.Model):
     
     def __str__(self):
         return f"{self.product.name} - {self.type} - {self.quantity}"
-
-class ProductType(models.Model):
-    name = models.CharField(max_length=50, unique=True)
     
-    def __str__(self):
-        return self.name
+    class Meta:
+        indexes = [
+            # Serves the admin's date drilldown
+            models.Index(fields=['date'], name='stockhistory_date_idx'),
+        ]
 
 class StockTransaction(models.Model):
     TRANSACTION_TYPES = (
@@ -99,7 +118,7 @@ class StockTransaction(models.Model):
     supplier_contact = models.CharField(max_length=255, blank=True, null=True)
     client = models.CharField(max_length=255, blank=True, null=True)
     client_contact = models.CharField(max_length=255, blank=True, null=True)
-    reference_number = models.CharField(max_length=100, blank=True, null=True)
+    reference_number = models.CharField(max_length=100, blank=True, null=True, db_index=True)
     unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     discount = models.DecimalField(max_digits=10, decimal_places=2, default=0, blank=True)
     date = models.DateTimeField(auto_now_add=True)
@@ -108,6 +127,16 @@ class StockTransaction(models.Model):
     # Add relationships to Supplier and Client models
     supplier_ref = models.ForeignKey(Supplier, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
     client_ref = models.ForeignKey(Client, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
+    # Carry-forward row holding the net quantity of archived movements
+    is_opening_balance = models.BooleanField(default=False)
+    # Persisted quantity * unit_price and that minus discount, kept by
+    # compute_totals() so value reports can sum them straight from an index
+    line_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    net_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Last save, so cached analytics notice edits. Set by save() and by hand
+    # where rows are updated in bulk; null on rows never edited since it
+    # was added (not auto_now, which would rewrite the table to add it)
+    updated_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
 
     def __str__(self):
         return f"{self.type} - {self.product.name} - {self.quantity} units"
@@ -119,12 +148,206 @@ class StockTransaction(models.Model):
                 self.unit_price = self.product.buying_price
             elif self.type == 'OUT':
                 self.unit_price = self.product.selling_price
+        self.compute_totals()
+        self.updated_at = timezone.now()
         super().save(*args, **kwargs)
     
+    def compute_totals(self):
+        """
+        Set line_total and net_total from quantity, unit_price and discount.
+        
+        save() calls this; code writing rows with bulk_create or bulk_update
+        must call it itself.
+        """
+        unit_price = self._meta.get_field('unit_price').to_python(self.unit_price)
+        discount = self._meta.get_field('discount').to_python(self.discount) or Decimal('0')
+        if unit_price is None:
+            self.line_total = Decimal('0')
+        else:
+            self.line_total = (int(self.quantity) * unit_price).quantize(Decimal('0.01'))
+        self.net_total = self.line_total - discount
+    
     class Meta:
         ordering = ['-date']
+        indexes = [
+            # Covers the value aggregates of date/type filtered reports
+            models.Index(fields=['date', 'type', 'quantity', 'line_total', 'net_total'],
+                         name='stocktxn_date_type_totals_idx'),
+            # Serves a product's movements newest first (product timeline)
+            models.Index(fields=['product', 'date', 'id'], name='stocktxn_product_date_idx'),
+        ]
         permissions = (
             ('view_reports', 'Can view reports'),
             ('export_reports', 'Can export reports to CSV/PDF'),
             ('print_reports', 'Can print reports'),
         )
+
+
+class ArchivedStockTransaction(models.Model):
+    """
+    Cold copy of StockTransaction rows moved out by the archive_transactions
+    command. Rows keep their original id; the product balance they made up
+    lives on in an opening-balance row in the hot table.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='archived_transactions')
+    quantity = models.IntegerField()
+    type = models.CharField(max_length=3, choices=StockTransaction.TRANSACTION_TYPES)
+    notes = models.TextField(blank=True, null=True)
+    supplier = models.CharField(max_length=255, blank=True, null=True)
+    supplier_contact = models.CharField(max_length=255, blank=True, null=True)
+    client = models.CharField(max_length=255, blank=True, null=True)
+    client_contact = models.CharField(max_length=255, blank=True, null=True)
+    reference_number = models.CharField(max_length=100, blank=True, null=True)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    discount = models.DecimalField(max_digits=10, decimal_places=2, default=0, blank=True)
+    date = models.DateTimeField()
+    is_wastage = models.BooleanField(default=False)
+    wastage = models.DecimalField(max_digits=10, decimal_places=2, default=0, blank=True)
+    supplier_ref = models.ForeignKey(Supplier, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_transactions')
+    client_ref = models.ForeignKey(Client, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_transactions')
+    is_opening_balance = models.BooleanField(default=False)
+    line_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    net_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.type} - {self.product.name} - {self.quantity} units (archived)"
+    
+    class Meta:
+        ordering = ['-date']
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+
+class ReorderSuggestion(models.Model):
+    """
+    Reorder point and order quantity suggested for a product by the
+    forecast_demand command from its recent daily sales.
+    """
+    METHOD_CHOICES = (
+        ('sma', 'Moving average'),
+        ('ses', 'Exponential smoothing'),
+    )
+    
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='reorder_suggestion')
+    method = models.CharField(max_length=3, choices=METHOD_CHOICES)
+    daily_demand = models.FloatField(help_text='Forecast units sold per day')
+    demand_std = models.FloatField(help_text='Standard deviation of daily sales')
+    safety_stock = models.IntegerField()
+    reorder_point = models.IntegerField()
+    suggested_quantity = models.IntegerField(help_text='Units to order to reach the order-up-to level')
+    needs_reorder = models.BooleanField(default=False, db_index=True)
+    computed_at = models.DateTimeField()
+    
+    def __str__(self):
+        return f"{self.product.name} - reorder at {self.reorder_point}"
+
+class Lot(models.Model):
+    """
+    A received batch of a product with its own expiry date. ``quantity`` is
+    what is left of it; OUT movements draw from lots first-expiry-first-out.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='lots')
+    batch_number = models.CharField(max_length=50, blank=True, null=True)
+    expiry_date = models.DateField(blank=True, null=True)
+    quantity = models.IntegerField()
+    received_quantity = models.IntegerField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.product.name} - lot {self.batch_number or self.id} ({self.quantity} left)"
+    
+    class Meta:
+        ordering = ['expiry_date', 'id']
+        # Only lots with stock left are indexed, so depleted lots piling up
+        # cost nothing to expiry scans and allocation
+        indexes = [
+            models.Index(fields=['expiry_date', 'product'], name='lot_expiry_product_idx',
+                         condition=models.Q(quantity__gt=0)),
+            models.Index(fields=['product', 'expiry_date'], name='lot_product_fefo_idx',
+                         condition=models.Q(quantity__gt=0)),
+        ]
+
+class ProductStats(models.Model):
+    """
+    Lifetime ledger totals of a product, archived rows included and opening
+    balances left out, so they are read without aggregating the ledger.
+    Kept up to date by inventory/product_stats.py.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    total_in = models.BigIntegerField(default=0)
+    total_out = models.BigIntegerField(default=0)
+    # Net total of the OUT movements
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_wastage = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    last_movement_date = models.DateTimeField(blank=True, null=True)
+    
+    def __str__(self):
+        return f"{self.product.name} stats"
+    
+    class Meta:
+        verbose_name_plural = 'product stats'
+
+class StockCounter(models.Model):
+    """
+    One slot of the sharded stock counter of a product. Its stock is
+    Product.quantity plus the ``delta`` of every slot until compaction folds
+    them back. ``allowance`` is this slot's share of Product.quantity at the
+    last compaction, the most its delta may go below zero. ``unrecorded``
+    counts the movements taken on the slot that its product's ProductStats
+    row does not include yet.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_counters')
+    slot = models.PositiveSmallIntegerField()
+    delta = models.IntegerField(default=0)
+    allowance = models.IntegerField(default=0)
+    unrecorded = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.product.name} - slot {self.slot} ({self.delta:+d})"
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'slot'], name='stock_counter_product_slot_unique'),
+        ]
+
+class DeletedRecord(models.Model):
+    """
+    Tombstone for a deleted row, so delta-sync clients can drop their copy.
+    Rows are written by the post_delete handlers in signals.py.
+    """
+    model = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.model} #{self.object_id} deleted"
+
+class RequestProfile(models.Model):
+    """
+    cProfile run and SQL log of one request, recorded on demand by
+    ProfilingMiddleware. The files live under MEDIA_ROOT/profiles/: the raw
+    stats (loadable with pstats or snakeviz) and a JSON report with the
+    top functions and every query with its timing and EXPLAIN plan.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    method = models.CharField(max_length=10)
+    path = models.TextField()
+    view_name = models.CharField(max_length=200, blank=True)
+    status_code = models.PositiveSmallIntegerField()
+    duration = models.FloatField(help_text='Seconds, including profiler overhead')
+    query_count = models.IntegerField()
+    db_time = models.FloatField(help_text='Seconds spent in queries')
+    stats_file = models.FileField(upload_to='profiles/%Y/%m/%d/')
+    report_file = models.FileField(upload_to='profiles/%Y/%m/%d/')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration * 1000:.0f} ms)"
+    
+    class Meta:
+        ordering = ['-created_at']
+        permissions = (
+            ('profile_requests', 'Can profile requests'),
+        )
@@ -0,0 +1,161 @@
+"""
+Per-product ledger totals kept in ProductStats.
+
+StockUpdateView adds each movement to its product's row in the same
+transaction (record_movement); code changing ledger rows in bulk
+recomputes the rows of the products it touched (refresh). Movements taken
+on the counter slots of sharded products skip their row, which would
+otherwise be as contended as the product row: each slot counts them as
+``unrecorded`` and compact_stock_counters refreshes those products instead.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, When, F, Q, Sum, Max, Value, DecimalField, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .counters import locked_products
+from .models import Product, ProductStats, StockCounter, StockTransaction, ArchivedStockTransaction
+
+STATS_VALUE_FIELD = DecimalField(max_digits=14, decimal_places=2)
+
+# Totals per product of a ledger queryset grouped by product
+LEDGER_TOTALS = {
+    'total_in': Sum('quantity', filter=Q(type='IN')),
+    'total_out': Sum('quantity', filter=Q(type='OUT')),
+    'revenue': Sum('net_total', filter=Q(type='OUT')),
+    'total_wastage': Sum('wastage'),
+    'last_movement_date': Max('date'),
+}
+
+# Product annotations reading the stats through a join, zero for products
+# without movements
+STATS_COLUMNS = {
+    'total_in': Coalesce('stats__total_in', 0),
+    'total_out': Coalesce('stats__total_out', 0),
+    'revenue': Coalesce('stats__revenue', Value(Decimal('0')), output_field=STATS_VALUE_FIELD),
+    'total_wastage': Coalesce('stats__total_wastage', Value(Decimal('0')), output_field=STATS_VALUE_FIELD),
+    'last_movement_date': F('stats__last_movement_date'),
+}
+
+
+def record_movement(movement):
+    """
+    Add a newly saved ledger row to its product's stats with one UPDATE, in
+    the caller's transaction, which holds the product row lock.
+    """
+    if movement.is_opening_balance:
+        return
+    quantity_field = 'total_in' if movement.type == 'IN' else 'total_out'
+    wastage = StockTransaction._meta.get_field('wastage').to_python(movement.wastage) or Decimal('0')
+    changes = {
+        quantity_field: F(quantity_field) + movement.quantity,
+        'total_wastage': F('total_wastage') + wastage,
+        'last_movement_date': Case(
+            When(last_movement_date__gt=movement.date, then=F('last_movement_date')),
+            default=Value(movement.date),
+        ),
+    }
+    if movement.type == 'OUT':
+        changes['revenue'] = F('revenue') + movement.net_total
+
+    stats = ProductStats.objects.filter(product_id=movement.product_id)
+    if not stats.update(**changes):
+        # First movement of a product created after the stats were built
+        ProductStats.objects.get_or_create(product_id=movement.product_id)
+        stats.update(**changes)
+
+
+def ledger_totals(product_ids):
+    """
+    ``{product_id: totals}`` of these products over the hot and archived
+    ledger, opening balances left out.
+    """
+    totals = {}
+    for model in (StockTransaction, ArchivedStockTransaction):
+        rows = (
+            model.objects
+            .filter(product_id__in=product_ids, is_opening_balance=False)
+            .order_by()
+            .values('product_id')
+            .annotate(**LEDGER_TOTALS)
+        )
+        for row in rows:
+            product_totals = totals.setdefault(row.pop('product_id'), {
+                'total_in': 0, 'total_out': 0, 'revenue': Decimal('0'), 'total_wastage': Decimal('0'),
+                'last_movement_date': None,
+            })
+            latest = row.pop('last_movement_date')
+            if product_totals['last_movement_date'] is None or latest > product_totals['last_movement_date']:
+                product_totals['last_movement_date'] = latest
+            for name, value in row.items():
+                product_totals[name] += value or 0
+    return totals
+
+
+def refresh(product_ids, chunk_size=1000):
+    """
+    Recompute the stats of these products from the ledger, ``chunk_size``
+    products per database transaction, and return how many there were.
+    """
+    product_ids = sorted(set(product_ids))
+    for start in range(0, len(product_ids), chunk_size):
+        with transaction.atomic():
+            # Locked in id order, so movements recorded meanwhile wait
+            # instead of being overwritten
+            ids = list(
+                locked_products()
+                .filter(id__in=product_ids[start:start + chunk_size])
+                .order_by('id')
+                .values_list('id', flat=True)
+            )
+            # Their counter slots too: a movement taken on one inserts its
+            # ledger row before releasing the slot, so once held every
+            # movement they counted is in the totals read below
+            slots = StockCounter.objects.filter(product_id__in=ids)
+            list(slots.select_for_update().values_list('id', flat=True))
+            totals = ledger_totals(ids)
+            ProductStats.objects.filter(product_id__in=ids).delete()
+            ProductStats.objects.bulk_create([
+                ProductStats(product_id=product_id, **totals.get(product_id, {})) for product_id in ids
+            ])
+            slots.exclude(unrecorded=0).update(unrecorded=0)
+    return len(product_ids)
+
+
+def rebuild(chunk_size=1000):
+    """Recompute the stats of every product, yielding the running count after each chunk."""
+    products = Product.objects.order_by('id').values_list('id', flat=True)
+    done = 0
+    last_id = 0
+    while True:
+        ids = list(products.filter(id__gt=last_id)[:chunk_size])
+        if not ids:
+            return
+        done += refresh(ids, chunk_size)
+        last_id = ids[-1]
+        yield done
+
+
+def stale_products(products):
+    """
+    Ids among ``products`` whose stats miss ledger rows: sharded products
+    with movements taken on their counter slots since the last refresh, and
+    products with ledger rows newer than their stats.
+    """
+    latest = (
+        StockTransaction.objects
+        .filter(product=OuterRef('pk'), is_opening_balance=False)
+        .order_by('-date')
+        .values('date')[:1]
+    )
+    return (
+        products
+        .annotate(latest_movement=Subquery(latest))
+        .filter(
+            Exists(StockCounter.objects.filter(product=OuterRef('pk'), unrecorded__gt=0)) |
+            Q(stats__last_movement_date__isnull=True, latest_movement__isnull=False) |
+            Q(latest_movement__gt=F('stats__last_movement_date'))
+        )
+        .values_list('id', flat=True)
+    )
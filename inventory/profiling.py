@@ -0,0 +1,184 @@
+import cProfile
+import io
+import json
+import logging
+import marshal
+import pstats
+import time
+import uuid
+from datetime import timedelta
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, connection
+from django.utils import timezone
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import RequestProfile
+
+logger = logging.getLogger(__name__)
+
+# Functions listed in the report, by cumulative time
+REPORTED_FUNCTIONS = 60
+# Slowest SELECTs of a request that get an EXPLAIN plan
+EXPLAINED_QUERIES = 20
+
+
+def profiling_requested(request):
+    # Plain META lookups, so requests that don't ask cost next to nothing
+    if 'HTTP_X_PROFILE' in request.META:
+        return True
+    return '_profile' in request.META.get('QUERY_STRING', '') and '_profile' in request.GET
+
+
+def profiling_user(request):
+    """
+    The user asking for the profile if they may have it (active staff with
+    the profile_requests permission), else None.
+
+    API clients authenticate in the view, after the middleware, so their
+    token is checked here.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        auth = get_authorization_header(request).split()
+        if len(auth) != 2 or auth[0].lower() != b'token':
+            return None
+        try:
+            user, _ = TokenAuthentication().authenticate_credentials(auth[1].decode())
+        except (AuthenticationFailed, UnicodeError):
+            return None
+    if user.is_active and user.is_staff and user.has_perm('inventory.profile_requests'):
+        return user
+    return None
+
+
+class QueryLog:
+    """Execute wrapper keeping every query with its params and duration."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, params, many, time.perf_counter() - start))
+
+
+def explain(sql, params):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+    except DatabaseError as e:
+        return f'EXPLAIN failed: {e}'
+
+
+class ProfilingMiddleware:
+    """
+    Runs a request under cProfile and logs its SQL when a staff user with
+    the profile_requests permission adds an ``X-Profile`` header or a
+    ``_profile`` query param, and saves the result as a RequestProfile. Its
+    id is returned in the ``X-Profile-Id`` header.
+
+    Must come after AuthenticationMiddleware. cProfile only follows the
+    thread it was started in, so requests served through the ASGI app are
+    not profiled.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async or not profiling_requested(request):
+            return self.get_response(request)
+        user = profiling_user(request)
+        if user is None:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        queries = QueryLog()
+        start = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - start
+
+        try:
+            profile = save_profile(request, user, response, duration, profiler, queries.queries)
+        except Exception:
+            # The profile is a side product; the response still goes out
+            logger.exception('Could not save the profile of %s %s', request.method, request.get_full_path())
+            return response
+        response['X-Profile-Id'] = str(profile.id)
+        return response
+
+
+def save_profile(request, user, response, duration, profiler, queries):
+    functions = io.StringIO()
+    stats = pstats.Stats(profiler, stream=functions)
+    stats.sort_stats('cumulative').print_stats(REPORTED_FUNCTIONS)
+
+    explained = sorted(
+        (i for i, (sql, _, many, _) in enumerate(queries)
+         if not many and sql.lstrip().upper().startswith(('SELECT', 'WITH'))),
+        key=lambda i: queries[i][3], reverse=True,
+    )[:EXPLAINED_QUERIES]
+    plans = {i: explain(queries[i][0], queries[i][1]) for i in explained}
+
+    report = {
+        'functions': functions.getvalue(),
+        'queries': [
+            {
+                'sql': sql,
+                'params': repr(params),
+                'duration_ms': round(query_time * 1000, 3),
+                'explain': plans.get(i),
+            }
+            for i, (sql, params, many, query_time) in enumerate(queries)
+        ],
+    }
+
+    profile = RequestProfile(
+        user=user,
+        method=request.method,
+        path=request.get_full_path(),
+        view_name=request.resolver_match.view_name if request.resolver_match else '',
+        status_code=response.status_code,
+        duration=duration,
+        query_count=len(queries),
+        db_time=sum(query[3] for query in queries),
+    )
+    # Random names, so profiles can't be found by guessing
+    name = uuid.uuid4().hex
+    profile.stats_file.save(f'{name}.prof', ContentFile(marshal.dumps(stats.stats)), save=False)
+    profile.report_file.save(f'{name}.json', ContentFile(json.dumps(report).encode()), save=False)
+    profile.save()
+    prune_profiles()
+    return profile
+
+
+def prune_profiles():
+    """
+    Delete profiles older than PROFILE_RETENTION_DAYS and all but the newest
+    PROFILE_MAX_COUNT; their files go with them (see signals.py).
+    """
+    cutoff = timezone.now() - timedelta(days=getattr(settings, 'PROFILE_RETENTION_DAYS', 7))
+    RequestProfile.objects.filter(created_at__lt=cutoff).delete()
+    max_count = getattr(settings, 'PROFILE_MAX_COUNT', 100)
+    oldest_kept = list(RequestProfile.objects.order_by('-id').values_list('id', flat=True)[max_count - 1:max_count])
+    if oldest_kept:
+        RequestProfile.objects.filter(id__lt=oldest_kept[0]).delete()
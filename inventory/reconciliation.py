@@ -0,0 +1,135 @@
+from django.db import transaction
+from django.db.models import Case, When, F, Q, Sum, Exists, OuterRef, Value
+from django.utils import timezone
+
+from . import counters
+from .models import Product, StockCounter, StockTransaction
+
+# Signed quantity of a ledger row: IN adds stock, OUT removes it
+SIGNED_QUANTITY = Case(
+    When(type='IN', then=F('quantity')),
+    When(type='OUT', then=-F('quantity')),
+    default=Value(0),
+)
+
+ADJUSTMENT_NOTE = 'Reconciliation adjustment'
+
+
+def ledger_balances(transactions=None):
+    """
+    Net IN minus OUT quantity per product, from a single grouped query.
+
+    Returns ``{product_id: balance}`` for products that have ledger rows.
+    """
+    if transactions is None:
+        transactions = StockTransaction.objects.all()
+    rows = (
+        transactions
+        .order_by()
+        .values('product_id')
+        .annotate(balance=Sum(SIGNED_QUANTITY))
+        .values_list('product_id', 'balance')
+    )
+    return {product_id: balance or 0 for product_id, balance in rows}
+
+
+def find_mismatches(chunk_size=None):
+    """
+    Yield ``(product_id, quantity, ledger_balance)`` for every product whose
+    quantity differs from its ledger.
+
+    Without ``chunk_size`` the whole ledger is grouped in one query; with it
+    products are walked in id ranges of that size, so memory stays bounded
+    on very large ledgers.
+    """
+    products = Product.objects.order_by('id').values_list('id', counters.STOCK_QUANTITY)
+    if not chunk_size:
+        balances = ledger_balances()
+        for product_id, quantity in products.iterator(chunk_size=10000):
+            balance = balances.get(product_id, 0)
+            if balance != quantity:
+                yield product_id, quantity, balance
+        return
+
+    last_id = 0
+    while True:
+        chunk = list(products.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        first_id, last_id = chunk[0][0], chunk[-1][0]
+        balances = ledger_balances(
+            StockTransaction.objects.filter(product_id__gte=first_id, product_id__lte=last_id)
+        )
+        for product_id, quantity in chunk:
+            balance = balances.get(product_id, 0)
+            if balance != quantity:
+                yield product_id, quantity, balance
+
+
+def invalid_transactions():
+    """Ledger rows with an unknown type, a non-positive quantity or a missing product."""
+    return StockTransaction.objects.filter(
+        ~Q(type__in=['IN', 'OUT']) |
+        Q(quantity__lte=0) |
+        ~Exists(Product.objects.filter(id=OuterRef('product_id')))
+    )
+
+
+def repair_quantities(mismatches, batch_size=1000):
+    """
+    Set Product.quantity to the ledger balance for the given mismatches,
+    ``batch_size`` products per database transaction, and return how many
+    were repaired.
+
+    The mismatches were found without locks, so each chunk is checked
+    again with its products and counter slots locked: a movement posted
+    since moved the quantity and the ledger together and must be kept.
+    """
+    product_ids = sorted({product_id for product_id, _, _ in mismatches})
+    repaired = 0
+    for start in range(0, len(product_ids), batch_size):
+        with transaction.atomic():
+            ids = list(
+                counters.locked_products()
+                .filter(id__in=product_ids[start:start + batch_size])
+                .order_by('id')
+                .values_list('id', flat=True)
+            )
+            list(StockCounter.objects.filter(product_id__in=ids).select_for_update().values_list('id', flat=True))
+            balances = ledger_balances(StockTransaction.objects.filter(product_id__in=ids))
+            current = Product.objects.filter(id__in=ids).values_list('id', 'sharded_stock', counters.STOCK_QUANTITY)
+            now = timezone.now()
+            products = []
+            for product_id, sharded, quantity in current:
+                balance = balances.get(product_id, 0)
+                if quantity == balance:
+                    continue
+                if sharded:
+                    # Their counter deltas are dropped and allowances shared out again
+                    counters.compact(product_id, balance)
+                else:
+                    # updated_at is set by hand because bulk_update skips auto_now
+                    products.append(Product(id=product_id, quantity=balance, updated_at=now))
+                repaired += 1
+            Product.objects.bulk_update(products, ['quantity', 'updated_at'])
+    return repaired
+
+
+def repair_ledger(mismatches, batch_size=1000):
+    """
+    Write one adjustment row per mismatch so the ledger matches Product.quantity.
+
+    Adjustments are flagged like opening balances so reports ignore them.
+    """
+    adjustments = [
+        StockTransaction(
+            product_id=product_id,
+            type='IN' if quantity > balance else 'OUT',
+            quantity=abs(quantity - balance),
+            notes=ADJUSTMENT_NOTE,
+            is_opening_balance=True,
+        )
+        for product_id, quantity, balance in mismatches
+    ]
+    StockTransaction.objects.bulk_create(adjustments, batch_size=batch_size)
+    return len(adjustments)
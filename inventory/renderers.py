@@ -0,0 +1,71 @@
+from itertools import chain
+
+from django.http import StreamingHttpResponse
+from rest_framework import renderers
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ColumnarRenderer(renderers.JSONRenderer):
+    """
+    Compact columnar JSON, picked with ?format=columnar or the media type in
+    Accept. List views that support it stream the document themselves (see
+    columnar_response); anything else, such as errors, renders as plain JSON.
+    """
+    media_type = 'application/vnd.ims.columnar+json'
+    format = 'columnar'
+
+
+def wants_columnar(request):
+    renderer = getattr(request, 'accepted_renderer', None)
+    return renderer is not None and renderer.format == ColumnarRenderer.format
+
+
+def stream_columnar(names, rows, dictionary_columns=(), head=None, chunk_size=1000):
+    """
+    Yield a JSON document ``{...head, "columns": [...], "rows": [[...], ...],
+    "dictionaries": {column: [values]}}`` chunk by chunk.
+
+    Values of the dictionary columns are written as indexes into
+    ``dictionaries[column]``, so repeated strings such as product names are
+    sent once. The dictionaries come last because they are only complete
+    once every row has been read.
+    """
+    encoder = JSONEncoder(
+        ensure_ascii=not api_settings.UNICODE_JSON,
+        allow_nan=not api_settings.STRICT_JSON,
+        separators=(',', ':') if api_settings.COMPACT_JSON else (', ', ': '),
+    )
+    encode = encoder.encode
+    encoded = [i for i, name in enumerate(names) if name in dictionary_columns]
+    dictionaries = {names[i]: {} for i in encoded}
+
+    yield '{' + ''.join(f'{encode(key)}:{encode(value)},' for key, value in (head or {}).items())
+    yield f'"columns":{encode(names)},"rows":['
+
+    separator = ''
+    batch = []
+    for row in rows:
+        for i in encoded:
+            if row[i] is not None:
+                codes = dictionaries[names[i]]
+                row[i] = codes.setdefault(row[i], len(codes))
+        batch.append(row)
+        if len(batch) == chunk_size:
+            yield separator + encode(batch)[1:-1]
+            separator = ','
+            batch = []
+    if batch:
+        yield separator + encode(batch)[1:-1]
+
+    yield '],"dictionaries":' + encode({name: list(codes) for name, codes in dictionaries.items()}) + '}'
+
+
+def columnar_response(values_serializer, querysets, fields=None, head=None):
+    """Stream the rows of ``querysets``, one after another, as a columnar document."""
+    names = values_serializer.columns(fields)
+    rows = chain.from_iterable(values_serializer.values(queryset, names) for queryset in querysets)
+    return StreamingHttpResponse(
+        stream_columnar(names, rows, values_serializer.dictionary_columns, head),
+        content_type=f'{ColumnarRenderer.media_type}; charset=utf-8',
+    )
@@ -0,0 +1,347 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Sum, F, Q, Max, Min, DateField, DecimalField, FloatField, OuterRef, Subquery
+from django.db.models.functions import Cast, Coalesce, TruncDay, TruncWeek, TruncMonth
+from django.utils import timezone
+
+from .models import StockTransaction, ArchivedStockTransaction, ProductType
+
+
+def product_type_id(name):
+    """
+    Id of the named product type as a scalar subquery, so product type
+    filters compare the indexed integer without joining ProductType.
+    """
+    return Subquery(ProductType.objects.filter(name=name).values('id')[:1])
+
+
+class ReportFilters:
+    """
+    Filters shared by the report endpoints.
+
+    Built from the request query params (see ReportsView for the list) and
+    applied to StockTransaction or ArchivedStockTransaction querysets alike.
+    Raises ValueError with a user-facing message on malformed params.
+
+    In strict mode (REPORTS_STRICT_ACCOUNT_FILTERS) supplier and client
+    filters are foreign key lookups only, without the substring match on
+    legacy names that scans the whole ledger.
+    """
+
+    def __init__(self, report_type='all', start_date=None, end_date=None, product_id=None,
+                 supplier_id=None, client_id=None, product_type=None, strict=False):
+        self.report_type = report_type
+        self.start_date = start_date
+        self.end_date = end_date
+        self.product_id = product_id
+        self.supplier_id = supplier_id
+        self.client_id = client_id
+        self.product_type = product_type
+        self.strict = strict
+
+    @classmethod
+    def from_params(cls, params):
+        start_date_str = params.get('start_date')
+        end_date_str = params.get('end_date')
+        start_date = end_date = None
+
+        if start_date_str:
+            try:
+                start_date = timezone.make_aware(datetime.strptime(start_date_str, '%Y-%m-%d'))
+            except ValueError:
+                raise ValueError("Invalid start_date format. Use YYYY-MM-DD")
+            except OverflowError:
+                raise ValueError("start_date is out of range")
+
+        if end_date_str:
+            try:
+                # Add one day to include the end date fully
+                end_date = timezone.make_aware(datetime.strptime(end_date_str, '%Y-%m-%d')) + timedelta(days=1)
+            except ValueError:
+                raise ValueError("Invalid end_date format. Use YYYY-MM-DD")
+            except OverflowError:
+                # 9999-12-31 has no next day
+                raise ValueError("end_date is out of range")
+
+        strict = getattr(settings, 'REPORTS_STRICT_ACCOUNT_FILTERS', False)
+        if strict:
+            for param in ('supplier_id', 'client_id'):
+                if params.get(param) and not params[param].isdigit():
+                    raise ValueError(f"Invalid {param}. Use the numeric id")
+
+        return cls(
+            report_type=params.get('report_type', 'all'),
+            start_date=start_date,
+            end_date=end_date,
+            product_id=params.get('product_id'),
+            supplier_id=params.get('supplier_id'),
+            client_id=params.get('client_id'),
+            product_type=params.get('product_type'),
+            strict=strict,
+        )
+
+    def apply(self, queryset):
+        # Opening-balance rows only carry archived quantities forward
+        queryset = queryset.filter(is_opening_balance=False)
+
+        # Apply report type filter
+        if self.report_type == 'sales':
+            queryset = queryset.filter(type='OUT')
+        elif self.report_type == 'purchases':
+            queryset = queryset.filter(type='IN')
+
+        # Apply date filters
+        if self.start_date:
+            queryset = queryset.filter(date__gte=self.start_date)
+        if self.end_date:
+            queryset = queryset.filter(date__lt=self.end_date)
+
+        # Apply product filter
+        if self.product_id:
+            queryset = queryset.filter(product_id=self.product_id)
+
+        # Apply supplier and client filters
+        if self.supplier_id:
+            queryset = queryset.filter(self.account_filter('supplier', self.supplier_id))
+        if self.client_id:
+            queryset = queryset.filter(self.account_filter('client', self.client_id))
+
+        # Apply product type filter
+        if self.product_type and self.product_type != 'all':
+            queryset = queryset.filter(product__type_id=product_type_id(self.product_type))
+
+        return queryset
+
+    def account_filter(self, field, value):
+        """
+        Rows of the supplier or client ``value``: its account id, and outside
+        strict mode also unlinked rows whose legacy name contains it. A
+        value that is not an id only matches legacy names.
+        """
+        by_account = Q(**{f'{field}_ref_id': value})
+        if self.strict:
+            return by_account
+        by_name = Q(**{f'{field}_ref__isnull': True, f'{field}__icontains': value})
+        return by_account | by_name if str(value).isdigit() else by_name
+
+    def needs_archive(self):
+        """
+        Whether the date range reaches into archived transactions.
+
+        Min/max on the archive's date index cost two index lookups.
+        """
+        bounds = ArchivedStockTransaction.objects.aggregate(earliest=Min('date'), latest=Max('date'))
+        if bounds['latest'] is None:
+            return False
+        if self.start_date and self.start_date > bounds['latest']:
+            return False
+        if self.end_date and self.end_date <= bounds['earliest']:
+            return False
+        return True
+
+
+def summarize(queryset):
+    """Report summary totals for a filtered transaction queryset, in one query."""
+    totals = queryset.aggregate(
+        total_transactions=Count('id'),
+        total_quantity=Sum('quantity'),
+        total_value=Sum('line_total'),
+        total_discount=Sum('discount'),
+        total_wastage=Sum('wastage'),
+    )
+    return {key: value or 0 for key, value in totals.items()}
+
+
+def combine_summaries(*summaries):
+    combined = {}
+    for summary in summaries:
+        for key, value in summary.items():
+            combined[key] = combined.get(key, 0) + value
+    return combined
+
+
+# Database truncation used for each timeseries interval
+INTERVALS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def bucket_start(day, interval):
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    if interval == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(day, interval):
+    if interval == 'week':
+        return day + timedelta(days=7)
+    if interval == 'month':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def timeseries_totals(queryset, interval):
+    """
+    IN/OUT quantity and value, discount and wastage per period, grouped in
+    the database. Returns ``{period_date: totals}`` for periods with rows.
+    """
+    trunc = INTERVALS[interval]
+    rows = (
+        queryset
+        .order_by()
+        .annotate(period=trunc('date', output_field=DateField()))
+        .values('period')
+        .annotate(
+            transactions=Count('id'),
+            in_quantity=Sum('quantity', filter=Q(type='IN')),
+            out_quantity=Sum('quantity', filter=Q(type='OUT')),
+            in_value=Sum('line_total', filter=Q(type='IN')),
+            out_value=Sum('line_total', filter=Q(type='OUT')),
+            discount=Sum('discount'),
+            wastage=Sum('wastage'),
+        )
+    )
+    return {
+        row.pop('period'): {key: value or 0 for key, value in row.items()}
+        for row in rows
+    }
+
+
+def first_ledger_day():
+    """Day of the oldest hot or archived transaction, or None, from min() on their date indexes."""
+    dates = [
+        date for date in (model.objects.aggregate(first=Min('date'))['first']
+                          for model in (StockTransaction, ArchivedStockTransaction))
+        if date is not None
+    ]
+    return timezone.localdate(min(dates)) if dates else None
+
+
+def fill_timeseries(totals, interval, start=None, end=None):
+    """
+    Turn grouped totals into a continuous list of periods from ``start`` to
+    ``end`` (dates, defaulting to the first/last period with data), with
+    zero rows for the empty ones.
+    """
+    if not totals and (start is None or end is None):
+        return []
+    start = bucket_start(start or min(totals), interval)
+    end = end or max(totals)
+
+    empty = dict.fromkeys(
+        ['transactions', 'in_quantity', 'out_quantity', 'in_value', 'out_value', 'discount', 'wastage'], 0
+    )
+    series = []
+    period = start
+    while period <= end:
+        series.append({'period': period, **totals.get(period, empty)})
+        period = next_bucket(period, interval)
+    return series
+
+
+# Columns a profit report can be grouped by, with the values they group on
+PROFIT_GROUPS = {
+    'product': ('product_id', 'product__name', 'product__sku'),
+    'type': ('product__type_id', 'product__type__name'),
+    'client': ('client_ref_id', 'client_name'),
+    'day': ('period',),
+    'week': ('period',),
+    'month': ('period',),
+}
+
+PROFIT_TOTALS = ('transactions', 'quantity_sold', 'revenue', 'total_discount', 'total_wastage', 'cogs', 'gross_profit')
+
+PROFIT_VALUE_FIELD = DecimalField(max_digits=16, decimal_places=2)
+
+
+def average_price():
+    """
+    Quantity-weighted average unit price of grouped ledger rows. SQLite
+    stores whole decimals as integers and would divide them as integers, so
+    there the total is divided as a float.
+    """
+    total = Sum('line_total')
+    if connection.vendor == 'sqlite':
+        total = Cast(total, FloatField())
+    return total / Sum('quantity')
+
+
+def unit_cost(cost_basis):
+    """
+    Cost of one unit sold: the product's buying price, or the weighted
+    average price paid on its IN transactions (hot ledger).
+    """
+    if cost_basis == 'average':
+        purchases = (
+            StockTransaction.objects
+            .filter(product_id=OuterRef('product_id'), type='IN', is_opening_balance=False,
+                    unit_price__isnull=False)
+            .order_by()
+            .values('product_id')
+            .annotate(cost=average_price())
+            .values('cost')
+        )
+        return Coalesce(Subquery(purchases, output_field=PROFIT_VALUE_FIELD), F('product__buying_price'))
+    return F('product__buying_price')
+
+
+def profit_aggregates(cost_basis):
+    return {
+        'transactions': Count('id'),
+        'quantity_sold': Coalesce(Sum('quantity'), 0),
+        'revenue': Coalesce(Sum('line_total'), 0, output_field=PROFIT_VALUE_FIELD),
+        'total_discount': Coalesce(Sum('discount'), 0, output_field=PROFIT_VALUE_FIELD),
+        'total_wastage': Coalesce(Sum('wastage'), 0, output_field=PROFIT_VALUE_FIELD),
+        'cogs': Coalesce(Sum(F('quantity') * unit_cost(cost_basis)), 0, output_field=PROFIT_VALUE_FIELD),
+    }
+
+
+def profit_totals(queryset, cost_basis='buying'):
+    totals = queryset.filter(type='OUT').aggregate(**profit_aggregates(cost_basis))
+    totals['gross_profit'] = totals['revenue'] - totals['total_discount'] - totals['total_wastage'] - totals['cogs']
+    return totals
+
+
+def profit_rows(queryset, group_by, cost_basis='buying'):
+    """
+    Revenue, discount, wastage, cost of goods sold and gross profit of the
+    OUT transactions in ``queryset``, grouped by ``group_by`` in one query.
+    """
+    queryset = queryset.filter(type='OUT').order_by()
+    if group_by in INTERVALS:
+        queryset = queryset.annotate(period=INTERVALS[group_by]('date', output_field=DateField()))
+    elif group_by == 'client':
+        queryset = queryset.annotate(client_name=Coalesce('client_ref__name', 'client'))
+
+    return (
+        queryset
+        .values(*PROFIT_GROUPS[group_by])
+        .annotate(**profit_aggregates(cost_basis))
+        .annotate(gross_profit=F('revenue') - F('total_discount') - F('total_wastage') - F('cogs'))
+    )
+
+
+def merge_profit_rows(group_by, *row_lists):
+    """Add up profit rows of the same group coming from several ledgers."""
+    merged = {}
+    for rows in row_lists:
+        for row in rows:
+            key = tuple(row[column] for column in PROFIT_GROUPS[group_by])
+            if key in merged:
+                for total in PROFIT_TOTALS:
+                    merged[key][total] += row[total]
+            else:
+                merged[key] = dict(row)
+    return list(merged.values())
+
+
+def add_margin(row):
+    net_revenue = row['revenue'] - row['total_discount']
+    row['margin_percent'] = round(row['gross_profit'] / net_revenue * 100, 2) if net_revenue else None
+    return row
@@ -1,24 +1,107 @@
+from django.db.models.functions import Coalesce
 from rest_framework import serializers
-from .models import Product, StockTransaction, ProductType, Supplier, Client
+from .counters import STOCK_QUANTITY, stock_of
+from .models import Product, StockTransaction, ProductType, Supplier, Client, ReorderSuggestion, Lot
 
-class ProductSerializer(serializers.ModelSerializer):
+def requested_fields(request):
+    """Field names picked with ?fields=a,b on a GET request, or None for all."""
+    if request is None or request.method != 'GET':
+        return None
+    requested = request.query_params.get('fields')
+    if not requested:
+        return None
+    return {name.strip() for name in requested.split(',')}
+
+class SparseFieldsMixin:
+    """
+    Lets GET requests pick the fields to return, e.g. ?fields=id,name for a
+    dropdown. Fields left out are dropped before serializing, so they cost
+    nothing to render either.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        keep = requested_fields(self.context.get('request'))
+        if keep is not None:
+            for name in set(self.fields) - keep:
+                self.fields.pop(name)
+
+class ProductTypeField(serializers.SlugRelatedField):
+    """
+    Product type by name. Unknown names create the type, as free-text types
+    were accepted before types became a table.
+    """
+    
+    def __init__(self, **kwargs):
+        super().__init__(slug_field='name', queryset=ProductType.objects.all(), **kwargs)
+    
+    def to_internal_value(self, data):
+        name = str(data).strip()
+        if not name:
+            self.fail('invalid')
+        if len(name) > ProductType._meta.get_field('name').max_length:
+            raise serializers.ValidationError('Product type name is too long.')
+        return ProductType.objects.get_or_create(name=name)[0]
+
+class StockQuantityField(serializers.IntegerField):
+    """Product.quantity plus the pending counter deltas of a sharded product."""
+    
+    def get_attribute(self, instance):
+        return stock_of(instance)
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    type = ProductTypeField()
+    quantity = StockQuantityField(required=False)
+    
     class Meta:
         model = Product
         fields = ['id', 'name', 'sku', 'type', 'quantity', 'buying_price', 'selling_price', 'price',
                  'location', 'expiry_date', 'batch_number', 'barcode', 
                  'minimum_stock_level', 'unit_of_measure', 'wastage', 'created_at', 'updated_at']
 
-class SupplierSerializer(serializers.ModelSerializer):
+class ProductStatsFields(serializers.Serializer):
+    # Lifetime totals annotated by views.with_product_stats
+    total_in = serializers.IntegerField(read_only=True)
+    total_out = serializers.IntegerField(read_only=True)
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2, read_only=True)
+    total_wastage = serializers.DecimalField(max_digits=14, decimal_places=2, read_only=True)
+    last_movement_date = serializers.DateTimeField(read_only=True)
+
+PRODUCT_STATS_FIELDS = ['total_in', 'total_out', 'revenue', 'total_wastage', 'last_movement_date']
+
+class ProductStatsSerializer(ProductStatsFields, ProductSerializer):
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + PRODUCT_STATS_FIELDS
+
+class SupplierSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Supplier
         fields = ['id', 'name', 'contact_person', 'email', 'phone', 'address', 'notes', 'created_at', 'updated_at']
 
-class ClientSerializer(serializers.ModelSerializer):
+class ClientSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Client
         fields = ['id', 'name', 'contact_person', 'email', 'phone', 'address', 'notes', 'created_at', 'updated_at']
 
-class StockTransactionSerializer(serializers.ModelSerializer):
+class AccountStatsFields(serializers.Serializer):
+    # Totals annotated by views.with_account_stats
+    transaction_count = serializers.IntegerField(read_only=True)
+    total_quantity = serializers.IntegerField(read_only=True)
+    total_value = serializers.DecimalField(max_digits=14, decimal_places=2, read_only=True)
+    last_transaction_date = serializers.DateTimeField(read_only=True)
+    product_count = serializers.IntegerField(read_only=True)
+
+ACCOUNT_STATS_FIELDS = ['transaction_count', 'total_quantity', 'total_value', 'last_transaction_date', 'product_count']
+
+class SupplierStatsSerializer(AccountStatsFields, SupplierSerializer):
+    class Meta(SupplierSerializer.Meta):
+        fields = SupplierSerializer.Meta.fields + ACCOUNT_STATS_FIELDS
+
+class ClientStatsSerializer(AccountStatsFields, ClientSerializer):
+    class Meta(ClientSerializer.Meta):
+        fields = ClientSerializer.Meta.fields + ACCOUNT_STATS_FIELDS
+
+class StockTransactionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product_name = serializers.SerializerMethodField()
     supplier_name = serializers.SerializerMethodField()
     client_name = serializers.SerializerMethodField()
@@ -45,7 +128,86 @@ class StockTransactionSerializer(serializers.ModelSerializer):
             return obj.client_ref.name
         return obj.client
     
-class ProductTypeSerializer(serializers.ModelSerializer):
+class ProductTypeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ProductType
-        fields = ['id', 'name']
\ No newline at end of file
+        fields = ['id', 'name']
+
+class ReorderSuggestionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True)
+    sku = serializers.CharField(source='product.sku', read_only=True)
+    # Annotated by the view, counter slots of sharded products included
+    quantity = serializers.IntegerField(source='stock_quantity', read_only=True)
+    
+    class Meta:
+        model = ReorderSuggestion
+        fields = ['product', 'product_name', 'sku', 'quantity', 'method', 'daily_demand', 'demand_std',
+                  'safety_stock', 'reorder_point', 'suggested_quantity', 'needs_reorder', 'computed_at']
+
+class LotSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True)
+    sku = serializers.CharField(source='product.sku', read_only=True)
+    
+    class Meta:
+        model = Lot
+        fields = ['id', 'product', 'product_name', 'sku', 'batch_number', 'expiry_date', 'quantity',
+                  'received_quantity', 'received_at']
+
+class ValuesSerializer:
+    """
+    Read-only fast path rendering the same output as ``serializer_class``
+    from values_list() rows, without model instances or per-row method
+    fields. ``sources`` maps output fields to the column or expression
+    selecting them (joined names included); other fields read the column
+    of the same name. Decimals and dates are formatted by the serializer's
+    own fields, so the JSON is byte-identical. ``dictionary_columns`` are the
+    repeated strings the columnar format sends once.
+    """
+    # Fields whose output differs from the value the database returns
+    FORMATTED = (serializers.DecimalField, serializers.DateTimeField, serializers.DateField)
+    
+    def __init__(self, serializer_class, sources, dictionary_columns=()):
+        self.serializer_class = serializer_class
+        self.sources = sources
+        self.dictionary_columns = dictionary_columns
+        self._formatters = None
+    
+    def formatters(self):
+        if self._formatters is None:
+            self._formatters = {
+                name: field.to_representation if isinstance(field, self.FORMATTED) else None
+                for name, field in self.serializer_class().fields.items()
+            }
+        return self._formatters
+    
+    def columns(self, fields=None):
+        return [name for name in self.serializer_class.Meta.fields if fields is None or name in fields]
+    
+    def values(self, queryset, names):
+        """Formatted value lists of the ``names`` columns, streamed from the database."""
+        formatters = self.formatters()
+        formats = [formatters[name] for name in names]
+        rows = queryset.values_list(*(self.sources.get(name, name) for name in names))
+        for row in rows.iterator(chunk_size=2000):
+            yield [value if format is None or value is None else format(value) for format, value in zip(formats, row)]
+    
+    def render(self, queryset, fields=None):
+        names = self.columns(fields)
+        return [dict(zip(names, values)) for values in self.values(queryset, names)]
+
+PRODUCT_ROWS = ValuesSerializer(ProductSerializer, {
+    'type': 'type__name',
+    'quantity': STOCK_QUANTITY,
+}, dictionary_columns=('type', 'location', 'unit_of_measure'))
+
+PRODUCT_STATS_ROWS = ValuesSerializer(ProductStatsSerializer, PRODUCT_ROWS.sources, PRODUCT_ROWS.dictionary_columns)
+
+TRANSACTION_ROWS = ValuesSerializer(StockTransactionSerializer, {
+    'product': 'product_id',
+    'product_name': 'product__name',
+    'supplier_ref': 'supplier_ref_id',
+    'client_ref': 'client_ref_id',
+    'supplier_name': Coalesce('supplier_ref__name', 'supplier'),
+    'client_name': Coalesce('client_ref__name', 'client'),
+}, dictionary_columns=('product_name', 'supplier', 'supplier_contact', 'client', 'client_contact',
+                       'supplier_name', 'client_name'))
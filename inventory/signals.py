@@ -0,0 +1,27 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete
+
+from .metrics import install_query_recorder
+from .models import Product, Supplier, Client, StockTransaction, DeletedRecord, RequestProfile
+
+# Models whose deletions are reported to delta-sync clients
+SYNCED_MODELS = (Product, Supplier, Client, StockTransaction)
+
+
+def record_deletion(sender, instance, **kwargs):
+    DeletedRecord.objects.create(model=sender._meta.model_name, object_id=instance.pk)
+
+
+for model in SYNCED_MODELS:
+    post_delete.connect(record_deletion, sender=model, dispatch_uid=f'sync_tombstone_{model._meta.model_name}')
+
+# Per-request query counts and times for the request metrics
+connection_created.connect(install_query_recorder, dispatch_uid='request_metrics_queries')
+
+
+def delete_profile_files(sender, instance, **kwargs):
+    instance.stats_file.delete(save=False)
+    instance.report_file.delete(save=False)
+
+
+post_delete.connect(delete_profile_files, sender=RequestProfile, dispatch_uid='request_profile_files')
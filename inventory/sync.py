@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .counters import PENDING_STOCK
+from .models import Product, Supplier, Client, StockTransaction, DeletedRecord
+
+# Rows updated this close to the previous sync are sent again, so writes that
+# were still in flight when the watermark was taken are not missed.
+# Clients upsert by id, so the repeats are harmless.
+WATERMARK_OVERLAP = timedelta(seconds=5)
+
+# Maximum number of transactions / tombstones returned per sync call
+SYNC_BATCH_SIZE = 1000
+
+
+class Watermark:
+    """
+    Position of a client in the change stream.
+
+    Encoded as ``<updated_at micros>-<last transaction id>-<last tombstone id>``;
+    ``0`` (or no watermark) means the client has nothing cached yet.
+    """
+
+    def __init__(self, updated_since=None, transaction_id=0, deleted_id=0):
+        self.updated_since = updated_since
+        self.transaction_id = transaction_id
+        self.deleted_id = deleted_id
+
+    @classmethod
+    def parse(cls, value):
+        if not value or value == '0':
+            return cls()
+        try:
+            micros, transaction_id, deleted_id = (int(part) for part in value.split('-'))
+        except ValueError:
+            raise ValueError("Invalid watermark. Use the 'watermark' value returned by the previous sync")
+        updated_since = datetime.fromtimestamp(micros / 1_000_000, tz=dt_timezone.utc)
+        return cls(updated_since, transaction_id, deleted_id)
+
+    def __str__(self):
+        micros = int(self.updated_since.timestamp() * 1_000_000) if self.updated_since else 0
+        return f'{micros}-{self.transaction_id}-{self.deleted_id}'
+
+
+def changed_since(queryset, watermark):
+    if watermark.updated_since is None:
+        return queryset
+    return queryset.filter(updated_at__gte=watermark.updated_since)
+
+
+def changed_products(queryset, watermark):
+    """
+    Products updated after ``watermark``, and sharded products moved since:
+    a movement taken on a counter slot leaves the product row untouched.
+    """
+    if watermark.updated_since is None:
+        return queryset
+    moved = (
+        StockTransaction.objects
+        .filter(id__gt=watermark.transaction_id, product__sharded_stock=True)
+        .values('product_id')
+    )
+    return queryset.filter(Q(updated_at__gte=watermark.updated_since) | Q(id__in=moved))
+
+
+def get_changes(watermark, batch_size=SYNC_BATCH_SIZE):
+    """
+    Collect everything that changed after ``watermark``.
+
+    Returns a dict of querysets/lists plus the watermark for the next call
+    and a ``has_more`` flag when the transaction or tombstone batch was cut.
+    """
+    # Taken before reading so rows changed while we read are picked up next time
+    next_updated_since = timezone.now() - WATERMARK_OVERLAP
+
+    transactions = list(
+        StockTransaction.objects
+        .filter(id__gt=watermark.transaction_id)
+        .select_related('product', 'supplier_ref', 'client_ref')
+        .order_by('id')[:batch_size]
+    )
+    if watermark.updated_since is None:
+        # A full sync has nothing to delete; skip the tombstones recorded so far
+        deleted = []
+        deleted_id = DeletedRecord.objects.aggregate(latest=Max('id'))['latest'] or 0
+    else:
+        deleted = list(
+            DeletedRecord.objects
+            .filter(id__gt=watermark.deleted_id)
+            .order_by('id')
+            .values_list('id', 'model', 'object_id')[:batch_size]
+        )
+        deleted_id = deleted[-1][0] if deleted else watermark.deleted_id
+
+    deleted_ids = {}
+    for _, model, object_id in deleted:
+        deleted_ids.setdefault(model, []).append(object_id)
+
+    next_watermark = Watermark(
+        updated_since=next_updated_since,
+        transaction_id=transactions[-1].id if transactions else watermark.transaction_id,
+        deleted_id=deleted_id,
+    )
+
+    return {
+        'products': changed_products(
+            Product.objects.select_related('type').annotate(pending_stock=PENDING_STOCK), watermark
+        ).order_by('id'),
+        'suppliers': changed_since(Supplier.objects.all(), watermark).order_by('id'),
+        'clients': changed_since(Client.objects.all(), watermark).order_by('id'),
+        'transactions': transactions,
+        'deleted': deleted_ids,
+        'watermark': next_watermark,
+        'has_more': len(transactions) == batch_size or len(deleted) == batch_size,
+    }
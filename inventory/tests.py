@@ -1,3 +1,1681 @@
-from django.test import TestCase
+import importlib.util
+import io
+import json
+import marshal
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from importlib import import_module
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.contrib import admin
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client.parser import text_string_to_metric_families
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import counters, product_stats, reconciliation
+from .archive import OPENING_BALANCE_NOTE, archive_transactions
+from .benchmarks import api_path, endpoint_requests, uncovered_routes
+from .management.commands.benchmark_stock_contention import BENCHMARK_SKU
+from .datagen import DatasetGenerator
+from .export import TRANSACTION_COLUMNS
+from .models import (
+    ArchivedStockTransaction, DeletedRecord, Lot, Product, ProductStats, ProductType, ReorderSuggestion, RequestProfile,
+    StockCounter, StockTransaction, Supplier,
+)
+from .profiling import QueryLog
+from .reconciliation import ADJUSTMENT_NOTE, find_mismatches
+from .serializers import (
+    PRODUCT_ROWS, TRANSACTION_ROWS, ProductSerializer, StockTransactionSerializer,
+)
+from .renderers import ColumnarRenderer, stream_columnar
+from .sync import WATERMARK_OVERLAP, Watermark, get_changes
+
+# Fixtures the query counts are compared across; the second adds its rows
+# to the first, so every table grows several times over. Both are big
+# enough for the requests to take the same branches (lots expiring soon,
+# lots on the busiest product)
+SMALL_DATASET = dict(products=40, suppliers=4, clients=8, transactions=500, types=3, days=90, prefix='SMALL')
+LARGE_DATASET = dict(products=60, suppliers=12, clients=30, transactions=3000, types=6, days=90, seed=1,
+                     prefix='LARGE')
+
+
+def full_scans(sql, params):
+    """
+    Tables of the inventory app that SQLite reads in full, without an index,
+    to run ``sql``.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        details = [row[-1] for row in cursor.fetchall()]
+    return [
+        detail for detail in details
+        if detail.startswith('SCAN inventory_') and ' USING ' not in detail
+    ]
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class PerformanceTestCase(TestCase):
+    dataset = SMALL_DATASET
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('perf', 'perf@example.com', None)
+        DatasetGenerator(**cls.dataset).run()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def request(self, method, path, data=None):
+        """Response and QueryLog of a request, run with empty caches."""
+        cache.clear()
+        queries = QueryLog()
+        with connection.execute_wrapper(queries):
+            if method == 'get':
+                response = self.client.get(path)
+            else:
+                response = self.client.generic(method.upper(), path, json.dumps(data), 'application/json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response, queries.queries
+
+
+class QueryCountTests(PerformanceTestCase):
+    """
+    Every endpoint must run the same number of queries however many rows
+    there are; a count that grows is an N+1 (e.g. a related object read
+    per row in a serializer).
+    """
+
+    def query_counts(self):
+        counts = {}
+        for label, _, method, path, data in endpoint_requests():
+            response, queries = self.request(method, path, data)
+            self.assertLess(response.status_code, 400, f'{label}: {response.status_code}')
+            counts[label] = len(queries)
+        return counts
+
+    def test_every_route_is_covered(self):
+        self.assertEqual(uncovered_routes(endpoint_requests()), set())
+
+    def test_query_counts_do_not_grow_with_rows(self):
+        small = self.query_counts()
+        DatasetGenerator(**LARGE_DATASET).run()
+        large = self.query_counts()
+        for label, count in small.items():
+            with self.subTest(label):
+                self.assertEqual(large[label], count)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'Plans are read from SQLite EXPLAIN QUERY PLAN')
+class QueryPlanTests(PerformanceTestCase):
+    """The hot ledger and product queries must be served by an index, not a full table scan."""
+
+    dataset = LARGE_DATASET
+
+    def assertIndexed(self, path):
+        response, queries = self.request('get', path)
+        self.assertEqual(response.status_code, 200)
+        selects = [
+            (sql, params) for sql, params, _, _ in queries
+            if sql.startswith('SELECT') and 'inventory_' in sql
+        ]
+        self.assertTrue(selects)
+        for sql, params in selects:
+            with self.subTest(sql=sql[:200]):
+                self.assertEqual(full_scans(sql, params), [])
+
+    def test_reports(self):
+        self.assertIndexed(api_path('reports') + '?start_date=2000-01-01')
+        self.assertIndexed(api_path('reports') + '?report_type=sales&start_date=2000-01-01&end_date=2100-01-01')
+
+    def test_product_stats(self):
+        self.assertIndexed(api_path('product-stats'))
+
+    def test_stock_history(self):
+        self.assertIndexed(api_path('stocktransaction-list'))
+        transaction = StockTransaction.objects.filter(supplier_ref__isnull=False).latest('id')
+        self.assertIndexed(api_path('stocktransaction-detail', transaction.id))
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None, STOCK_COUNTER_SLOTS=4)
+class ShardedStockTests(TestCase):
+    """Movements of products with sharded stock, on counter slots and under the product lock."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('sharded', 'sharded@example.com', None)
+        product_type = ProductType.objects.create(name='Sharded')
+        cls.product = Product.objects.create(name='Fast mover', sku='FAST-1', type=product_type, quantity=40,
+                                             selling_price=Decimal('2.50'))
+        counters.enable(cls.product.id)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def move(self, transaction_type, quantity, **data):
+        return self.client.post(api_path('stock-update'), {
+            'product': self.product.id, 'type': transaction_type, 'quantity': quantity, 'unit_price': '2.50',
+            **data,
+        }, content_type='application/json')
+
+    def assertStatsMatchLedger(self):
+        stats = ProductStats.objects.get(product=self.product)
+        totals = product_stats.ledger_totals([self.product.id])[self.product.id]
+        self.assertEqual(
+            (stats.total_in, stats.total_out, stats.revenue, stats.last_movement_date),
+            (totals['total_in'], totals['total_out'], totals['revenue'], totals['last_movement_date']),
+        )
+
+    def slots(self):
+        slots = StockCounter.objects.filter(product=self.product).order_by('slot')
+        return list(slots.values_list('delta', 'allowance'))
+
+    def test_share_out_splits_the_stock_between_the_slots(self):
+        self.assertEqual(self.slots(), [(0, 10)] * 4)
+        with self.settings(STOCK_COUNTER_SLOTS=3):
+            counters.compact(self.product.id, 11)
+        self.assertEqual(self.slots(), [(0, 4), (0, 4), (0, 3)])
+
+    def test_movements_go_to_slots_within_their_allowance(self):
+        product = Product.objects.get(id=self.product.id)
+        self.assertTrue(counters.apply_movement(product, 'IN', 5))
+        self.assertTrue(counters.apply_movement(product, 'OUT', 12))
+        # No slot has 16 left, nor does a lot movement go to one
+        self.assertFalse(counters.apply_movement(product, 'OUT', 16))
+        self.assertFalse(counters.apply_movement(product, 'IN', 5, receives_lot=True))
+        self.assertEqual(sum(delta for delta, _ in self.slots()), -7)
+        self.assertEqual(counters.stock_of(product), 33)
+        self.assertEqual(Product.objects.get(id=product.id).quantity, 40)
+
+    def test_fold_and_compact_move_the_deltas_into_the_quantity(self):
+        product = Product.objects.get(id=self.product.id)
+        counters.apply_movement(product, 'OUT', 4)
+        with transaction.atomic():
+            product = counters.lock_product(product.id)
+            counters.fold(product)
+            self.assertEqual(product.quantity, 36)
+            self.assertTrue(all(delta == 0 for delta, _ in self.slots()))
+            # Not saved: rolling back restores the deltas
+            transaction.set_rollback(True)
+        self.assertEqual(counters.stock_of(product), 36)
+
+        counters.apply_movement(product, 'IN', 2)
+        self.assertEqual(list(counters.pending_products()), [product.id])
+        self.assertEqual(counters.compact(product.id).quantity, 38)
+        self.assertEqual(self.slots(), [(0, 10), (0, 10), (0, 9), (0, 9)])
+        self.assertEqual(list(counters.pending_products()), [])
+        # A set quantity replaces the deltas
+        counters.apply_movement(product, 'IN', 2)
+        self.assertEqual(counters.compact(product.id, 7).quantity, 7)
+        self.assertEqual(counters.stock_of(product), 7)
+
+    def test_sales_never_take_the_stock_below_zero(self):
+        product = Product.objects.get(id=self.product.id)
+        sold = 0
+        while counters.apply_movement(product, 'OUT', 3):
+            sold += 3
+        # Each slot of 10 takes three sales of 3; the rest falls back to the lock
+        self.assertEqual(sold, 36)
+        self.assertEqual(self.move('OUT', 5).json(), {'error': 'Insufficient stock'})
+        self.assertEqual(counters.stock_of(product), 4)
+        self.assertEqual(self.move('OUT', 4).status_code, 200)
+        self.assertEqual(counters.stock_of(product), 0)
+        self.assertFalse(counters.apply_movement(product, 'OUT', 1))
+
+    def test_stock_reads_include_the_slots(self):
+        counters.compact(self.product.id, 3)
+        self.assertEqual(self.move('IN', 10).status_code, 200)
+        self.assertTrue(StockCounter.objects.filter(product=self.product, delta=10).exists())
+
+        response = self.client.get(api_path('product-low-stock'), {'threshold': 5})
+        self.assertEqual(response.json(), [])
+        response = self.client.get(api_path('product-list'), {'below_minimum': 'true'})
+        self.assertEqual(response.json(), [])
+        self.assertEqual(self.client.get(api_path('product-stats')).json()['low_stock_count'], 0)
+        [breakdown] = self.client.get(api_path('reports-categories')).json()
+        self.assertEqual((breakdown['total_quantity'], breakdown['below_minimum']), (13, 0))
+
+    def test_sync_sends_products_moved_on_slots(self):
+        Product.objects.filter(id=self.product.id).update(updated_at=timezone.now() - timedelta(days=1))
+        watermark = self.client.get(api_path('sync')).json()['watermark']
+        self.assertEqual(self.client.get(api_path('sync'), {'since': watermark}).json()['products'], [])
+        self.assertEqual(self.move('IN', 1).status_code, 200)
+        products = self.client.get(api_path('sync'), {'since': watermark}).json()['products']
+        self.assertEqual([product['quantity'] for product in products], [41])
+
+    def test_stats_catch_up_with_slot_movements_followed_by_locked_ones(self):
+        # Within one slot's allowance, then more than any slot has left
+        self.assertEqual(self.move('OUT', 3).status_code, 200)
+        self.assertEqual(StockCounter.objects.filter(product=self.product).exclude(delta=0).count(), 1)
+        self.assertEqual(self.move('OUT', 20).status_code, 200)
+        self.assertFalse(StockCounter.objects.filter(product=self.product).exclude(delta=0).exists())
+
+        call_command('compact_stock_counters', stdout=io.StringIO())
+        self.assertStatsMatchLedger()
+        self.assertEqual(ProductStats.objects.get(product=self.product).total_out, 23)
+        self.assertFalse(StockCounter.objects.filter(product=self.product, unrecorded__gt=0).exists())
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class StockEventsTests(TestCase):
+    """Opening the stock event stream."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('events', 'events@example.com', 'events')
+
+    def ticket(self):
+        self.client.force_login(self.user)
+        response = self.client.post(api_path('stock-events-ticket'))
+        self.client.logout()
+        self.assertEqual(response.status_code, 200)
+        return response.json()['ticket']
+
+    def test_wsgi_answers_not_implemented(self):
+        response = self.client.get(api_path('stock-events'), {'ticket': self.ticket()})
+        self.assertEqual(response.status_code, 501)
+
+    async def test_ticket_opens_the_stream(self):
+        ticket = await sync_to_async(self.ticket)()
+        response = await self.async_client.get(api_path('stock-events'), {'ticket': ticket})
+        self.assertEqual(response.status_code, 200)
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b'retry:'))
+        await response.streaming_content.aclose()
+
+    async def test_invalid_expired_or_token_credentials_are_refused(self):
+        ticket = await sync_to_async(self.ticket)()
+        token = await Token.objects.acreate(user=self.user)
+        for params in ({'ticket': ticket + 'x'}, {'token': token.key}):
+            with self.subTest(params=params):
+                response = await self.async_client.get(api_path('stock-events'), params)
+                self.assertEqual(response.status_code, 401)
+        with override_settings(STOCK_EVENTS_TICKET_MAX_AGE=-1):
+            response = await self.async_client.get(api_path('stock-events'), {'ticket': ticket})
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None, STOCK_COUNTER_SLOTS=4)
+class ConcurrentShardedSalesTests(TransactionTestCase):
+    """Sales of one sharded product posted at once from several threads."""
+
+    def test_concurrent_sales_never_take_the_stock_below_zero(self):
+        user = User.objects.create_superuser('concurrent', 'concurrent@example.com', None)
+        product_type = ProductType.objects.create(name='Concurrent')
+        product = Product.objects.create(name='Rush', sku='RUSH-1', type=product_type, quantity=8)
+        counters.enable(product.id)
+        start = threading.Barrier(6)
+        accepted = []
+
+        sale = {'product': product.id, 'quantity': 1, 'type': 'OUT'}
+
+        def sell(client):
+            try:
+                start.wait()
+                for _ in range(6):
+                    response = client.post(api_path('stock-update'), sale, content_type='application/json')
+                    if response.status_code == 200:
+                        accepted.append(response)
+            finally:
+                connection.close()
+
+        threads = []
+        for _ in range(6):
+            # Logged in up front, so every thread reaches the barrier
+            client = Client(HTTP_HOST='localhost')
+            client.force_login(user)
+            threads.append(threading.Thread(target=sell, args=(client,)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 36 sales of 8 units: whatever the interleaving, no more are
+        # accepted than there was stock, and each one is in the ledger
+        product = counters.compact(product.id)
+        self.assertGreaterEqual(product.quantity, 0)
+        self.assertLessEqual(len(accepted), 8)
+        self.assertEqual(StockTransaction.objects.filter(product=product).count(), len(accepted))
+        self.assertEqual(product.quantity, 8 - len(accepted))
+
+
+@override_settings(STOCK_COUNTER_SLOTS=4)
+class BenchmarkStockContentionTests(TransactionTestCase):
+    """benchmark_stock_contention runs both modes and cleans up after itself."""
+
+    def run_benchmark(self):
+        out = io.StringIO()
+        call_command('benchmark_stock_contention', threads=1, movements=3, stdout=out)
+        return out.getvalue()
+
+    def test_runs_twice_and_leaves_nothing_behind(self):
+        # As left by an interrupted run
+        product_type = ProductType.objects.create(name='Benchmark')
+        stale = Product.objects.create(name='Stale', sku=BENCHMARK_SKU, type=product_type, quantity=1)
+        StockTransaction.objects.create(product=stale, type='IN', quantity=1)
+        product_stats.refresh([stale.id])
+
+        for _ in range(2):
+            output = self.run_benchmark()
+            rows = [line.split() for line in output.splitlines() if line.startswith(('locked', 'sharded'))]
+            # Every movement accepted, three units sold of three
+            self.assertEqual([(row[0], row[4], row[5]) for row in rows], [('locked', '0', '0'), ('sharded', '0', '0')])
+            self.assertNotIn('does not match', output)
+        self.assertFalse(Product.objects.filter(sku=BENCHMARK_SKU).exists())
+        self.assertFalse(StockTransaction.objects.exists())
+        self.assertFalse(ProductStats.objects.exists())
+        self.assertFalse(DeletedRecord.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class ProductTimelineTests(TestCase):
+    """Paging through the movements of one product with their balances."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('timeline', 'timeline@example.com', None)
+        product_type = ProductType.objects.create(name='Timeline')
+        cls.product = Product.objects.create(name='Timeline product', sku='TIME-1', type=product_type)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        for transaction_type, quantity in (('IN', 10), ('OUT', 3), ('IN', 5), ('OUT', 4), ('OUT', 1)):
+            response = self.client.post(api_path('stock-update'), {
+                'product': self.product.id, 'type': transaction_type, 'quantity': quantity, 'unit_price': '1.50',
+            }, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+    def timeline(self, **params):
+        return self.client.get(api_path('product-timeline', self.product.id), params)
+
+    def test_pages_chain_their_balances(self):
+        rows = []
+        params = {'limit': 2}
+        while True:
+            page = self.timeline(**params).json()
+            rows += page['results']
+            if not page['next']:
+                break
+            params['cursor'] = page['next']
+        self.assertEqual([row['quantity'] for row in rows], [1, 4, 5, 3, 10])
+        self.assertEqual([(row['balance_before'], row['balance_after']) for row in rows],
+                         [(8, 7), (12, 8), (7, 12), (10, 7), (0, 10)])
+        self.assertEqual({row['unit_price'] for row in rows}, {'1.50'})
+
+    def test_limit_is_clamped_and_validated(self):
+        self.assertEqual(len(self.timeline(limit=0).json()['results']), 1)
+        self.assertEqual(len(self.timeline(limit=-3).json()['results']), 1)
+        self.assertEqual(len(self.timeline(limit=10**6).json()['results']), 5)
+        for params in ({'limit': 'abc'}, {'cursor': 'x.1.2'}, {'cursor': f'{10**20}.1.2'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.timeline(**params).status_code, 400)
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class ReportParamsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('profit', 'profit@example.com', None)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_paging_is_validated(self):
+        for params in ({'limit': 0}, {'limit': -5}, {'offset': -1}, {'limit': 'ten'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(api_path('reports-profit'), params).status_code, 400)
+        response = self.client.get(api_path('reports-profit'), {'limit': 5000, 'offset': 3})
+        self.assertEqual(response.status_code, 200)
+
+    def test_out_of_range_dates_are_rejected(self):
+        for name in ('reports', 'reports-timeseries', 'reports-profit'):
+            with self.subTest(name=name):
+                response = self.client.get(api_path(name), {'start_date': '2020-01-01', 'end_date': '9999-12-31'})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'end_date is out of range'})
+
+    def test_open_ended_timeseries_ranges_are_bounded(self):
+        timeseries = api_path('reports-timeseries')
+        response = self.client.get(timeseries, {'start_date': '0001-01-01', 'interval': 'day'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Date range too large for this interval'})
+        self.assertEqual(self.client.get(timeseries, {'start_date': '0001-01-01', 'interval': 'month'}).status_code, 400)
+
+        # Without start_date the oldest transaction bounds the range
+        product_type = ProductType.objects.create(name='Timeseries')
+        product = Product.objects.create(name='Old stock', sku='OLD-1', type=product_type)
+        movement = StockTransaction.objects.create(product=product, type='IN', quantity=1)
+        today = timezone.localdate()
+        self.assertEqual(self.client.get(timeseries, {'end_date': today.isoformat()}).status_code, 200)
+        StockTransaction.objects.filter(id=movement.id).update(date=timezone.now() - timedelta(days=6000))
+        self.assertEqual(self.client.get(timeseries, {'end_date': today.isoformat()}).status_code, 400)
+        self.assertEqual(self.client.get(timeseries, {'interval': 'week'}).status_code, 200)
+
+        # An open end stops today
+        start = today - timedelta(days=3)
+        series = self.client.get(timeseries, {'start_date': start.isoformat()}).json()['series']
+        self.assertEqual([row['period'] for row in series], [(start + timedelta(days=i)).isoformat() for i in range(4)])
+
+    def test_low_stock_threshold_is_validated(self):
+        for threshold in ('abc', '-1', '1e3', str(2 ** 63)):
+            with self.subTest(threshold=threshold):
+                response = self.client.get(api_path('product-low-stock'), {'threshold': threshold})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('threshold', response.json())
+        self.assertEqual(self.client.get(api_path('product-low-stock'), {'threshold': 0}).status_code, 200)
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class LotAllocationTests(TestCase):
+    """Sales drawn from a product's lots, first expiry first out."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('lots', 'lots@example.com', None)
+        product_type = ProductType.objects.create(name='Perishable')
+        cls.product = Product.objects.create(name='Milk', sku='MILK-1', type=product_type)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.today = timezone.localdate()
+
+    def move(self, transaction_type, quantity, **data):
+        return self.client.post(api_path('stock-update'), {
+            'product': self.product.id, 'type': transaction_type, 'quantity': quantity, **data,
+        }, content_type='application/json')
+
+    def receive(self, batch_number, quantity, expires_in):
+        expiry_date = (self.today + timedelta(days=expires_in)).isoformat()
+        response = self.move('IN', quantity, batch_number=batch_number, expiry_date=expiry_date)
+        self.assertEqual(response.status_code, 200)
+
+    def remaining(self):
+        return dict(Lot.objects.filter(product=self.product).values_list('batch_number', 'quantity'))
+
+    def test_sales_take_the_earliest_expiry_first_and_split_lots(self):
+        self.receive('LATE', 5, 30)
+        self.receive('EARLY', 4, 5)
+        response = self.move('OUT', 6)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(lot['batch_number'], lot['quantity']) for lot in response.json()['lots']],
+                         [('EARLY', 4), ('LATE', 2)])
+        self.assertEqual(self.remaining(), {'EARLY': 0, 'LATE': 3})
+        # The product shows the next lot to expire
+        product = Product.objects.get(id=self.product.id)
+        self.assertEqual((product.batch_number, product.quantity), ('LATE', 3))
+
+    def test_expired_lots_are_not_sold(self):
+        self.receive('OLD', 4, 1)
+        self.receive('FRESH', 3, 10)
+        Lot.objects.filter(batch_number='OLD').update(expiry_date=self.today - timedelta(days=1))
+        Product.objects.filter(id=self.product.id).update(expiry_date=self.today - timedelta(days=1))
+
+        response = self.move('OUT', 5)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('4 units are in expired lots', response.json()['error'])
+        self.assertEqual(self.remaining(), {'OLD': 4, 'FRESH': 3})
+
+        response = self.move('OUT', 2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([lot['batch_number'] for lot in response.json()['lots']], ['FRESH'])
+        self.assertEqual(self.remaining(), {'OLD': 4, 'FRESH': 1})
+
+    def test_expiring_window_is_validated(self):
+        for within in ('-1', '3651', '10000000000', 'soon'):
+            with self.subTest(within=within):
+                response = self.client.get(api_path('lot-expiring'), {'within': within})
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(api_path('lot-expiring'), {'within': 3650}).status_code, 200)
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class AnalyticsCacheTests(TestCase):
+    """Cached analytics keyed on ledger_version."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('analytics', 'analytics@example.com', None)
+        product_type = ProductType.objects.create(name='Beverages')
+        cls.product = Product.objects.create(name='Tea', sku='TEA-1', type=product_type, quantity=10)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client(HTTP_HOST='localhost')
+        self.client.force_login(self.user)
+
+    def revenue(self):
+        response = self.client.get(api_path('reports-products'))
+        self.assertEqual(response.status_code, 200)
+        return {row['id']: row['revenue'] for row in response.json()['products']}[self.product.id]
+
+    def test_edited_movement_invalidates_cached_analytics(self):
+        sale = StockTransaction.objects.create(product=self.product, type='OUT', quantity=2, unit_price=Decimal('3'))
+        self.assertEqual(self.revenue(), 6.0)
+
+        sale.unit_price = Decimal('5')
+        sale.save()
+        self.assertEqual(self.revenue(), 10.0)
+
+    def test_bulk_recalculated_totals_invalidate_cached_analytics(self):
+        sale = StockTransaction.objects.create(product=self.product, type='OUT', quantity=2, unit_price=Decimal('3'))
+        self.assertEqual(self.revenue(), 6.0)
+
+        # A price fixed in bulk, then the totals recalculated by the admin action
+        StockTransaction.objects.filter(id=sale.id).update(unit_price=Decimal('4'))
+        response = self.client.post('/admin/inventory/stocktransaction/', {
+            'action': 'recalculate_totals', '_selected_action': [sale.id],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.revenue(), 8.0)
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class ArchiveTests(TestCase):
+    """Old movements moved to the archive behind opening-balance rows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('archive', 'archive@example.com', None)
+        cls.product_type = ProductType.objects.create(name='Archive')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.now = timezone.now()
+        self.products = [
+            Product.objects.create(name=f'Archived {i}', sku=f'ARCH-{i}', type=self.product_type) for i in range(2)
+        ]
+        # Ten days of movements, one a day, oldest first
+        movements = [('IN', 20), ('OUT', 3), ('OUT', 4), ('IN', 6), ('OUT', 2),
+                     ('OUT', 5), ('IN', 1), ('OUT', 7), ('IN', 2), ('OUT', 1)]
+        for product in self.products:
+            for days_ago, (transaction_type, quantity) in zip(range(10, 0, -1), movements):
+                response = self.client.post(api_path('stock-update'), {
+                    'product': product.id, 'type': transaction_type, 'quantity': quantity, 'unit_price': '2.00',
+                }, content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+                StockTransaction.objects.filter(id=response.json()['transaction_id']).update(
+                    date=self.now - timedelta(days=days_ago))
+
+    def balances(self, product):
+        """``{id: (balance_before, balance_after)}`` of every movement on the timeline."""
+        response = self.client.get(api_path('product-timeline', product.id), {'limit': 500})
+        return {row['id']: (row['balance_before'], row['balance_after']) for row in response.json()['results']}
+
+    def archive(self, days_ago):
+        cutoff = self.now - timedelta(days=days_ago, hours=12)
+        # Small chunks, so later chunks add to the opening rows of earlier ones
+        list(archive_transactions(StockTransaction.objects.filter(date__lt=cutoff), cutoff, chunk_size=3))
+        return cutoff
+
+    def test_carried_forward_balances_match_the_full_ledger(self):
+        before = {product.id: self.balances(product) for product in self.products}
+        totals = product_stats.ledger_totals([product.id for product in self.products])
+
+        cutoff = self.archive(6)
+        for product in self.products:
+            kept = self.balances(product)
+            opening = StockTransaction.objects.get(product=product, is_opening_balance=True)
+            self.assertEqual((opening.date, opening.notes), (cutoff, OPENING_BALANCE_NOTE))
+            # The opening row starts from zero and ends where the archived rows did
+            self.assertEqual(kept.pop(opening.id), (0, 20 - 3 - 4 + 6))
+            self.assertEqual(kept, {row_id: balance for row_id, balance in before[product.id].items() if row_id in kept})
+            self.assertEqual(len(kept), 6)
+        self.assertEqual(ArchivedStockTransaction.objects.count(), 8)
+        self.assertEqual(list(find_mismatches()), [])
+        self.assertEqual(product_stats.ledger_totals([product.id for product in self.products]), totals)
+
+        # A later cutoff archives the opening row too and carries it into a new one
+        self.archive(3)
+        for product in self.products:
+            kept = self.balances(product)
+            opening = StockTransaction.objects.get(product=product, is_opening_balance=True)
+            self.assertEqual(kept.pop(opening.id), (0, 19 - 2 - 5 + 1))
+            self.assertEqual(kept, {row_id: balance for row_id, balance in before[product.id].items() if row_id in kept})
+            self.assertEqual(len(kept), 3)
+        self.assertEqual(list(find_mismatches()), [])
+        self.assertEqual(product_stats.ledger_totals([product.id for product in self.products]), totals)
+
+
+@override_settings(STOCK_COUNTER_SLOTS=4)
+class ReconciliationTests(TestCase):
+    """Product quantities checked and repaired against the ledger."""
+
+    @classmethod
+    def setUpTestData(cls):
+        product_type = ProductType.objects.create(name='Reconciled')
+        cls.drifted = Product.objects.create(name='Drifted', sku='REC-1', type=product_type, quantity=12)
+        cls.matching = Product.objects.create(name='Matching', sku='REC-2', type=product_type, quantity=5)
+        cls.sharded = Product.objects.create(name='Sharded', sku='REC-3', type=product_type, quantity=30)
+        counters.enable(cls.sharded.id)
+        for product, quantity in ((cls.drifted, 10), (cls.matching, 7), (cls.sharded, 25)):
+            StockTransaction.objects.create(product=product, type='IN', quantity=quantity)
+        StockTransaction.objects.create(product=cls.matching, type='OUT', quantity=2)
+        # Movements taken on the counter slots count towards the stock too
+        StockCounter.objects.filter(product=cls.sharded, slot=0).update(delta=3)
+        cls.user = User.objects.create_superuser('reconcile', 'reconcile@example.com', None)
+
+    def reconcile(self, *args, **options):
+        out = io.StringIO()
+        call_command('cleanup_invalid_transactions', *args, stdout=out, **options)
+        return out.getvalue()
+
+    def test_mismatches_are_found_whole_and_in_chunks(self):
+        expected = [(self.drifted.id, 12, 10), (self.sharded.id, 33, 25)]
+        self.assertEqual(list(find_mismatches()), expected)
+        self.assertEqual(list(find_mismatches(chunk_size=1)), expected)
+        self.assertIn('Found 2 products not matching the ledger', self.reconcile())
+
+    def test_repair_quantity_sets_the_ledger_balance(self):
+        updated_at = Product.objects.get(id=self.drifted.id).updated_at
+        self.assertIn('Set quantity from the ledger for 2 products', self.reconcile(repair='quantity'))
+        self.assertEqual(list(find_mismatches()), [])
+        products = Product.objects.in_bulk([self.drifted.id, self.matching.id, self.sharded.id])
+        self.assertEqual([products[product.id].quantity for product in (self.drifted, self.matching, self.sharded)],
+                         [10, 5, 25])
+        # Delta-sync clients see the new quantity
+        self.assertGreater(products[self.drifted.id].updated_at, updated_at)
+        # The counter deltas are dropped and the new quantity shared out
+        slots = StockCounter.objects.filter(product=self.sharded)
+        self.assertEqual(list(slots.order_by('slot').values_list('delta', 'allowance')),
+                         [(0, 7), (0, 6), (0, 6), (0, 6)])
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=None)
+    def test_repair_keeps_movements_posted_after_the_check(self):
+        mismatches = list(find_mismatches())
+        self.client.force_login(self.user)
+        response = self.client.post(api_path('stock-update'), {
+            'product': self.drifted.id, 'type': 'IN', 'quantity': 3,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        # Fixed by hand meanwhile; nothing left to repair
+        counters.compact(self.sharded.id, 25)
+
+        self.assertEqual(reconciliation.repair_quantities(mismatches), 1)
+        self.assertEqual(list(find_mismatches()), [])
+        # The ledger balance now, not the one found by the check
+        self.assertEqual(Product.objects.get(id=self.drifted.id).quantity, 13)
+
+    def test_repair_ledger_writes_adjustments(self):
+        self.assertIn('Wrote 2 adjustment transactions', self.reconcile(repair='ledger'))
+        self.assertEqual(list(find_mismatches()), [])
+        adjustments = StockTransaction.objects.filter(notes=ADJUSTMENT_NOTE).order_by('product_id')
+        self.assertEqual(list(adjustments.values_list('product_id', 'type', 'quantity', 'is_opening_balance')),
+                         [(self.drifted.id, 'IN', 2, True), (self.sharded.id, 'IN', 8, True)])
+        self.assertEqual(counters.stock_of(Product.objects.get(id=self.sharded.id)), 33)
+
+    def test_invalid_transactions_are_deleted_and_stats_refreshed(self):
+        product_stats.refresh([self.matching.id])
+        invalid = StockTransaction.objects.get(product=self.matching, type='OUT')
+        StockTransaction.objects.filter(id=invalid.id).update(quantity=0)
+        output = self.reconcile(delete_invalid=True)
+        self.assertIn('Deleted 1 invalid transactions', output)
+        self.assertFalse(StockTransaction.objects.filter(id=invalid.id).exists())
+        self.assertEqual(ProductStats.objects.get(product=self.matching).total_out, 0)
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class SyncTests(TestCase):
+    """Delta sync from a watermark: overlapping updates, new ledger rows and tombstones."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('sync', 'sync@example.com', None)
+        product_type = ProductType.objects.create(name='Synced')
+        cls.products = [
+            Product.objects.create(name=f'Synced {i}', sku=f'SYNC-{i}', type=product_type) for i in range(3)
+        ]
+        cls.supplier = Supplier.objects.create(name='Synced supplier')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        # Long unchanged, so only what the tests touch shows up again
+        Product.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        Supplier.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+
+    def sync(self, since=None):
+        response = self.client.get(api_path('sync'), {'since': since} if since else {})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_full_sync_then_changes_since_the_watermark(self):
+        # Deleted before the first sync; a client starting now never had it
+        Supplier.objects.create(name='Gone before').delete()
+        StockTransaction.objects.create(product=self.products[0], type='IN', quantity=4)
+        full = self.sync()
+        self.assertEqual(len(full['products']), 3)
+        self.assertEqual(len(full['transactions']), 1)
+        self.assertEqual(full['deleted'], {})
+        self.assertFalse(full['has_more'])
+
+        self.products[1].name = 'Renamed'
+        self.products[1].save()
+        movement = StockTransaction.objects.create(product=self.products[2], type='IN', quantity=2)
+        changes = self.sync(full['watermark'])
+        self.assertEqual([product['id'] for product in changes['products']], [self.products[1].id])
+        self.assertEqual([row['id'] for row in changes['transactions']], [movement.id])
+        self.assertEqual(changes['suppliers'], [])
+
+        # Nothing new after that but the overlap repeats
+        self.assertEqual(self.sync(changes['watermark'])['transactions'], [])
+
+    def test_updates_within_the_overlap_are_sent_again(self):
+        watermark = self.sync()['watermark']
+        # Committed just before the watermark was taken, e.g. by a slow request
+        Product.objects.filter(id=self.products[0].id).update(
+            updated_at=Watermark.parse(watermark).updated_since + WATERMARK_OVERLAP / 2)
+        Product.objects.filter(id=self.products[1].id).update(
+            updated_at=Watermark.parse(watermark).updated_since - timedelta(seconds=1))
+        changes = self.sync(watermark)
+        self.assertEqual([product['id'] for product in changes['products']], [self.products[0].id])
+
+    def test_deletions_are_sent_once_as_tombstones(self):
+        watermark = self.sync()['watermark']
+        movement = StockTransaction.objects.create(product=self.products[0], type='IN', quantity=1)
+        movement_id = movement.id
+        movement.delete()
+        supplier_id = self.supplier.id
+        self.supplier.delete()
+
+        changes = self.sync(watermark)
+        self.assertEqual(changes['deleted'], {'stocktransaction': [movement_id], 'supplier': [supplier_id]})
+        self.assertEqual(self.sync(changes['watermark'])['deleted'], {})
+
+    def test_batches_are_cut_with_has_more(self):
+        watermark = Watermark.parse(self.sync()['watermark'])
+        movements = [StockTransaction.objects.create(product=self.products[0], type='IN', quantity=1) for _ in range(3)]
+        deleted_ids = [product.id for product in self.products[1:]]
+        supplier_id = self.supplier.id
+        Product.objects.filter(id__in=deleted_ids).delete()
+        self.supplier.delete()
+
+        first = get_changes(watermark, batch_size=2)
+        self.assertTrue(first['has_more'])
+        self.assertEqual([row.id for row in first['transactions']], [row.id for row in movements[:2]])
+        self.assertEqual(sorted(first['deleted']['product']), deleted_ids)
+        self.assertEqual(list(first['deleted']), ['product'])
+
+        second = get_changes(first['watermark'], batch_size=2)
+        self.assertFalse(second['has_more'])
+        self.assertEqual([row.id for row in second['transactions']], [movements[2].id])
+        self.assertEqual(second['deleted'], {'supplier': [supplier_id]})
+
+    def test_invalid_watermark_is_refused(self):
+        response = self.client.get(api_path('sync'), {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+def decode_columnar(document):
+    """Rows of a columnar document as dicts, dictionary indexes resolved."""
+    dictionaries = document['dictionaries']
+    return [
+        {
+            name: dictionaries[name][value] if name in dictionaries and value is not None else value
+            for name, value in zip(document['columns'], row)
+        }
+        for row in document['rows']
+    ]
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class ColumnarFormatTests(TestCase):
+    """Columnar responses decode back to exactly the JSON rows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('columnar', 'columnar@example.com', None)
+        types = [ProductType.objects.create(name=name) for name in ('Dairy', 'Bakery')]
+        supplier = Supplier.objects.create(name='Farm Fresh')
+        for i in range(5):
+            product = Product.objects.create(
+                name=f'Columnar {i}', sku=f'COL-{i}', type=types[i % 2], quantity=10 + i,
+                location='Aisle 1' if i % 2 else None, buying_price=Decimal('1.25'), selling_price=Decimal('2.40'),
+            )
+            StockTransaction.objects.create(product=product, type='IN', quantity=5, supplier_ref=supplier,
+                                            supplier='Farm Fresh', unit_price=Decimal('1.25'))
+            StockTransaction.objects.create(product=product, type='OUT', quantity=2, client='Café Ünïcode',
+                                            discount=Decimal('0.30'))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def both(self, path, **params):
+        """The JSON and the columnar response of one request."""
+        plain = self.client.get(path, params)
+        columnar = self.client.get(path, {**params, 'format': 'columnar'})
+        self.assertEqual(plain.status_code, 200)
+        self.assertEqual(columnar.status_code, 200)
+        self.assertTrue(columnar.streaming)
+        self.assertTrue(columnar['Content-Type'].startswith(ColumnarRenderer.media_type))
+        return plain.json(), json.loads(b''.join(columnar.streaming_content))
+
+    def test_product_lists_round_trip(self):
+        for params in ({}, {'fields': 'id,name,type,location'}, {'stats': 'true'}):
+            with self.subTest(params=params):
+                plain, document = self.both(api_path('product-list'), **params)
+                self.assertEqual(decode_columnar(document), plain)
+                self.assertEqual(len(plain), 5)
+        # Repeated strings are sent once
+        _, document = self.both(api_path('product-list'))
+        self.assertEqual(sorted(document['dictionaries']['type']), ['Bakery', 'Dairy'])
+
+    def test_stock_history_and_reports_round_trip(self):
+        plain, document = self.both(api_path('stocktransaction-list'))
+        self.assertEqual(decode_columnar(document), plain)
+        self.assertEqual(len(plain), 10)
+
+        plain, document = self.both(api_path('reports'))
+        self.assertEqual(document['summary'], plain['summary'])
+        self.assertEqual(decode_columnar(document), plain['transactions'])
+
+    def test_accept_header_and_errors(self):
+        response = self.client.get(api_path('stocktransaction-list'), HTTP_ACCEPT=ColumnarRenderer.media_type)
+        self.assertEqual(len(decode_columnar(json.loads(b''.join(response.streaming_content)))), 10)
+        # Anything but the list itself still renders as plain JSON
+        response = self.client.get(api_path('reports'), {'format': 'columnar', 'end_date': '9999-12-31'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'end_date is out of range'})
+
+    def test_rows_are_streamed_in_chunks(self):
+        rows = [[i, None if i % 3 == 0 else f'name {i % 2}', '1.50'] for i in range(7)]
+        expected = [{'id': row[0], 'name': row[1], 'price': '1.50'} for row in rows]
+        chunks = list(stream_columnar(['id', 'name', 'price'], [list(row) for row in rows], ('name',),
+                                      head={'total': 7}, chunk_size=2))
+        # Head, columns, four chunks of rows, then the dictionaries
+        self.assertEqual(len(chunks), 7)
+        document = json.loads(''.join(chunks))
+        self.assertEqual(document['total'], 7)
+        self.assertEqual(document['dictionaries'], {'name': ['name 1', 'name 0']})
+        self.assertEqual(decode_columnar(document), expected)
+
+
+@override_settings(STOCK_COUNTER_SLOTS=4)
+class ValuesSerializerTests(TestCase):
+    """The values() fast paths render the same JSON as their ModelSerializers."""
+
+    @classmethod
+    def setUpTestData(cls):
+        product_type = ProductType.objects.create(name='Dairy')
+        supplier = Supplier.objects.create(name='Farm Fresh')
+        # Whole, fractional and missing decimals; dates set and left empty
+        plain = Product.objects.create(name='Milk', sku='VAL-1', type=product_type, quantity=12,
+                                       buying_price=Decimal('10'), selling_price=Decimal('12.5'),
+                                       price=Decimal('11.99'), expiry_date=timezone.localdate())
+        bare = Product.objects.create(name='Yoghurt', sku='VAL-2', type=product_type, quantity=0)
+        sharded = Product.objects.create(name='Butter', sku='VAL-3', type=product_type, quantity=40,
+                                         wastage=Decimal('0.25'), location='Cold room')
+        counters.enable(sharded.id)
+        # Pending counter deltas count towards the quantity
+        StockCounter.objects.filter(product=sharded, slot=0).update(delta=-3)
+        StockTransaction.objects.create(product=plain, type='IN', quantity=5, supplier_ref=supplier,
+                                        supplier='Farm Fresh', unit_price=Decimal('2'))
+        legacy = StockTransaction.objects.create(product=bare, type='IN', quantity=1, supplier='Legacy supplier')
+        # save() fills in prices; older rows may still have none
+        Product.objects.filter(pk=bare.pk).update(price=None)
+        StockTransaction.objects.filter(pk=legacy.pk).update(unit_price=None)
+        StockTransaction.objects.create(product=plain, type='OUT', quantity=2, client='Walk-in',
+                                        unit_price=Decimal('3.10'), discount=Decimal('0.5'),
+                                        is_wastage=True, wastage=Decimal('1.05'), notes='Damaged')
+
+    def assertRendersIdentically(self, values_serializer, serializer_data, queryset, fields=None):
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(values_serializer.render(queryset, fields)),
+                         renderer.render(serializer_data))
+
+    def test_product_rows(self):
+        products = Product.objects.order_by('id')
+        data = ProductSerializer(products.select_related('type'), many=True).data
+        self.assertRendersIdentically(PRODUCT_ROWS, data, products)
+        self.assertEqual([row['quantity'] for row in data], [12, 0, 37])
+        self.assertEqual(data[0]['buying_price'], '10.00')
+        self.assertIsNone(data[1]['price'])
+        self.assertIsNone(data[1]['expiry_date'])
+
+    def test_transaction_rows(self):
+        transactions = StockTransaction.objects.order_by('-date', '-id')
+        data = StockTransactionSerializer(
+            transactions.select_related('product', 'supplier_ref', 'client_ref'), many=True,
+        ).data
+        self.assertRendersIdentically(TRANSACTION_ROWS, data, transactions)
+        self.assertEqual([row['supplier_name'] for row in data], [None, 'Legacy supplier', 'Farm Fresh'])
+        self.assertEqual([row['unit_price'] for row in data], ['3.10', None, '2.00'])
+
+    def test_sparse_fields(self):
+        fields = {'id', 'date', 'unit_price', 'client_name'}
+        request = Request(RequestFactory().get('/', {'fields': ','.join(fields)}))
+        transactions = StockTransaction.objects.order_by('id')
+        data = StockTransactionSerializer(transactions, many=True, context={'request': request}).data
+        self.assertRendersIdentically(TRANSACTION_ROWS, data, transactions, fields)
+
+
+def exported_value(value):
+    """An exported value as the JSON API renders it."""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+@unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'Exports need pyarrow')
+@override_settings(SLOW_REQUEST_THRESHOLD=None, STOCK_COUNTER_SLOTS=4)
+class LedgerExportTests(TestCase):
+    """Parquet and Arrow exports read back to the rows the JSON API returns."""
+
+    # Export column and the JSON field it matches
+    TRANSACTION_FIELDS = [
+        ('id', 'id'), ('date', 'date'), ('product_id', 'product'), ('product_name', 'product_name'),
+        ('type', 'type'), ('quantity', 'quantity'), ('unit_price', 'unit_price'), ('discount', 'discount'),
+        ('wastage', 'wastage'), ('is_wastage', 'is_wastage'), ('supplier_id', 'supplier_ref'),
+        ('supplier_name', 'supplier_name'), ('client_id', 'client_ref'), ('client_name', 'client_name'),
+        ('reference_number', 'reference_number'), ('notes', 'notes'),
+    ]
+    PRODUCT_FIELDS = [
+        (name, name) for name in (
+            'id', 'name', 'sku', 'type', 'quantity', 'buying_price', 'selling_price', 'price', 'location',
+            'expiry_date', 'batch_number', 'barcode', 'minimum_stock_level', 'unit_of_measure', 'wastage',
+            'created_at', 'updated_at',
+        )
+    ]
+    DATETIMES = ('date', 'created_at', 'updated_at')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('export', 'export@example.com', None)
+        product_type = ProductType.objects.create(name='Dairy')
+        supplier = Supplier.objects.create(name='Farm Fresh')
+        milk = Product.objects.create(name='Milk', sku='EXP-1', type=product_type, quantity=12,
+                                      buying_price=Decimal('10'), price=Decimal('11.99'),
+                                      expiry_date=timezone.localdate(), location='Cold room')
+        butter = Product.objects.create(name='Butter', sku='EXP-2', type=product_type, quantity=40)
+        Product.objects.filter(pk=butter.pk).update(price=None)
+        counters.enable(butter.id)
+        StockCounter.objects.filter(product=butter, slot=0).update(delta=-3)
+        StockTransaction.objects.create(product=milk, type='IN', quantity=5, supplier_ref=supplier,
+                                        supplier='Farm Fresh', unit_price=Decimal('2'), reference_number='PO-1')
+        StockTransaction.objects.create(product=butter, type='OUT', quantity=2, client='Café Ünïcode',
+                                        unit_price=Decimal('3.10'), discount=Decimal('0.5'),
+                                        is_wastage=True, wastage=Decimal('1.05'), notes='Damaged')
+        StockTransaction.objects.create(product=milk, type='IN', quantity=1, supplier='Legacy supplier')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def json_rows(self, name, fields):
+        response = self.client.get(api_path(name))
+        self.assertEqual(response.status_code, 200)
+        rows = sorted(response.json(), key=lambda row: row['id'])
+        return [
+            {key: parse_datetime(row[key]) if key in self.DATETIMES and row[key] else row[key] for _, key in fields}
+            for row in rows
+        ]
+
+    def exported_rows(self, table, fields):
+        columns = table.to_pydict()
+        return [
+            {key: exported_value(columns[column][i]) for column, key in fields}
+            for i in range(table.num_rows)
+        ]
+
+    def download(self, **params):
+        response = self.client.get(api_path('export-ledger'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_parquet_transactions_match_the_json_rows(self):
+        import pyarrow.parquet
+
+        response, content = self.download()
+        table = pyarrow.parquet.read_table(io.BytesIO(content))
+        self.assertEqual(table.schema.names, [name for name, _, _ in TRANSACTION_COLUMNS])
+        self.assertEqual(self.exported_rows(table, self.TRANSACTION_FIELDS),
+                         self.json_rows('stocktransaction-list', self.TRANSACTION_FIELDS))
+        last_id = StockTransaction.objects.latest('id').id
+        self.assertEqual(response['X-Export-Watermark'], str(last_id))
+        self.assertEqual(table.schema.metadata[b'watermark'], str(last_id).encode())
+
+        # The watermark picks up only what was added since
+        product = Product.objects.get(sku='EXP-1')
+        added = StockTransaction.objects.create(product=product, type='OUT', quantity=1)
+        _, content = self.download(after_id=last_id)
+        self.assertEqual(pyarrow.parquet.read_table(io.BytesIO(content)).column('id').to_pylist(), [added.id])
+
+    def test_arrow_products_match_the_json_rows(self):
+        import pyarrow
+
+        _, content = self.download(dataset='products', file_format='arrow')
+        table = pyarrow.ipc.open_file(pyarrow.BufferReader(content)).read_all()
+        exported = self.exported_rows(table, self.PRODUCT_FIELDS)
+        self.assertEqual(exported, self.json_rows('product-list', self.PRODUCT_FIELDS))
+        self.assertEqual([(row['quantity'], row['price']) for row in exported], [(12, '11.99'), (37, None)])
+
+    def test_command_writes_a_row_group_per_batch(self):
+        import pyarrow.parquet
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ledger.parquet')
+            call_command('export_ledger', path, batch_size=2, stdout=io.StringIO())
+            parquet = pyarrow.parquet.ParquetFile(path)
+            self.assertEqual(parquet.num_row_groups, 2)
+            table = parquet.read()
+        self.assertEqual(self.exported_rows(table, self.TRANSACTION_FIELDS),
+                         self.json_rows('stocktransaction-list', self.TRANSACTION_FIELDS))
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class MetricsTests(TestCase):
+    """The metrics endpoint serves Prometheus text to staff only."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('scraper', 'scraper@example.com', None, is_staff=True)
+        cls.clerk = User.objects.create_user('clerk', 'clerk@example.com', None)
+        cls.staff_token = Token.objects.create(user=cls.staff)
+        cls.clerk_token = Token.objects.create(user=cls.clerk)
+        product_type = ProductType.objects.create(name='Metrics')
+        Product.objects.create(name='Counted', sku='MET-1', type=product_type, quantity=3)
+
+    def scrape(self, token=None):
+        headers = {'HTTP_AUTHORIZATION': f'Token {token.key}'} if token else {}
+        return self.client.get(api_path('metrics'), **headers)
+
+    def samples(self):
+        """Sample values of the last scrape by (name, labels)."""
+        response = self.scrape(self.staff_token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], CONTENT_TYPE_LATEST)
+        return {
+            (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+            for family in text_string_to_metric_families(response.content.decode())
+            for sample in family.samples
+        }
+
+    def test_requests_and_queries_are_counted(self):
+        requests = ('ims_request_duration_seconds_count',
+                    (('method', 'GET'), ('route', 'product-list'), ('status', '200')))
+        queries = ('ims_request_db_queries_sum', (('method', 'GET'), ('route', 'product-list')))
+        before = self.samples()
+        headers = {'HTTP_AUTHORIZATION': f'Token {self.clerk_token.key}'}
+        for _ in range(2):
+            self.assertEqual(self.client.get(api_path('product-list'), **headers).status_code, 200)
+        after = self.samples()
+        self.assertEqual(after[requests] - before.get(requests, 0), 2)
+        self.assertGreaterEqual(after[queries] - before.get(queries, 0), 2)
+        # The scrape itself is counted too
+        self.assertIn(('ims_request_duration_seconds_count',
+                       (('method', 'GET'), ('route', 'metrics'), ('status', '200'))), after)
+
+    def test_staff_only(self):
+        self.assertEqual(self.scrape().status_code, 401)
+        self.assertEqual(self.scrape(self.clerk_token).status_code, 403)
+        self.client.force_login(self.clerk)
+        self.assertEqual(self.client.get(api_path('metrics')).status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(api_path('metrics')).status_code, 200)
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class ProfilingTests(TestCase):
+    """Profiles are recorded on request for permitted staff only, saved with their files, and pruned."""
+
+    @classmethod
+    def setUpTestData(cls):
+        permission = Permission.objects.get(codename='profile_requests')
+        cls.profiler = User.objects.create_user('profiler', 'profiler@example.com', None, is_staff=True)
+        cls.profiler.user_permissions.add(permission)
+        # Has the permission but isn't staff
+        cls.clerk = User.objects.create_user('clerk', 'clerk@example.com', None)
+        cls.clerk.user_permissions.add(permission)
+        # Staff without the permission
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', None, is_staff=True)
+        cls.token = Token.objects.create(user=cls.profiler)
+        product_type = ProductType.objects.create(name='Profiled')
+        Product.objects.create(name='Profiled', sku='PROF-1', type=product_type, quantity=3)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media_root
+
+    def profiled_get(self, user, **extra):
+        self.client.force_login(user)
+        response = self.client.get(api_path('product-list'), HTTP_X_PROFILE='1', **extra)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assertFilesExist(self, profile, exist=True):
+        for file in (profile.stats_file, profile.report_file):
+            self.assertTrue(file.name.startswith('profiles/'))
+            self.assertEqual(os.path.exists(os.path.join(self.media_root, file.name)), exist)
+
+    def test_only_permitted_staff_are_profiled(self):
+        for user in (self.clerk, self.staff):
+            with self.subTest(user=user.username):
+                self.assertNotIn('X-Profile-Id', self.profiled_get(user))
+        # Not asked for
+        self.client.force_login(self.profiler)
+        self.assertNotIn('X-Profile-Id', self.client.get(api_path('product-list')))
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_profiled_request_saves_the_profile_and_its_files(self):
+        response = self.profiled_get(self.profiler)
+        profile = RequestProfile.objects.get(id=response['X-Profile-Id'])
+        self.assertEqual((profile.user, profile.method, profile.view_name, profile.status_code),
+                         (self.profiler, 'GET', 'product-list', 200))
+        self.assertGreater(profile.query_count, 0)
+        self.assertFilesExist(profile)
+
+        with profile.report_file.open('rb') as report_file:
+            report = json.load(report_file)
+        self.assertEqual(len(report['queries']), profile.query_count)
+        self.assertTrue(any(query['explain'] for query in report['queries']))
+        self.assertIn('cumulative', report['functions'])
+        with profile.stats_file.open('rb') as stats_file:
+            self.assertTrue(marshal.loads(stats_file.read()))
+
+    def test_query_param_with_token_auth(self):
+        response = self.client.get(api_path('product-list'), {'_profile': '1'},
+                                   HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get(id=response['X-Profile-Id'])
+        self.assertEqual(profile.user, self.profiler)
+        self.assertTrue(profile.path.endswith('?_profile=1'))
+
+    @override_settings(PROFILE_RETENTION_DAYS=7, PROFILE_MAX_COUNT=2)
+    def test_old_profiles_are_pruned_with_their_files(self):
+        expired = RequestProfile.objects.get(id=self.profiled_get(self.profiler)['X-Profile-Id'])
+        RequestProfile.objects.filter(id=expired.id).update(created_at=timezone.now() - timedelta(days=8))
+        ids = [int(self.profiled_get(self.profiler)['X-Profile-Id']) for _ in range(3)]
+        # The expired one and the oldest past the newest two
+        self.assertEqual(list(RequestProfile.objects.order_by('id').values_list('id', flat=True)), ids[1:])
+        self.assertFilesExist(expired, exist=False)
+        self.assertEqual(
+            sorted(name for _, _, names in os.walk(self.media_root) for name in names),
+            sorted(os.path.basename(file.name) for profile in RequestProfile.objects.all()
+                   for file in (profile.stats_file, profile.report_file)),
+        )
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class ForecastTests(TestCase):
+    """Demand forecasts and reorder suggestions from a known sales history."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('forecast', 'forecast@example.com', None)
+        product_type = ProductType.objects.create(name='Forecast')
+        cls.product = Product.objects.create(name='Steady seller', sku='FC-1', type=product_type, quantity=15)
+        cls.idle = Product.objects.create(name='Idle', sku='FC-2', type=product_type, quantity=3)
+        # Four whole days of sales before today: 2, 4, 6 and 4 units
+        today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        for days_ago, quantity in zip((4, 3, 2, 1), (2, 4, 6, 4)):
+            for _ in range(2):
+                sale = StockTransaction.objects.create(product=cls.product, type='OUT', quantity=quantity // 2)
+                StockTransaction.objects.filter(id=sale.id).update(date=today - timedelta(days=days_ago, hours=-12))
+        # Sold today, which is still in progress
+        StockTransaction.objects.create(product=cls.product, type='OUT', quantity=50)
+
+    def forecast(self, **options):
+        call_command('forecast_demand', history_days=4, window=4, lead_time=4, review_days=10,
+                     service_level=0.95, stdout=io.StringIO(), **options)
+        return ReorderSuggestion.objects.get(product=self.product)
+
+    def test_moving_average_suggestion(self):
+        suggestion = self.forecast(method='sma')
+        # Mean 4 a day, standard deviation sqrt(2)
+        self.assertEqual((suggestion.daily_demand, suggestion.demand_std), (4.0, 1.4142))
+        # z(0.95) * sqrt(2) * sqrt(lead time 4) = 4.65, rounded up
+        self.assertEqual(suggestion.safety_stock, 5)
+        # 4 days of lead time demand plus safety stock
+        self.assertEqual(suggestion.reorder_point, 21)
+        # Order up to 14 days of demand plus safety stock, less the 15 in stock
+        self.assertEqual(suggestion.suggested_quantity, 4 * 14 + 5 - 15)
+        self.assertTrue(suggestion.needs_reorder)
+        self.assertFalse(ReorderSuggestion.objects.get(product=self.idle).needs_reorder)
+
+    def test_exponential_smoothing_level(self):
+        # 2, then halfway to 4, 6 and 4 in turn
+        self.assertEqual(self.forecast(method='ses', alpha=0.5).daily_demand, 4.25)
+
+    def test_reorder_suggestions_endpoint(self):
+        self.forecast(method='sma')
+        self.client.force_login(self.user)
+        response = self.client.get(api_path('product-reorder-suggestions'), {'needs_reorder': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(row['sku'], row['quantity'], row['reorder_point'], row['suggested_quantity'])
+                          for row in response.json()], [('FC-1', 15, 21, 46)])
+
+    def test_invalid_settings_are_refused(self):
+        for options in ({'lead_time': -1}, {'review_days': -1}, {'service_level': 1.0},
+                        {'service_level': 0.2}, {'window': 5}, {'chunk_size': 0}):
+            with self.subTest(options=options):
+                with self.assertRaises(CommandError):
+                    call_command('forecast_demand', **{'history_days': 4, 'window': 4, **options},
+                                 stdout=io.StringIO())
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None, STOCK_COUNTER_SLOTS=4)
+class ProductStatsTests(TestCase):
+    """ProductStats kept equal to the ledger totals on every write path."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('stats', 'stats@example.com', None)
+        product_type = ProductType.objects.create(name='Stats')
+        cls.products = [
+            Product.objects.create(name=f'Stats {i}', sku=f'STATS-{i}', type=product_type, price=Decimal('2.00'))
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.admin = admin.site._registry[StockTransaction]
+        self.request = RequestFactory().post('/admin/')
+        self.request.user = self.user
+
+    def move(self, product, transaction_type, quantity, **data):
+        response = self.client.post(api_path('stock-update'), {
+            'product': product.id, 'type': transaction_type, 'quantity': quantity, **data,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return StockTransaction.objects.get(id=response.json()['transaction_id'])
+
+    def assertStatsMatchLedger(self):
+        ids = [product.id for product in self.products]
+        totals = product_stats.ledger_totals(ids)
+        empty = {'total_in': 0, 'total_out': 0, 'revenue': 0, 'total_wastage': 0, 'last_movement_date': None}
+        stats = {
+            row.pop('product_id'): row
+            for row in ProductStats.objects.filter(product_id__in=ids).values('product_id', *empty)
+        }
+        # Products never moved may have no row yet
+        self.assertEqual({product_id: stats.get(product_id, empty) for product_id in ids},
+                         {product_id: totals.get(product_id, empty) for product_id in ids})
+
+    def test_stock_updates_keep_the_stats(self):
+        self.move(self.products[0], 'IN', 10, unit_price='1.50')
+        self.move(self.products[0], 'OUT', 3, unit_price='4.00', discount='1.00')
+        self.move(self.products[0], 'OUT', 2, unit_price='4.00', is_wastage=True, wastage='8.00')
+        self.assertStatsMatchLedger()
+        stats = ProductStats.objects.get(product=self.products[0])
+        self.assertEqual((stats.total_in, stats.total_out, stats.revenue, stats.total_wastage),
+                         (10, 5, Decimal('19.00'), Decimal('8.00')))
+
+    def test_admin_edits_and_deletes_keep_the_stats(self):
+        self.move(self.products[0], 'IN', 10)
+        sale = self.move(self.products[0], 'OUT', 4, unit_price='3.00')
+        other = self.move(self.products[1], 'IN', 6)
+
+        # Edited in place, then moved to the other product
+        sale.quantity = 5
+        sale.compute_totals()
+        self.admin.save_model(self.request, sale, None, True)
+        self.assertStatsMatchLedger()
+        sale.product = self.products[1]
+        self.admin.save_model(self.request, sale, None, True)
+        self.assertStatsMatchLedger()
+        self.assertEqual(ProductStats.objects.get(product=self.products[0]).total_out, 0)
+
+        self.admin.delete_model(self.request, other)
+        self.assertStatsMatchLedger()
+        self.admin.delete_queryset(self.request, StockTransaction.objects.all())
+        self.assertStatsMatchLedger()
+
+    def test_stale_and_corrupted_rows_are_fixed(self):
+        for product in self.products:
+            self.move(product, 'IN', 7)
+        stats = ProductStats.objects.filter(product=self.products[0])
+        # Missed a movement: its last movement is older than the ledger's
+        stats.update(total_in=0, last_movement_date=timezone.now() - timedelta(days=1))
+        self.assertEqual(list(product_stats.stale_products(Product.objects.all())), [self.products[0].id])
+        product_stats.refresh(product_stats.stale_products(Product.objects.all()))
+        self.assertStatsMatchLedger()
+
+        # Wrong totals look current; only a rebuild finds them
+        stats.update(total_in=999)
+        ProductStats.objects.filter(product=self.products[1]).delete()
+        self.assertEqual(list(product_stats.stale_products(Product.objects.all())), [self.products[1].id])
+        call_command('rebuild_product_stats', chunk_size=1, stdout=io.StringIO())
+        self.assertStatsMatchLedger()
+
+    def test_stats_endpoint_counts_pending_counter_deltas(self):
+        sharded, plain = self.products
+        Product.objects.filter(id=sharded.id).update(quantity=8)
+        Product.objects.filter(id=plain.id).update(quantity=3)
+        counters.enable(sharded.id)
+        # 8 and 3 units at 2.00; one of the two below 5
+        self.assertEqual(self.client.get(api_path('product-stats')).json(),
+                         {'total_products': 2, 'total_value': 22.0, 'low_stock_count': 1})
+
+        # Taken on a counter slot, not yet in Product.quantity
+        self.move(sharded, 'OUT', 2)
+        self.assertEqual(Product.objects.get(id=sharded.id).quantity, 8)
+        self.assertEqual(self.client.get(api_path('product-stats')).json(),
+                         {'total_products': 2, 'total_value': 18.0, 'low_stock_count': 1})
+        self.move(sharded, 'OUT', 1)
+        self.assertEqual(self.client.get(api_path('product-stats')).json()['low_stock_count'], 2)
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class ProfitReportTests(TestCase):
+    """Profit per group for both cost bases, ordered and paged deterministically."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('margins', 'margins@example.com', None)
+        product_type = ProductType.objects.create(name='Profit')
+        cls.a, cls.b, cls.c = (
+            Product.objects.create(name=name, sku=name, type=product_type, buying_price=Decimal(price))
+            for name, price in (('A', '2.00'), ('B', '3.00'), ('C', '1.00'))
+        )
+        for product, transaction_type, quantity, unit_price, discount in (
+            # A: bought at an average of 1.50, 4 sold for 20.00 less 1.00 discount
+            (cls.a, 'IN', 10, '1.00', '0'), (cls.a, 'IN', 10, '2.00', '0'), (cls.a, 'OUT', 4, '5.00', '1.00'),
+            # B: bought at its buying price, 2 sold for 20.00
+            (cls.b, 'IN', 5, '3.00', '0'), (cls.b, 'OUT', 2, '10.00', '0'),
+            # C: never bought, so costed at its buying price either way; ties with A
+            (cls.c, 'OUT', 4, '3.75', '0'),
+        ):
+            StockTransaction.objects.create(product=product, type=transaction_type, quantity=quantity,
+                                            unit_price=Decimal(unit_price), discount=Decimal(discount))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def profit(self, **params):
+        response = self.client.get(api_path('reports-profit'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def rows(self, **params):
+        return [
+            (row['product__name'], Decimal(str(row['revenue'])), Decimal(str(row['cogs'])),
+             Decimal(str(row['gross_profit'])))
+            for row in self.profit(**params)['results']
+        ]
+
+    def test_profit_per_product_for_both_cost_bases(self):
+        self.assertEqual(self.rows(cost='buying'), [
+            ('B', Decimal('20'), Decimal('6'), Decimal('14')),
+            ('A', Decimal('20'), Decimal('8'), Decimal('11')),
+            ('C', Decimal('15'), Decimal('4'), Decimal('11')),
+        ])
+        self.assertEqual(self.rows(cost='average'), [
+            ('B', Decimal('20'), Decimal('6'), Decimal('14')),
+            ('A', Decimal('20'), Decimal('6'), Decimal('13')),
+            ('C', Decimal('15'), Decimal('4'), Decimal('11')),
+        ])
+        totals = self.profit(cost='average')['totals']
+        self.assertEqual(Decimal(str(totals['gross_profit'])), Decimal('38'))
+
+    def test_equal_totals_page_in_group_order(self):
+        pages = [self.rows(limit=1, offset=offset)[0][0] for offset in range(3)]
+        self.assertEqual(pages, ['B', 'A', 'C'])
+        self.assertEqual([row[0] for row in self.rows(ordering='gross_profit')], ['A', 'C', 'B'])
+
+        # The same rows and order when the archive is merged in Python
+        rows = self.rows()
+        StockTransaction.objects.update(date=timezone.now() - timedelta(days=30))
+        list(archive_transactions(StockTransaction.objects.filter(product=self.c), timezone.now() - timedelta(days=1)))
+        self.assertEqual([self.rows(limit=1, offset=offset)[0] for offset in range(3)], rows)
+
+
+class LineTotalsTests(TestCase):
+    """line_total and net_total, however the ledger rows are written."""
+
+    # quantity, unit_price, discount, line_total, net_total
+    CASES = [
+        (3, Decimal('2.50'), Decimal('1.00'), Decimal('7.50'), Decimal('6.50')),
+        (4, None, Decimal('0.50'), Decimal('0.00'), Decimal('-0.50')),
+        (7, Decimal('0.33'), Decimal('0'), Decimal('2.31'), Decimal('2.31')),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('totals', 'totals@example.com', None)
+        product_type = ProductType.objects.create(name='Totals')
+        cls.product = Product.objects.create(name='Totalled', sku='TOT-1', type=product_type,
+                                             selling_price=Decimal('9.99'))
+
+    def rows(self, **data):
+        return [
+            StockTransaction(product=self.product, type='OUT', quantity=quantity, unit_price=unit_price,
+                             discount=discount, **data)
+            for quantity, unit_price, discount, _, _ in self.CASES
+        ]
+
+    def totals(self, rows):
+        totals = StockTransaction.objects.filter(id__in=[row.id for row in rows]).order_by('id')
+        return list(totals.values_list('line_total', 'net_total'))
+
+    def expected(self):
+        return [(line_total, net_total) for *_, line_total, net_total in self.CASES]
+
+    def test_save_and_bulk_create_set_the_totals(self):
+        saved = self.rows()
+        for row in saved:
+            row.save()
+        # save() prices a missing unit price at the product's selling price
+        self.assertEqual(self.totals(saved), [self.expected()[0], (Decimal('39.96'), Decimal('39.46')),
+                                              self.expected()[2]])
+
+        created = self.rows()
+        for row in created:
+            row.compute_totals()
+        StockTransaction.objects.bulk_create(created)
+        self.assertEqual(self.totals(created), self.expected())
+
+    def test_backfill_and_admin_action_agree(self):
+        created = self.rows()
+        for row in created:
+            row.compute_totals()
+        StockTransaction.objects.bulk_create(created)
+        stale = StockTransaction.objects.filter(id__in=[row.id for row in created])
+
+        stale.update(line_total=0, net_total=0)
+        backfill = import_module('inventory.migrations.0021_backfill_line_totals')
+        backfill.backfill_line_totals(django_apps, None)
+        self.assertEqual(self.totals(created), self.expected())
+
+        stale.update(line_total=Decimal('99'), net_total=0)
+        self.client.force_login(self.user)
+        response = self.client.post('/admin/inventory/stocktransaction/', {
+            'action': 'recalculate_totals', '_selected_action': [row.id for row in created],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.totals(created), self.expected())
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class ProductTypeTests(TestCase):
+    """Product types read and written by name over the API."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('types', 'types@example.com', None)
+        cls.spice = ProductType.objects.create(name='Spice')
+        Product.objects.create(name='Pepper', sku='SP-1', type=cls.spice)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def create(self, sku, type_name):
+        return self.client.post(api_path('product-list'), {'name': sku, 'sku': sku, 'type': type_name},
+                                content_type='application/json')
+
+    def test_types_are_matched_or_created_by_name(self):
+        response = self.create('SP-2', 'Spice')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['type'], 'Spice')
+        self.assertEqual(Product.objects.get(sku='SP-2').type_id, self.spice.id)
+
+        response = self.create('HD-1', '  Home Decor ')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['type'], 'Home Decor')
+        self.assertEqual(ProductType.objects.filter(name='Home Decor').count(), 1)
+        self.assertEqual(self.create('HD-2', 'Home Decor').status_code, 201)
+        self.assertEqual(ProductType.objects.count(), 2)
+
+        for name in ('', ' ', 'x' * 101):
+            with self.subTest(name=name):
+                response = self.create('BAD-1', name)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('type', response.json())
+
+    def test_lists_filter_by_type_name(self):
+        self.create('HD-1', 'Home Decor')
+        response = self.client.get(api_path('product-list'), {'type': 'Spice'})
+        self.assertEqual([(row['sku'], row['type']) for row in response.json()], [('SP-1', 'Spice')])
+        self.assertEqual(self.client.get(api_path('product-list'), {'type': 'Unknown'}).json(), [])
+        self.assertEqual(len(self.client.get(api_path('product-list'), {'type': 'all'}).json()), 2)
+
+    def test_setup_product_types_is_idempotent(self):
+        ProductType.objects.create(name='Unused')
+        call_command('setup_product_types', stdout=io.StringIO())
+        names = sorted(ProductType.objects.values_list('name', flat=True))
+        # Unused types go; types products still use stay
+        self.assertEqual(names, ['Bakery Ingredients', 'Cookware', 'Fruits', 'Home Decor', 'Spice'])
+
+        out = io.StringIO()
+        call_command('setup_product_types', stdout=out)
+        self.assertIn('Successfully created 0 product types', out.getvalue())
+        self.assertEqual(sorted(ProductType.objects.values_list('name', flat=True)), names)
+        self.assertEqual(Product.objects.get(sku='SP-1').type_id, self.spice.id)
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class ReportAccountFilterTests(TestCase):
+    """Supplier and client report filters, with and without legacy name matching."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('accounts', 'accounts@example.com', None)
+        product_type = ProductType.objects.create(name='Accounts')
+        product = Product.objects.create(name='Flour', sku='FL-1', type=product_type)
+        cls.farm = Supplier.objects.create(name='Farm Fresh')
+        cls.linked, cls.legacy, cls.other = (
+            StockTransaction.objects.create(product=product, type='IN', quantity=quantity, **data)
+            for quantity, data in (
+                (1, {'supplier_ref': cls.farm, 'supplier': 'Farm Fresh'}),
+                # Only a name, written before accounts existed
+                (2, {'supplier': ' FARM   fresh ', 'supplier_contact': 'Ann'}),
+                (3, {'supplier': 'Other Co', 'client': 'Corner Shop'}),
+            )
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def report(self, **params):
+        return self.client.get(api_path('reports'), params)
+
+    def ids(self, **params):
+        response = self.report(**params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(row['id'] for row in response.json()['transactions'])
+
+    def test_lenient_filters_fall_back_to_legacy_names(self):
+        self.assertEqual(self.ids(supplier_id=self.farm.id), [self.linked.id])
+        self.assertEqual(self.ids(supplier_id='fresh'), [self.legacy.id])
+        self.assertEqual(self.ids(client_id='corner'), [self.other.id])
+        self.assertEqual(self.ids(supplier_id='Nobody'), [])
+
+    @override_settings(REPORTS_STRICT_ACCOUNT_FILTERS=True)
+    def test_strict_filters_take_account_ids_only(self):
+        self.assertEqual(self.ids(supplier_id=self.farm.id), [self.linked.id])
+        for params in ({'supplier_id': 'Nobody'}, {'client_id': 'Corner Shop'}, {'supplier_id': 'fresh'}):
+            with self.subTest(params=params):
+                response = self.report(**params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('Use the numeric id', response.json()['error'])
+
+    @override_settings(REPORTS_STRICT_ACCOUNT_FILTERS=True)
+    def test_resolved_names_are_found_by_account(self):
+        out = io.StringIO()
+        call_command('resolve_account_refs', dry_run=True, stdout=out)
+        self.assertIn('Would create 1 suppliers', out.getvalue())
+        self.assertFalse(StockTransaction.objects.filter(id=self.legacy.id, supplier_ref__isnull=False).exists())
+
+        call_command('resolve_account_refs', chunk_size=1, stdout=io.StringIO())
+        # Matched case and whitespace insensitively; the rest get new accounts
+        self.assertEqual(self.ids(supplier_id=self.farm.id), [self.linked.id, self.legacy.id])
+        other = Supplier.objects.get(name='Other Co')
+        self.assertEqual(self.ids(supplier_id=other.id), [self.other.id])
+        self.assertEqual(StockTransaction.objects.get(id=self.other.id).client_ref.name, 'Corner Shop')
+
+        out = io.StringIO()
+        call_command('resolve_account_refs', stdout=out)
+        self.assertIn('Created 0 suppliers', out.getvalue())
+        self.assertEqual(Supplier.objects.count(), 2)
+
+
+@override_settings(SLOW_REQUEST_THRESHOLD=None)
+class AccountStatsTests(TestCase):
+    """Supplier totals from ?stats=true, ordered and paged."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('leaders', 'leaders@example.com', None)
+        product_type = ProductType.objects.create(name='Leaderboard')
+        products = [Product.objects.create(name=f'Item {i}', sku=f'LB-{i}', type=product_type) for i in range(2)]
+        cls.suppliers = [Supplier.objects.create(name=name) for name in ('Acme', 'Bolt', 'Crate', 'Dune')]
+        acme, bolt, crate, _ = cls.suppliers
+        for supplier, product, quantity, unit_price in (
+            (acme, products[0], 2, '5.00'), (acme, products[1], 3, '1.00'),
+            (bolt, products[0], 10, '2.00'),
+            # Same value as Acme; the id breaks the tie
+            (crate, products[1], 13, '1.00'),
+        ):
+            StockTransaction.objects.create(product=product, type='IN', quantity=quantity, supplier_ref=supplier,
+                                            unit_price=Decimal(unit_price))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def page(self, **params):
+        response = self.client.get(api_path('supplier-list'), {'stats': 'true', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_totals_per_supplier(self):
+        rows = {row['name']: row for row in self.page()}
+        self.assertEqual(
+            {name: (row['transaction_count'], row['total_quantity'], row['total_value'], row['product_count'])
+             for name, row in rows.items()},
+            {'Acme': (2, 5, '13.00', 2), 'Bolt': (1, 10, '20.00', 1), 'Crate': (1, 13, '13.00', 1),
+             'Dune': (0, 0, '0.00', 0)},
+        )
+        self.assertIsNone(rows['Dune']['last_transaction_date'])
+
+    def test_ordering_by_totals_pages_with_limit_offset(self):
+        names = []
+        for offset in (0, 2):
+            page = self.page(ordering='-total_value', limit=2, offset=offset)
+            self.assertEqual(page['count'], 4)
+            names += [row['name'] for row in page['results']]
+        self.assertEqual(names, ['Bolt', 'Acme', 'Crate', 'Dune'])
+        self.assertEqual([row['name'] for row in self.page(ordering='total_quantity')],
+                         ['Dune', 'Acme', 'Bolt', 'Crate'])
+        response = self.client.get(api_path('supplier-list'), {'stats': 'true', 'ordering': 'email'})
+        self.assertEqual(response.status_code, 400)
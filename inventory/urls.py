@@ -8,10 +8,20 @@ router.register(r'stock-history', views.StockHistoryViewSet)
 router.register(r'product-types', views.ProductTypeViewSet)
 router.register(r'suppliers', views.SupplierViewSet)
 router.register(r'clients', views.ClientViewSet)
+router.register(r'lots', views.LotViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
     path('stock/update/', views.StockUpdateView.as_view(), name='stock-update'),
+    path('sync/', views.SyncView.as_view(), name='sync'),
+    path('events/stock/', views.StockEventsView.as_view(), name='stock-events'),
+    path('events/stock/ticket/', views.StockEventsTicketView.as_view(), name='stock-events-ticket'),
     path('user-permissions/', views.UserPermissionsView.as_view(), name='user-permissions'),
     path('reports/', views.ReportsView.as_view(), name='reports'),
+    path('reports/timeseries/', views.ReportTimeseriesView.as_view(), name='reports-timeseries'),
+    path('reports/categories/', views.CategoryBreakdownView.as_view(), name='reports-categories'),
+    path('reports/products/', views.ProductAnalyticsView.as_view(), name='reports-products'),
+    path('reports/profit/', views.ProfitReportView.as_view(), name='reports-profit'),
+    path('export/ledger/', views.LedgerExportView.as_view(), name='export-ledger'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
 ] 
\ No newline at end of file
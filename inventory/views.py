@@ -2,28 +2,161 @@ from django.shortcuts import render
 from rest_framework import viewsets, status
 from rest_framework.decorators import action, permission_classes
 from rest_framework.response import Response
-from .models import Product, StockTransaction, ProductType, Supplier, Client
-from .serializers import ProductSerializer, StockTransactionSerializer, ProductTypeSerializer, SupplierSerializer, ClientSerializer
-from django.db.models import Count, Sum, F, Q
+from .models import (
+    Product, StockTransaction, ProductType, Supplier, Client, ArchivedStockTransaction, ReorderSuggestion, Lot,
+)
+from .serializers import (
+    ProductSerializer, StockTransactionSerializer, ProductTypeSerializer, SupplierSerializer, ClientSerializer,
+    SupplierStatsSerializer, ClientStatsSerializer, ReorderSuggestionSerializer, LotSerializer,
+    ProductStatsSerializer, PRODUCT_ROWS, PRODUCT_STATS_ROWS, TRANSACTION_ROWS, requested_fields,
+)
+from django.db.models import Count, Sum, F, Q, Max, Exists, OuterRef, Value, DecimalField, ProtectedError
+from django.db.models.functions import Coalesce
+from django.db.models.expressions import Window, RowRange
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.settings import api_settings
+from decimal import Decimal
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated, DjangoModelPermissions, BasePermission
-from django.contrib.auth.models import Permission
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, DjangoModelPermissions, BasePermission
+from django.contrib.auth.models import Permission, User
 from django.contrib.contenttypes.models import ContentType
-from datetime import datetime, timedelta
+from django.db import transaction as db_transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework.authentication import get_authorization_header
+from rest_framework.authtoken.models import Token
+from prometheus_client import CONTENT_TYPE_LATEST
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.utils import timezone
+from . import counters, events, export, lots, metrics, product_stats
+from .renderers import ColumnarRenderer, wants_columnar, columnar_response
+from .analytics import cached, category_breakdown, product_analytics
+from .reports import (
+    ReportFilters, summarize, combine_summaries, INTERVALS, timeseries_totals, fill_timeseries, first_ledger_day,
+    PROFIT_GROUPS, PROFIT_TOTALS, profit_rows, profit_totals, merge_profit_rows, add_margin, product_type_id,
+)
+from .sync import Watermark, get_changes
+from .reconciliation import SIGNED_QUANTITY
 
 # Create your views here.
 
+# Timeline cursors count microseconds from here
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+def stats_requested(request):
+    return request.query_params.get('stats', '').lower() in ('1', 'true', 'yes')
+
+def with_product_stats(queryset):
+    """
+    Annotate products with their lifetime ledger totals, read from their
+    ProductStats row through a join instead of aggregating the ledger.
+    """
+    return queryset.annotate(**product_stats.STATS_COLUMNS)
+
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related('type').annotate(pending_stock=counters.PENDING_STOCK)
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [ColumnarRenderer]
+    # Indexed columns the list can be ordered by
+    ordering_fields = ('id', 'name', 'sku', 'expiry_date', 'updated_at')
+    
+    def get_queryset(self):
+        """
+        List query params:
+        - type: Product type name
+        - location: Exact location
+        - below_minimum: 'true' for products at or below their minimum stock level
+        - expiring_before: Products expiring on or before this day (YYYY-MM-DD)
+        - search: Text contained in the name, SKU or barcode
+        - ordering: One of ordering_fields, '-' prefixed for descending
+        
+        List and detail requests with ?stats=true include the product's
+        total in, total out, revenue, wastage and last movement date.
+        """
+        queryset = super().get_queryset()
+        if self.wants_stats():
+            queryset = with_product_stats(queryset)
+        if self.action != 'list':
+            return queryset
+        params = self.request.query_params
+        
+        product_type = params.get('type')
+        if product_type and product_type != 'all':
+            queryset = queryset.filter(type_id=product_type_id(product_type))
+        
+        location = params.get('location')
+        if location:
+            queryset = queryset.filter(location=location)
+        
+        if params.get('below_minimum', '').lower() in ('1', 'true', 'yes'):
+            queryset = queryset.alias(stock=counters.STOCK_QUANTITY).filter(stock__lte=F('minimum_stock_level'))
+        
+        expiring_before = params.get('expiring_before')
+        if expiring_before:
+            try:
+                day = datetime.strptime(expiring_before, '%Y-%m-%d').date()
+            except ValueError:
+                raise ValidationError({'expiring_before': 'Use YYYY-MM-DD'})
+            queryset = queryset.filter(expiry_date__lte=day)
+        
+        search = params.get('search', '').strip()
+        if search:
+            queryset = queryset.filter(
+                Q(name__icontains=search) | Q(sku__icontains=search) | Q(barcode__icontains=search)
+            )
+        
+        ordering = params.get('ordering')
+        if ordering:
+            if ordering.lstrip('-') not in self.ordering_fields:
+                raise ValidationError({'ordering': f'Cannot order by {ordering}'})
+            queryset = queryset.order_by(ordering, 'id')
+        return queryset
+    
+    def wants_stats(self):
+        return self.action in ('list', 'retrieve') and stats_requested(self.request)
+    
+    def get_serializer_class(self):
+        if self.wants_stats():
+            return ProductStatsSerializer
+        return super().get_serializer_class()
+    
+    def list(self, request, *args, **kwargs):
+        # Rendered from values() rows, identical to the serializer output
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = PRODUCT_STATS_ROWS if self.wants_stats() else PRODUCT_ROWS
+        if wants_columnar(request):
+            return columnar_response(rows, [queryset], requested_fields(request))
+        return Response(rows.render(queryset, requested_fields(request)))
+    
+    def perform_update(self, serializer):
+        product = serializer.instance
+        if not product.sharded_stock:
+            serializer.save()
+            return
+        # Saved under the product lock with the counters folded in, so the
+        # save neither writes back a stale quantity nor leaves deltas to be
+        # counted on top of an edited one
+        with db_transaction.atomic():
+            product.quantity = counters.compact(product.id, serializer.validated_data.get('quantity')).quantity
+            product.pending_stock = 0
+            serializer.save()
     
     @action(detail=False, methods=['get'])
     def low_stock(self, request):
-        threshold = int(request.query_params.get('threshold', 5))
-        products = Product.objects.filter(quantity__lte=threshold)
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        try:
+            threshold = int(request.query_params.get('threshold', 5))
+        except ValueError:
+            raise ValidationError({'threshold': 'Must be a whole number'})
+        # Within the quantity column's range, which the database can compare
+        if not 0 <= threshold <= 2147483647:
+            raise ValidationError({'threshold': 'Must be between 0 and 2147483647'})
+        products = Product.objects.alias(stock=counters.STOCK_QUANTITY).filter(stock__lte=threshold)
+        if wants_columnar(request):
+            return columnar_response(PRODUCT_ROWS, [products], requested_fields(request))
+        return Response(PRODUCT_ROWS.render(products, requested_fields(request)))
     
     @action(detail=False, methods=['get'])
     def stats(self, request):
@@ -32,6 +165,13 @@ class ProductViewSet(viewsets.ModelViewSet):
             total=Sum(F('quantity') * F('price'))
         )['total'] or 0
         low_stock_count = Product.objects.filter(quantity__lte=5).count()
+        # Read through the quantity index; sharded products with movements
+        # on their counter slots are corrected by their pending deltas
+        pending = counters.pending_deltas()
+        corrected = Product.objects.filter(id__in=pending).values_list('id', 'quantity', 'price')
+        for product_id, quantity, price in corrected:
+            total_value += pending[product_id] * (price or 0)
+            low_stock_count += (quantity + pending[product_id] <= 5) - (quantity <= 5)
         
         return Response({
             'total_products': total_products,
@@ -39,15 +179,108 @@ class ProductViewSet(viewsets.ModelViewSet):
             'low_stock_count': low_stock_count
         })
     
+    @action(detail=True, methods=['get'])
+    def timeline(self, request, pk=None):
+        """
+        Movements of one product, newest first, with the stock balance
+        before and after each of them.
+        
+        Query params:
+        - limit: Page size (default 50, max 500)
+        - cursor: 'next' value of the previous page
+        
+        Pages are walked backwards from the current quantity. The cursor
+        carries the balance reached so far, so each page only reads its own
+        rows through the (product, date) index.
+        """
+        product = self.get_object()
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 50)), 500))
+            cursor = request.query_params.get('cursor')
+            if cursor:
+                micros, last_id, balance = (int(part) for part in cursor.split('.'))
+                last_date = EPOCH + timedelta(microseconds=micros)
+            else:
+                balance = counters.stock_of(product)
+        except (ValueError, OverflowError):
+            return Response({'error': 'Invalid limit or cursor'}, status=400)
+        
+        movements = StockTransaction.objects.filter(product=product)
+        if cursor:
+            movements = movements.filter(Q(date__lt=last_date) | Q(date=last_date, id__lt=last_id))
+        rows = list(
+            movements
+            .annotate(
+                signed_quantity=SIGNED_QUANTITY,
+                # Net change of this row and every newer one on the page
+                newer_change=Window(
+                    Sum(SIGNED_QUANTITY),
+                    order_by=[F('date').desc(), F('id').desc()],
+                    frame=RowRange(start=None, end=0)
+                ),
+                supplier_name=Coalesce('supplier_ref__name', 'supplier'),
+                client_name=Coalesce('client_ref__name', 'client'),
+            )
+            .order_by('-date', '-id')
+            .values('id', 'date', 'type', 'quantity', 'signed_quantity', 'newer_change', 'unit_price',
+                    'notes', 'reference_number', 'supplier_name', 'client_name', 'is_wastage',
+                    'is_opening_balance')[:limit + 1]
+        )
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        for row in rows:
+            row['balance_before'] = balance - row['newer_change']
+            row['balance_after'] = row['balance_before'] + row.pop('signed_quantity')
+            del row['newer_change']
+            # A string, like the decimals of the other endpoints
+            if row['unit_price'] is not None:
+                row['unit_price'] = str(row['unit_price'])
+        
+        next_cursor = None
+        if has_more:
+            last = rows[-1]
+            # Exact microseconds; a float timestamp can round off the last one
+            micros = (last['date'] - EPOCH) // timedelta(microseconds=1)
+            next_cursor = f"{micros}.{last['id']}.{last['balance_before']}"
+        
+        return Response({
+            'product': {'id': product.id, 'name': product.name, 'quantity': counters.stock_of(product)},
+            'next': next_cursor,
+            'results': rows
+        })
+    
+    @action(detail=False, methods=['get'], url_path='reorder-suggestions')
+    def reorder_suggestions(self, request):
+        """
+        Reorder suggestions computed by the forecast_demand command.
+        
+        Query params:
+        - needs_reorder: If true, only products at or below their reorder point
+        - product_type: Filter by product type
+        """
+        suggestions = (
+            ReorderSuggestion.objects.select_related('product')
+            .annotate(stock_quantity=counters.stock_quantity('product'))
+            .order_by('-needs_reorder', '-suggested_quantity')
+        )
+        if request.query_params.get('needs_reorder', '').lower() in ('1', 'true', 'yes'):
+            suggestions = suggestions.filter(needs_reorder=True)
+        product_type = request.query_params.get('product_type')
+        if product_type and product_type != 'all':
+            suggestions = suggestions.filter(product__type_id=product_type_id(product_type))
+        serializer = ReorderSuggestionSerializer(suggestions, many=True)
+        return Response(serializer.data)
+    
     @action(detail=False, methods=['get'])
     def wastage_stats(self, request):
         # Calculate total wastage value from StockTransaction records
         # where is_wastage=True
         wastage_transactions = StockTransaction.objects.filter(is_wastage=True)
         
-        # Sum of quantity * unit_price for all wastage transactions
+        # Sum of quantity * unit_price (stored as line_total) for all wastage transactions
         total_wastage_value = wastage_transactions.aggregate(
-            total=Sum(F('quantity') * F('unit_price'))
+            total=Sum('line_total')
         )['total'] or 0
         
         # Get total wastage quantity
@@ -74,56 +307,108 @@ class ProductViewSet(viewsets.ModelViewSet):
             'wastage_count': wastage_count
         })
 
-class SupplierViewSet(viewsets.ModelViewSet):
-    queryset = Supplier.objects.all()
-    serializer_class = SupplierSerializer
-    permission_classes = [IsAuthenticated, DjangoModelPermissions]
+def with_account_stats(queryset):
+    """
+    Annotate suppliers or clients with their transaction totals, computed in
+    one grouped query over the ledger join.
+    """
+    return queryset.annotate(
+        transaction_count=Count('transactions'),
+        total_quantity=Coalesce(Sum('transactions__quantity'), 0),
+        total_value=Coalesce(
+            Sum('transactions__line_total'),
+            Value(Decimal('0')),
+            output_field=DecimalField(max_digits=14, decimal_places=2)
+        ),
+        last_transaction_date=Max('transactions__date'),
+        product_count=Count('transactions__product', distinct=True),
+    )
+
+class AccountViewSetMixin:
+    """
+    Shared behaviour of the supplier and client viewsets.
+    
+    List and detail requests with ?stats=true include transaction totals and
+    can be ordered by them for leaderboards, e.g. ?stats=true&ordering=-total_value.
+    The transactions action is paginated when ?limit= is given.
+    """
+    stats_serializer_class = None
+    stats_ordering_fields = ('name', 'transaction_count', 'total_quantity', 'total_value',
+                             'last_transaction_date', 'product_count')
+    pagination_class = LimitOffsetPagination
+    
+    def wants_stats(self):
+        return self.action in ('list', 'retrieve') and stats_requested(self.request)
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.wants_stats():
+            queryset = with_account_stats(queryset)
+            ordering = self.request.query_params.get('ordering')
+            if ordering:
+                if ordering.lstrip('-') not in self.stats_ordering_fields:
+                    raise ValidationError({'ordering': f'Cannot order by {ordering}'})
+                queryset = queryset.order_by(ordering, 'id')
+        return queryset
+    
+    def get_serializer_class(self):
+        if self.wants_stats():
+            return self.stats_serializer_class
+        return super().get_serializer_class()
     
     @action(detail=True, methods=['get'])
     def transactions(self, request, pk=None):
-        supplier = self.get_object()
-        transactions = supplier.transactions.all()
+        account = self.get_object()
+        transactions = account.transactions.select_related('product', 'supplier_ref', 'client_ref')
+        page = self.paginate_queryset(transactions)
+        if page is not None:
+            serializer = StockTransactionSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         serializer = StockTransactionSerializer(transactions, many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def products(self, request, pk=None):
-        supplier = self.get_object()
-        # Get unique products from transactions
-        product_ids = supplier.transactions.values_list('product', flat=True).distinct()
-        products = Product.objects.filter(id__in=product_ids)
-        serializer = ProductSerializer(products, many=True)
+        """Products the account has moved; ?stats=true adds their lifetime totals."""
+        account = self.get_object()
+        # Get unique products from transactions in a single semi-join
+        products = Product.objects.select_related('type').annotate(pending_stock=counters.PENDING_STOCK).filter(
+            Exists(account.transactions.filter(product=OuterRef('pk')))
+        )
+        if stats_requested(request):
+            serializer = ProductStatsSerializer(with_product_stats(products), many=True)
+        else:
+            serializer = ProductSerializer(products, many=True)
         return Response(serializer.data)
 
-class ClientViewSet(viewsets.ModelViewSet):
+class SupplierViewSet(AccountViewSetMixin, viewsets.ModelViewSet):
+    queryset = Supplier.objects.all()
+    serializer_class = SupplierSerializer
+    stats_serializer_class = SupplierStatsSerializer
+    permission_classes = [IsAuthenticated, DjangoModelPermissions]
+
+class ClientViewSet(AccountViewSetMixin, viewsets.ModelViewSet):
     queryset = Client.objects.all()
     serializer_class = ClientSerializer
+    stats_serializer_class = ClientStatsSerializer
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
-    
-    @action(detail=True, methods=['get'])
-    def transactions(self, request, pk=None):
-        client = self.get_object()
-        transactions = client.transactions.all()
-        serializer = StockTransactionSerializer(transactions, many=True)
-        return Response(serializer.data)
-    
-    @action(detail=True, methods=['get'])
-    def products(self, request, pk=None):
-        client = self.get_object()
-        # Get unique products from transactions
-        product_ids = client.transactions.values_list('product', flat=True).distinct()
-        products = Product.objects.filter(id__in=product_ids)
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
 
 class StockHistoryViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = StockTransaction.objects.all().order_by('-date')
     serializer_class = StockTransactionSerializer
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [ColumnarRenderer]
+    
+    def list(self, request, *args, **kwargs):
+        # Rendered from values() rows, identical to the serializer output
+        queryset = self.filter_queryset(self.get_queryset())
+        if wants_columnar(request):
+            return columnar_response(TRANSACTION_ROWS, [queryset], requested_fields(request))
+        return Response(TRANSACTION_ROWS.render(queryset, requested_fields(request)))
     
     def retrieve(self, request, pk=None):
         try:
-            transaction = StockTransaction.objects.get(pk=pk)
+            transaction = StockTransaction.objects.select_related('product', 'supplier_ref', 'client_ref').get(pk=pk)
             serializer = self.get_serializer(transaction)
             
             # Add product name to response
@@ -145,6 +430,66 @@ class ProductTypeViewSet(viewsets.ModelViewSet):
     queryset = ProductType.objects.all()
     serializer_class = ProductTypeSerializer
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
+    
+    def perform_update(self, serializer):
+        renamed = serializer.instance.name != serializer.validated_data.get('name', serializer.instance.name)
+        product_type = serializer.save()
+        if renamed:
+            # Products show the type name, so they changed for sync clients
+            product_type.products.update(updated_at=timezone.now())
+    
+    def destroy(self, request, *args, **kwargs):
+        try:
+            return super().destroy(request, *args, **kwargs)
+        except ProtectedError:
+            return Response({'error': 'This product type is still used by products'}, status=400)
+
+class LotPagination(LimitOffsetPagination):
+    default_limit = 100
+    max_limit = 1000
+
+class LotViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = Lot.objects.select_related('product').order_by('id')
+    serializer_class = LotSerializer
+    permission_classes = [IsAuthenticated, DjangoModelPermissions]
+    pagination_class = LotPagination
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        product_id = self.request.query_params.get('product_id')
+        if product_id:
+            queryset = queryset.filter(product_id=product_id)
+        return queryset
+    
+    @action(detail=False, methods=['get'])
+    def expiring(self, request):
+        """
+        Lots with stock left that expire within the given number of days,
+        soonest first.
+        
+        Query params:
+        - within: Days ahead to look (default 30, max 3650)
+        - include_expired: Also list lots already past expiry (default true)
+        - product_id: Only lots of this product
+        - limit, offset: Page (default 100 lots, max 1000)
+        """
+        try:
+            within = int(request.query_params.get('within', 30))
+        except ValueError:
+            return Response({'error': 'within must be a number of days'}, status=400)
+        if not 0 <= within <= 3650:
+            return Response({'error': 'within must be between 0 and 3650 days'}, status=400)
+        
+        today = timezone.localdate()
+        include_expired = request.query_params.get('include_expired', 'true').lower() != 'false'
+        expiring = lots.expiring_lots(today + timedelta(days=within), since=None if include_expired else today)
+        product_id = request.query_params.get('product_id')
+        if product_id:
+            expiring = expiring.filter(product_id=product_id)
+        
+        page = self.paginate_queryset(expiring.select_related('product'))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 class StockUpdateView(APIView):
     permission_classes = [IsAuthenticated]
@@ -164,6 +509,9 @@ class StockUpdateView(APIView):
             client_contact = request.data.get('client_contact', '')
             is_wastage = request.data.get('is_wastage', False)
             wastage = request.data.get('wastage', 0)
+            # Lot of an IN movement, for per-batch expiry tracking
+            batch_number = request.data.get('batch_number')
+            expiry_date = request.data.get('expiry_date')
             
             # Get supplier or client references if IDs are provided
             supplier_ref = None
@@ -190,43 +538,95 @@ class StockUpdateView(APIView):
                 
             if transaction_type not in ['IN', 'OUT']:
                 return Response({'error': 'Invalid transaction type'}, status=400)
+            
+            if expiry_date:
+                try:
+                    expiry_date = datetime.strptime(expiry_date, '%Y-%m-%d').date()
+                except ValueError:
+                    return Response({'error': 'Invalid expiry_date format. Use YYYY-MM-DD'}, status=400)
                 
-            # Get product
-            try:
-                product = Product.objects.get(id=product_id)
-            except Product.DoesNotExist:
-                return Response({'error': 'Product not found'}, status=404)
-                
-            # For stock out, check if enough quantity is available
-            if transaction_type == 'OUT' and product.quantity < quantity:
-                return Response({'error': 'Insufficient stock'}, status=400)
+            with db_transaction.atomic():
+                allocations = []
+                # Fast-moving products take the movement on a counter slot
+                # when they can, leaving the product row unlocked
+                product = Product.objects.filter(id=product_id, sharded_stock=True).first()
+                took_slot = product is not None and counters.apply_movement(
+                    product, transaction_type, quantity, receives_lot=bool(batch_number or expiry_date))
+                if took_slot:
+                    # Never saved; the stock after this movement, for the
+                    # response and the event
+                    product.quantity = counters.stock_of(product)
+                else:
+                    # Get product, locking its row until the movement is recorded
+                    try:
+                        product = counters.lock_product(product_id)
+                    except Product.DoesNotExist:
+                        return Response({'error': 'Product not found'}, status=404)
+                    if product.sharded_stock:
+                        counters.fold(product)
+                        
+                    # For stock out, check if enough quantity is available
+                    if transaction_type == 'OUT' and product.quantity < quantity:
+                        # Undo the fold, which is only saved with the product
+                        db_transaction.set_rollback(True)
+                        return Response({'error': 'Insufficient stock'}, status=400)
+                    
+                    # Units in expired lots can't be sold; the product mirrors
+                    # its earliest lot, so only then are they counted
+                    today = timezone.localdate()
+                    if transaction_type == 'OUT' and product.expiry_date and product.expiry_date < today:
+                        expired = lots.expired_quantity(product, today)
+                        if product.quantity - expired < quantity:
+                            db_transaction.set_rollback(True)
+                            return Response({
+                                'error': f'Insufficient stock: {expired} units are in expired lots'
+                            }, status=400)
+                        
+                    # Update product quantity
+                    if transaction_type == 'IN':
+                        product.quantity += quantity
+                    else:
+                        product.quantity -= quantity
+                    
+                    # Receive a new lot, or draw the units from the lots that
+                    # expire first; the product shows the next lot to expire
+                    if transaction_type == 'IN' and (batch_number or expiry_date):
+                        lots.receive_lot(product, quantity, batch_number, expiry_date)
+                        lots.refresh_product_expiry(product)
+                    elif transaction_type == 'OUT':
+                        allocations = lots.allocate_fefo(product, quantity, today)
+                        if allocations:
+                            lots.refresh_product_expiry(product)
+                        
+                    product.save()
+                    if product.sharded_stock:
+                        counters.share_out(product)
                 
-            # Update product quantity
-            if transaction_type == 'IN':
-                product.quantity += quantity
-            else:
-                product.quantity -= quantity
+                # Create stock transaction record
+                transaction = StockTransaction.objects.create(
+                    product=product,
+                    quantity=quantity,
+                    type=transaction_type,
+                    notes=notes,
+                    reference_number=reference_number,
+                    unit_price=unit_price,
+                    discount=discount,
+                    supplier=supplier,
+                    supplier_contact=supplier_contact,
+                    client=client,
+                    client_contact=client_contact,
+                    supplier_ref=supplier_ref,
+                    client_ref=client_ref,
+                    is_wastage=is_wastage,
+                    wastage=wastage
+                )
+                # Only under the product lock; the stats of a sharded product
+                # catch up at compaction rather than contend on their row
+                if not took_slot:
+                    product_stats.record_movement(transaction)
                 
-            product.save()
-            
-            # Create stock transaction record
-            transaction = StockTransaction.objects.create(
-                product=product,
-                quantity=quantity,
-                type=transaction_type,
-                notes=notes,
-                reference_number=reference_number,
-                unit_price=unit_price,
-                discount=discount,
-                supplier=supplier,
-                supplier_contact=supplier_contact,
-                client=client,
-                client_contact=client_contact,
-                supplier_ref=supplier_ref,
-                client_ref=client_ref,
-                is_wastage=is_wastage,
-                wastage=wastage
-            )
+                # Notify open event streams once the movement is committed
+                db_transaction.on_commit(lambda: events.publish_transaction(transaction))
             
             # Return updated product info
             return Response({
@@ -236,11 +636,115 @@ class StockUpdateView(APIView):
                     'id': product.id,
                     'name': product.name,
                     'quantity': product.quantity
-                }
+                },
+                'lots': [
+                    {'id': lot.id, 'batch_number': lot.batch_number, 'expiry_date': lot.expiry_date, 'quantity': taken}
+                    for lot, taken in allocations
+                ]
             })
         except Exception as e:
             return Response({'error': str(e)}, status=500)
 
+# Server-sent events stream of stock changes (served through the ASGI app)
+class StockEventsView(View):
+    """
+    Stream new stock transactions as server-sent events.
+    
+    EventSource cannot set an Authorization header, so besides the session
+    and ``Authorization: Token <key>`` the stream can be opened with a
+    ``?ticket=`` from StockEventsTicketView. Reconnecting clients resume
+    from the ``Last-Event-ID`` header (or the ``last_event_id`` query param).
+    """
+    
+    async def get(self, request):
+        # Under WSGI the response is read to its end before it is sent, and
+        # the stream never ends
+        if not isinstance(request, ASGIRequest):
+            return JsonResponse({'error': 'Stock events are only served through the ASGI app'}, status=501)
+        
+        user = await self.authenticate(request)
+        if user is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+        
+        last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+        if last_event_id is not None:
+            try:
+                last_event_id = int(last_event_id)
+            except ValueError:
+                return JsonResponse({'error': 'Invalid Last-Event-ID'}, status=400)
+        
+        response = StreamingHttpResponse(
+            events.stock_event_stream(last_event_id),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    async def authenticate(self, request):
+        user = await request.auser()
+        if user.is_authenticated:
+            return user
+        
+        ticket = request.GET.get('ticket')
+        if ticket:
+            user_id = events.read_ticket(ticket)
+            if user_id is None:
+                return None
+            return await User.objects.filter(id=user_id, is_active=True).afirst()
+        
+        auth = get_authorization_header(request).split()
+        if not (auth and auth[0].lower() == b'token' and len(auth) == 2):
+            return None
+        token = await Token.objects.select_related('user').filter(key=auth[1].decode()).afirst()
+        if token is None or not token.user.is_active:
+            return None
+        return token.user
+
+# Short-lived ticket for opening the stock event stream from a browser
+class StockEventsTicketView(APIView):
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request):
+        return Response({
+            'ticket': events.issue_ticket(request.user),
+            'expires_in': events.ticket_max_age(),
+        })
+
+# Delta-sync view for clients that keep a local copy of the data
+class SyncView(APIView):
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        """
+        Return everything that changed since a watermark.
+        
+        Query params:
+        - since: watermark returned by the previous call (omit or 0 for a full sync)
+        
+        Products, suppliers and clients are returned when updated after the
+        watermark, transactions when their id is above it, and ids of deleted
+        rows under 'deleted'. When 'has_more' is true, call again with the new
+        watermark straight away.
+        """
+        try:
+            watermark = Watermark.parse(request.query_params.get('since'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        
+        changes = get_changes(watermark)
+        
+        return Response({
+            'watermark': str(changes['watermark']),
+            'has_more': changes['has_more'],
+            'products': ProductSerializer(changes['products'], many=True).data,
+            'suppliers': SupplierSerializer(changes['suppliers'], many=True).data,
+            'clients': ClientSerializer(changes['clients'], many=True).data,
+            'transactions': StockTransactionSerializer(changes['transactions'], many=True).data,
+            'deleted': changes['deleted'],
+        })
+
 # User permissions view
 class UserPermissionsView(APIView):
     permission_classes = [IsAuthenticated]
@@ -286,6 +790,7 @@ class ReportPermission(BasePermission):
 # Report view with custom permissions
 class ReportsView(APIView):
     permission_classes = [IsAuthenticated, ReportPermission]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [ColumnarRenderer]
     
     def get(self, request):
         """
@@ -300,79 +805,35 @@ class ReportsView(APIView):
         - client_id: Filter by client ID
         - product_type: Filter by product type
         - export: If present, format for export (CSV, PDF)
+        - format: 'columnar' streams the transactions as columns and rows
+          with repeated names dictionary-encoded
         """
         try:
-            # Get report parameters
-            report_type = request.query_params.get('report_type', 'all')
-            start_date_str = request.query_params.get('start_date')
-            end_date_str = request.query_params.get('end_date')
-            product_id = request.query_params.get('product_id')
-            supplier_id = request.query_params.get('supplier_id')
-            client_id = request.query_params.get('client_id')
-            product_type = request.query_params.get('product_type')
             export_format = request.query_params.get('export')
             
-            # Base queryset
-            queryset = StockTransaction.objects.all()
-            
-            # Apply report type filter
-            if report_type == 'sales':
-                queryset = queryset.filter(type='OUT')
-            elif report_type == 'purchases':
-                queryset = queryset.filter(type='IN')
-            
-            # Apply date filters if provided
-            if start_date_str:
-                try:
-                    start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-                    queryset = queryset.filter(date__gte=start_date)
-                except ValueError:
-                    return Response({"error": "Invalid start_date format. Use YYYY-MM-DD"}, status=400)
-            
-            if end_date_str:
-                try:
-                    end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-                    # Add one day to include the end date fully
-                    end_date = end_date + timedelta(days=1)
-                    queryset = queryset.filter(date__lt=end_date)
-                except ValueError:
-                    return Response({"error": "Invalid end_date format. Use YYYY-MM-DD"}, status=400)
+            try:
+                filters = ReportFilters.from_params(request.query_params)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=400)
             
-            # Apply product filter
-            if product_id:
-                queryset = queryset.filter(product_id=product_id)
+            queryset = filters.apply(StockTransaction.objects.all())
             
-            # Apply supplier filter
-            if supplier_id:
-                queryset = queryset.filter(
-                    Q(supplier_ref_id=supplier_id) | 
-                    (Q(supplier_ref__isnull=True) & Q(supplier__icontains=supplier_id))
-                )
-            
-            # Apply client filter
-            if client_id:
-                queryset = queryset.filter(
-                    Q(client_ref_id=client_id) | 
-                    (Q(client_ref__isnull=True) & Q(client__icontains=client_id))
-                )
+            # Generate report summary
+            summary = summarize(queryset)
+            ledgers = [queryset]
             
-            # Apply product type filter
-            if product_type and product_type != 'all':
-                queryset = queryset.filter(product__type=product_type)
+            # Only read the archive when the date range reaches into it
+            if filters.needs_archive():
+                archived = filters.apply(ArchivedStockTransaction.objects.all())
+                summary = combine_summaries(summary, summarize(archived))
+                # Archived rows are all older than the hot ones, so this keeps date order
+                ledgers.append(archived)
             
-            # Generate report summary
-            summary = {
-                'total_transactions': queryset.count(),
-                'total_quantity': queryset.aggregate(total=Sum('quantity'))['total'] or 0,
-                'total_value': queryset.aggregate(
-                    total=Sum(F('quantity') * F('unit_price'))
-                )['total'] or 0,
-                'total_discount': queryset.aggregate(total=Sum('discount'))['total'] or 0,
-                'total_wastage': queryset.aggregate(total=Sum('wastage'))['total'] or 0
-            }
+            if wants_columnar(request) and not export_format:
+                return columnar_response(TRANSACTION_ROWS, ledgers, head={'summary': summary})
             
-            # Serialize transaction data
-            serializer = StockTransactionSerializer(queryset, many=True)
+            # Serialize transaction data (values() rows, same output as StockTransactionSerializer)
+            data = [row for ledger in ledgers for row in TRANSACTION_ROWS.render(ledger)]
             
             # If export is requested, check permission and format accordingly
             if export_format:
@@ -383,14 +844,14 @@ class ReportsView(APIView):
                     return Response({
                         'export_format': 'csv',
                         'summary': summary,
-                        'data': serializer.data
+                        'data': data
                     })
                 elif export_format.lower() == 'pdf':
                     # In a real implementation, this would generate a PDF file
                     return Response({
                         'export_format': 'pdf',
                         'summary': summary,
-                        'data': serializer.data
+                        'data': data
                     })
                 else:
                     return Response({"error": f"Unsupported export format: {export_format}"}, status=400)
@@ -398,8 +859,239 @@ class ReportsView(APIView):
             # Return regular API response
             return Response({
                 'summary': summary,
-                'transactions': serializer.data
+                'transactions': data
             })
             
         except Exception as e:
             return Response({"error": str(e)}, status=500)
+
+# Time-bucketed report totals for charts
+class ReportTimeseriesView(APIView):
+    permission_classes = [IsAuthenticated, ReportPermission]
+    
+    # Upper bound on returned periods, so a daily series can't span centuries
+    max_periods = 5000
+    
+    def get(self, request):
+        """
+        Get IN/OUT totals per day, week or month.
+        
+        Query params: the ReportsView filters, plus
+        - interval: 'day' (default), 'week' or 'month'
+        
+        Periods without transactions are included with zero totals. Weeks
+        start on Monday; each period is labelled with its first day. Without
+        end_date the series runs to today.
+        """
+        interval = request.query_params.get('interval', 'day')
+        if interval not in INTERVALS:
+            return Response({"error": "Invalid interval. Use day, week or month"}, status=400)
+        
+        try:
+            filters = ReportFilters.from_params(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        
+        start = filters.start_date.date() if filters.start_date else None
+        # end_date is exclusive, so the last period holds the day before it
+        end = (filters.end_date - timedelta(days=1)).date() if filters.end_date else timezone.localdate()
+        # Checked before aggregating; without start_date the series starts
+        # at the first period with data, no earlier than the oldest transaction
+        first = start or first_ledger_day() or end
+        if (end - first).days > self.max_periods * {'day': 1, 'week': 7, 'month': 31}[interval]:
+            return Response({"error": "Date range too large for this interval"}, status=400)
+        
+        totals = timeseries_totals(filters.apply(StockTransaction.objects.all()), interval)
+        if filters.needs_archive():
+            archived = timeseries_totals(filters.apply(ArchivedStockTransaction.objects.all()), interval)
+            for period, period_totals in archived.items():
+                totals[period] = combine_summaries(totals.get(period, {}), period_totals)
+        
+        return Response({
+            'interval': interval,
+            'series': fill_timeseries(totals, interval, start, end)
+        })
+
+# Stock and value breakdown per product type
+class CategoryBreakdownView(APIView):
+    permission_classes = [IsAuthenticated, ReportPermission]
+    
+    def get(self, request):
+        return Response(cached('categories', category_breakdown))
+
+# ABC classification, turnover and days of cover per product
+class ProductAnalyticsView(APIView):
+    permission_classes = [IsAuthenticated, ReportPermission]
+    
+    def get(self, request):
+        """
+        Get per-product sales analytics.
+        
+        Query params:
+        - days: Length of the sales window in days (default 90)
+        - product_type: Filter by product type
+        - abc_class: Only return products of this class (A, B or C)
+        
+        Products are ordered by revenue, highest first.
+        """
+        try:
+            days = int(request.query_params.get('days', 90))
+        except ValueError:
+            return Response({"error": "days must be a whole number"}, status=400)
+        if not 1 <= days <= 3650:
+            return Response({"error": "days must be between 1 and 3650"}, status=400)
+        product_type = request.query_params.get('product_type')
+        if product_type == 'all':
+            product_type = None
+        
+        products = cached('products', lambda: product_analytics(days, product_type), days, product_type)
+        
+        summary = {abc_class: {'product_count': 0, 'revenue': 0} for abc_class in 'ABC'}
+        for product in products:
+            summary[product['abc_class']]['product_count'] += 1
+            summary[product['abc_class']]['revenue'] += product['revenue']
+        for totals in summary.values():
+            totals['revenue'] = round(totals['revenue'], 2)
+        
+        abc_class = request.query_params.get('abc_class')
+        if abc_class:
+            products = [product for product in products if product['abc_class'] == abc_class.upper()]
+        
+        return Response({
+            'days': days,
+            'summary': summary,
+            'products': sorted(products, key=lambda product: -product['revenue'])
+        })
+
+# Margin and profit report
+class ProfitReportView(APIView):
+    permission_classes = [IsAuthenticated, ReportPermission]
+    
+    default_limit = 100
+    max_limit = 1000
+    
+    def get(self, request):
+        """
+        Get revenue, cost of goods sold and gross profit of sales.
+        
+        Query params: the ReportsView filters (report_type is ignored), plus
+        - group_by: 'product' (default), 'type', 'client', 'day', 'week' or 'month'
+        - cost: 'buying' to cost sales at the product buying price (default),
+          'average' for the weighted average price paid on stock IN
+        - ordering: Total to order by, e.g. '-gross_profit' (default) or 'revenue'
+        - limit / offset: Paging over the groups (default limit 100, max 1000)
+        
+        Gross profit is revenue minus discount, wastage and cost of goods sold.
+        """
+        group_by = request.query_params.get('group_by', 'product')
+        if group_by not in PROFIT_GROUPS:
+            return Response({"error": f"Invalid group_by. Use one of: {', '.join(PROFIT_GROUPS)}"}, status=400)
+        cost_basis = request.query_params.get('cost', 'buying')
+        if cost_basis not in ('buying', 'average'):
+            return Response({"error": "Invalid cost. Use buying or average"}, status=400)
+        ordering = request.query_params.get('ordering', '-gross_profit')
+        if ordering.lstrip('-') not in PROFIT_TOTALS + PROFIT_GROUPS[group_by]:
+            return Response({"error": f"Cannot order by {ordering}"}, status=400)
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+            offset = int(request.query_params.get('offset', 0))
+        except ValueError:
+            return Response({"error": "limit and offset must be whole numbers"}, status=400)
+        if limit < 1 or offset < 0:
+            return Response({"error": "limit must be at least 1 and offset at least 0"}, status=400)
+        
+        try:
+            filters = ReportFilters.from_params(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        filters.report_type = 'sales'
+        
+        queryset = filters.apply(StockTransaction.objects.all())
+        totals = profit_totals(queryset, cost_basis)
+        
+        if filters.needs_archive():
+            archived = filters.apply(ArchivedStockTransaction.objects.all())
+            totals = combine_summaries(totals, profit_totals(archived, cost_basis))
+            rows = merge_profit_rows(
+                group_by,
+                profit_rows(queryset, group_by, cost_basis),
+                profit_rows(archived, group_by, cost_basis)
+            )
+            field = ordering.lstrip('-')
+            # By group first, so the stable sort breaks ties the way the
+            # database path does
+            rows.sort(key=lambda row: tuple((row[column] is None, row[column]) for column in PROFIT_GROUPS[group_by]))
+            rows.sort(key=lambda row: (row[field] is None, row[field]), reverse=ordering.startswith('-'))
+            count = len(rows)
+            page = rows[offset:offset + limit]
+        else:
+            # Group, order and page in the database; the group columns break
+            # ties, so equal totals page the same way every time
+            rows = profit_rows(queryset, group_by, cost_basis).order_by(ordering, *PROFIT_GROUPS[group_by])
+            count = rows.count()
+            page = list(rows[offset:offset + limit])
+        
+        return Response({
+            'group_by': group_by,
+            'cost': cost_basis,
+            'totals': add_margin(totals),
+            'count': count,
+            'results': [add_margin(row) for row in page]
+        })
+
+
+class ExportPermission(BasePermission):
+    def has_permission(self, request, view):
+        return request.user.has_perm('inventory.export_reports')
+
+# Parquet / Arrow IPC export of the ledger for BI tools
+class LedgerExportView(APIView):
+    permission_classes = [IsAuthenticated, ExportPermission]
+    
+    def get(self, request):
+        """
+        Stream stock transactions or a product snapshot as a file.
+        
+        Query params:
+        - dataset: 'transactions' (default) or 'products'
+        - file_format: 'parquet' (default) or 'arrow' (Arrow IPC file)
+        - start_date / end_date: YYYY-MM-DD, limits the transactions exported
+        - after_id: Only transactions with a higher id, for incremental exports
+        
+        The X-Export-Watermark header carries the last transaction id
+        exported, to pass as after_id next time.
+        """
+        dataset = request.query_params.get('dataset', 'transactions')
+        if dataset not in ('transactions', 'products'):
+            return Response({"error": "Invalid dataset. Use transactions or products"}, status=400)
+        file_format = request.query_params.get('file_format', 'parquet')
+        if file_format not in export.FORMATS:
+            return Response({"error": f"Invalid file_format. Use one of: {', '.join(export.FORMATS)}"}, status=400)
+        after_id = request.query_params.get('after_id')
+        if after_id is not None and not after_id.isdigit():
+            return Response({"error": "after_id must be a whole number"}, status=400)
+        try:
+            filters = ReportFilters.from_params(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        try:
+            export.load_pyarrow()
+        except export.ExportUnavailable as e:
+            return Response({"error": str(e)}, status=503)
+        
+        ledger_export = export.LedgerExport(
+            dataset, filters.start_date, filters.end_date, int(after_id) if after_id is not None else None
+        )
+        content_type = 'application/vnd.apache.parquet' if file_format == 'parquet' else 'application/vnd.apache.arrow.file'
+        response = StreamingHttpResponse(export.stream_export(ledger_export, file_format), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{export.export_filename(ledger_export, file_format)}"'
+        if ledger_export.watermark is not None:
+            response['X-Export-Watermark'] = str(ledger_export.watermark)
+        return response
+
+# Request metrics for Prometheus (scrape with an "Authorization: Token <key>" header)
+class MetricsView(APIView):
+    permission_classes = [IsAuthenticated, IsAdminUser]
+    
+    def get(self, request):
+        return HttpResponse(metrics.exposition(), content_type=CONTENT_TYPE_LATEST)